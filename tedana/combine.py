@@ -3,7 +3,9 @@ Functions to optimally combine data across echoes.
 """
 import logging
 import numpy as np
-from tedana.utils import unmask
+from nilearn._utils import check_niimg
+from tedana import io
+from tedana.utils import MaskedData, apply_mask, memory_chunk_size, unmask
 from tedana.due import due, Doi
 
 LGR = logging.getLogger(__name__)
@@ -11,10 +13,55 @@ RepLGR = logging.getLogger('REPORT')
 RefLGR = logging.getLogger('REFERENCES')
 
 
+def _weighted_average(data, alpha, keep_dtype=False):
+    """
+    Average data across echoes with voxel- or voxel- and volume-wise weights.
+
+    Parameters
+    ----------
+    data : (M x E x T) array_like
+        Masked data.
+    alpha : (M [x T] x E) :obj:`numpy.ndarray`
+        Unnormalized, non-negative weights. Weights that are zero for every
+        echo are set to one in place.
+    keep_dtype : :obj:`bool`, optional
+        Whether to combine floating-point `data` in its own precision (e.g.,
+        float32) instead of float64. Default is False.
+
+    Returns
+    -------
+    combined : (M x T) :obj:`numpy.ndarray`
+        Weighted average of `data` across echoes.
+    """
+    if keep_dtype and np.issubdtype(data.dtype, np.floating):
+        dtype = data.dtype
+    else:
+        dtype = np.float64
+    alpha = alpha.astype(dtype, copy=False)
+
+    # If all values across echos are 0, set to 1 to avoid
+    # divide-by-zero errors
+    scale = alpha.sum(axis=-1)
+    all_zero = scale == 0
+    if np.any(all_zero):
+        alpha[all_zero] = 1.
+        scale[all_zero] = alpha.shape[-1]
+
+    # contract the weights against the data over echoes, rather than
+    # broadcasting voxel-wise weights to the size of the data, and normalize
+    # the (M x T) result instead of the weights
+    subscripts = 'me,met->mt' if alpha.ndim == 2 else 'mte,met->mt'
+    combined = np.einsum(subscripts, alpha, data, dtype=dtype)
+    if scale.ndim == 1:
+        scale = scale[:, np.newaxis]
+    combined /= scale
+    return combined
+
+
 @due.dcite(Doi('10.1002/(SICI)1522-2594(199907)42:1<87::AID-MRM13>3.0.CO;2-O'),
            description='T2* method of combining data across echoes using '
                        'monoexponential equation.')
-def _combine_t2s(data, tes, ft2s):
+def _combine_t2s(data, tes, ft2s, keep_dtype=False, report=True):
     """
     Combine data across echoes using weighted averaging according to voxel-
     (and sometimes volume-) wise estimates of T2*.
@@ -27,12 +74,28 @@ def _combine_t2s(data, tes, ft2s):
         Echo times in milliseconds.
     ft2s : (M [x T] X 1) array_like
         Either voxel-wise or voxel- and volume-wise estimates of T2*.
+    keep_dtype : :obj:`bool`, optional
+        Whether to combine floating-point `data` in its own precision.
+        Default is False.
+    report : :obj:`bool`, optional
+        Whether to log the method to the report. Default is True.
 
     Returns
     -------
     combined : (M x T) :obj:`numpy.ndarray`
         Data combined across echoes according to T2* estimates.
     """
+    if report:
+        _report_t2s()
+    # alpha is (S, E) for voxel-wise T2 estimates and (S, T, E) for voxel-
+    # and volume-wise T2 estimates
+    alpha = tes * np.exp(-tes / ft2s)
+    combined = _weighted_average(data, alpha, keep_dtype=keep_dtype)
+    return combined
+
+
+def _report_t2s():
+    """Log the T2* combination method to the report."""
     RepLGR.info("Multi-echo data were then optimally combined using the "
                 "T2* combination method (Posse et al., 1999).")
     RefLGR.info("Posse, S., Wiese, S., Gembris, D., Mathiak, K., Kessler, "
@@ -41,28 +104,12 @@ def _combine_t2s(data, tes, ft2s):
                 "multi‐echo functional MR imaging. Magnetic Resonance in "
                 "Medicine: An Official Journal of the International Society "
                 "for Magnetic Resonance in Medicine, 42(1), 87-97.")
-    n_vols = data.shape[-1]
-    alpha = tes * np.exp(-tes / ft2s)
-    if alpha.ndim == 2:
-        # Voxel-wise T2 estimates
-        alpha = np.tile(alpha[:, :, np.newaxis], (1, 1, n_vols))
-    elif alpha.ndim == 3:
-        # Voxel- and volume-wise T2 estimates
-        # alpha is currently (S, T, E) but should be (S, E, T) like mdata
-        alpha = np.swapaxes(alpha, 1, 2)
-
-        # If all values across echos are 0, set to 1 to avoid
-        # divide-by-zero errors
-        ax0_idx, ax2_idx = np.where(np.all(alpha == 0, axis=1))
-        alpha[ax0_idx, :, ax2_idx] = 1.
-    combined = np.average(data, axis=1, weights=alpha)
-    return combined
 
 
 @due.dcite(Doi('10.1002/mrm.20900'),
            description='PAID method of combining data across echoes using just '
                        'SNR/signal and TE.')
-def _combine_paid(data, tes):
+def _combine_paid(data, tes, keep_dtype=False, report=True, echo_means=None):
     """
     Combine data across echoes using SNR/signal and TE via the
     parallel-acquired inhomogeneity desensitized (PAID) ME-fMRI combination
@@ -74,12 +121,31 @@ def _combine_paid(data, tes):
         Masked data.
     tes : (1 x E) array_like
         Echo times in milliseconds.
+    keep_dtype : :obj:`bool`, optional
+        Whether to combine floating-point `data` in its own precision.
+        Default is False.
+    report : :obj:`bool`, optional
+        Whether to log the method to the report. Default is True.
+    echo_means : (M x E) array_like or None, optional
+        Temporal mean of each echo, if `data` only holds some of the volumes.
+        Default is None (computed from `data`).
 
     Returns
     -------
     combined : (M x T) :obj:`numpy.ndarray`
         Data combined across echoes according to SNR/signal.
     """
+    if report:
+        _report_paid()
+    if echo_means is None:
+        echo_means = data.mean(axis=-1)
+    alpha = echo_means * tes
+    combined = _weighted_average(data, alpha, keep_dtype=keep_dtype)
+    return combined
+
+
+def _report_paid():
+    """Log the PAID combination method to the report."""
     RepLGR.info("Multi-echo data were then optimally combined using the "
                 "parallel-acquired inhomogeneity desensitized (PAID) "
                 "combination method.")
@@ -90,20 +156,28 @@ def _combine_paid(data, tes):
                 "Magnetic Resonance in Medicine: An Official Journal of the "
                 "International Society for Magnetic Resonance in Medicine, "
                 "55(6), 1227-1235.")
-    n_vols = data.shape[-1]
-    alpha = data.mean(axis=-1) * tes
-    alpha = np.tile(alpha[:, :, np.newaxis], (1, 1, n_vols))
-    combined = np.average(data, axis=1, weights=alpha)
-    return combined
 
 
-def make_optcom(data, tes, mask, t2s=None, combmode='t2s', verbose=True):
+def _check_combmode(combmode, t2s):
+    """Check that `t2s` is provided when (and only when) `combmode` uses it."""
+    if combmode not in ['t2s', 'paid']:
+        raise ValueError("Argument 'combmode' must be either 't2s' or 'paid'")
+    elif combmode == 't2s' and t2s is None:
+        raise ValueError("Argument 't2s' must be supplied if 'combmode' is "
+                         "set to 't2s'.")
+    elif combmode == 'paid' and t2s is not None:
+        LGR.warning("Argument 't2s' is not required if 'combmode' is 'paid'. "
+                    "'t2s' array will not be used.")
+
+
+def make_optcom(data, tes, mask, t2s=None, combmode='t2s', verbose=True,
+                keep_dtype=False):
     """
     Optimally combine BOLD data across TEs.
 
     Parameters
     ----------
-    data : (S x E x T) :obj:`numpy.ndarray`
+    data : (S x E x T) :obj:`numpy.ndarray` or :obj:`tedana.utils.MaskedData`
         Concatenated BOLD data.
     tes : (E,) :obj:`numpy.ndarray`
         Array of TEs, in seconds.
@@ -117,11 +191,14 @@ def make_optcom(data, tes, mask, t2s=None, combmode='t2s', verbose=True):
         is not required. Default is 't2s'.
     verbose : :obj:`bool`, optional
         Whether to print status updates. Default is True.
+    keep_dtype : :obj:`bool`, optional
+        Whether to combine floating-point `data` (e.g., float32) in its own
+        precision, rather than upcasting to float64. Default is False.
 
     Returns
     -------
-    combined : (S x T) :obj:`numpy.ndarray`
-        Optimally combined data.
+    combined : (S x T) :obj:`numpy.ndarray` or :obj:`tedana.utils.MaskedData`
+        Optimally combined data. Masked with `mask` if `data` is masked.
 
     Notes
     -----
@@ -149,22 +226,17 @@ def make_optcom(data, tes, mask, t2s=None, combmode='t2s', verbose=True):
                          'voxels/samples: {0} != {1}'.format(mask.shape[0],
                                                              data.shape[0]))
 
-    if combmode not in ['t2s', 'paid']:
-        raise ValueError("Argument 'combmode' must be either 't2s' or 'paid'")
-    elif combmode == 't2s' and t2s is None:
-        raise ValueError("Argument 't2s' must be supplied if 'combmode' is "
-                         "set to 't2s'.")
-    elif combmode == 'paid' and t2s is not None:
-        LGR.warning("Argument 't2s' is not required if 'combmode' is 'paid'. "
-                    "'t2s' array will not be used.")
+    _check_combmode(combmode, t2s)
 
-    data = data[mask, :, :]  # mask out empty voxels/samples
+    masked = isinstance(data, MaskedData)
+    ref_img = data.ref_img if masked else None
+    data = apply_mask(data, mask)  # mask out empty voxels/samples
     tes = np.array(tes)[np.newaxis, ...]  # (1 x E) array_like
 
     if combmode == 'paid':
         LGR.info('Optimally combining data with parallel-acquired inhomogeneity '
                  'desensitized (PAID) method')
-        combined = _combine_paid(data, tes)
+        combined = _combine_paid(data, tes, keep_dtype=keep_dtype)
     else:
         if t2s.ndim == 1:
             msg = 'Optimally combining data with voxel-wise T2 estimates'
@@ -174,7 +246,98 @@ def make_optcom(data, tes, mask, t2s=None, combmode='t2s', verbose=True):
         t2s = t2s[mask, ..., np.newaxis]  # mask out empty voxels/samples
 
         LGR.info(msg)
-        combined = _combine_t2s(data, tes, t2s)
+        combined = _combine_t2s(data, tes, t2s, keep_dtype=keep_dtype)
 
+    if masked:
+        return MaskedData(combined, mask, ref_img=ref_img)
     combined = unmask(combined, mask)
     return combined
+
+
+def write_optcom(data, tes, mask, filename, ref_img, t2s=None, combmode='t2s',
+                 max_memory=None):
+    """
+    Optimally combine BOLD data across TEs, reading the echo images and
+    writing the combined image in blocks of volumes.
+
+    The full multi-echo data and the combined time series are never held in
+    memory at once.
+
+    Parameters
+    ----------
+    data : :obj:`list` of img_like
+        Multi-echo data files, as accepted by :func:`tedana.io.load_data`.
+    tes : (E,) :obj:`numpy.ndarray`
+        Array of TEs, in seconds.
+    mask : (S,) :obj:`numpy.ndarray`
+        Brain mask in 3D array.
+    filename : :obj:`str`
+        Filepath where the combined data should be saved to.
+    ref_img : :obj:`str` or img_like
+        Reference image to dictate how the output is saved to disk.
+    t2s : (S [x T]) :obj:`numpy.ndarray` or None, optional
+        Estimated T2* values. Only required if combmode = 't2s'.
+        Default is None.
+    combmode : {'t2s', 'paid'}, optional
+        How to combine data. Either 'paid' or 't2s'. If 'paid', argument 't2s'
+        is not required, and the data are read twice. Default is 't2s'.
+    max_memory : :obj:`float` or None, optional
+        Approximate memory budget, in gigabytes, for each block of volumes.
+        Default is None (all volumes at once).
+
+    Returns
+    -------
+    name : :obj:`str`
+        Path of saved image (with added extensions, as appropriate)
+
+    Notes
+    -----
+    NaNs in the combined data are replaced by zero as they are written.
+    """
+    _check_combmode(combmode, t2s)
+    if isinstance(data, str):
+        data = [data]
+    if mask.ndim != 1:
+        raise ValueError('Mask is not 1D')
+
+    n_echos = len(tes)
+    n_samp = mask.shape[0]
+    n_vols = check_niimg(data[0]).shape[3]
+    tes = np.array(tes)[np.newaxis, ...]  # (1 x E) array_like
+
+    # the block, its masked copy and the combined volumes, in float64
+    block_size = n_vols
+    if max_memory is not None:
+        vol_nbytes = n_samp * (2 * n_echos + 1) * 8
+        block_size = min(memory_chunk_size(vol_nbytes, max_memory), n_vols)
+    LGR.info('Optimally combining data in blocks of {} '
+             'volumes'.format(block_size))
+
+    echo_means = None
+    if combmode == 'paid':
+        _report_paid()
+        echo_means = np.zeros((int(mask.sum()), n_echos))
+        for block in io.load_data_blocks(data, n_echos=n_echos,
+                                         block_size=block_size):
+            echo_means += block[mask].sum(axis=-1)
+        echo_means /= n_vols
+    else:
+        _report_t2s()
+        t2s = t2s[mask, ..., np.newaxis]  # mask out empty voxels/samples
+
+    def _combined_blocks():
+        blocks = io.load_data_blocks(data, n_echos=n_echos,
+                                     block_size=block_size)
+        for start, block in zip(range(0, n_vols, block_size), blocks):
+            block = block[mask]
+            if combmode == 'paid':
+                combined = _combine_paid(block, tes, report=False,
+                                         echo_means=echo_means)
+            else:
+                block_t2s = t2s
+                if t2s.ndim == 3:
+                    block_t2s = t2s[:, start:start + block.shape[-1]]
+                combined = _combine_t2s(block, tes, block_t2s, report=False)
+            yield np.nan_to_num(unmask(combined, mask), copy=False)
+
+    return io.filewrite_blocks(_combined_blocks(), filename, ref_img, n_vols)
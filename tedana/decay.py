@@ -2,7 +2,8 @@
 Functions to estimate S0 and T2* from multi-echo data.
 """
 import logging
-import scipy
+import multiprocessing
+
 import numpy as np
 from tedana import utils
 
@@ -10,6 +11,9 @@ LGR = logging.getLogger(__name__)
 RepLGR = logging.getLogger('REPORT')
 RefLGR = logging.getLogger('REFERENCES')
 
+# per-process view of the array shared with the worker pool
+_SHARED = {}
+
 
 def mono_exp(tes, s0, t2star):
     """
@@ -28,15 +32,514 @@ def mono_exp(tes, s0, t2star):
     return s0 * np.exp(-tes / t2star)
 
 
-def fit_decay(data, tes, mask, masksum, fittype):
+def _loglin_design(tes):
+    """
+    Closed-form pseudo-inverse of the log-linear monoexponential design
+
+    Parameters
+    ----------
+    tes : (E,) array_like
+        Echo times
+
+    Returns
+    -------
+    pinv : (2 x E) :obj:`numpy.ndarray`
+        Solution of the 2x2 normal equations for the design
+        ``[1, -TE]``. Multiplying log signal by this array gives the
+        intercept (log S0) and slope (R2*) of the fit.
+    """
+    tes = np.asarray(tes, dtype=float)
+    n_echos = tes.size
+    sum_te = tes.sum()
+    sum_te2 = (tes ** 2).sum()
+    det = n_echos * sum_te2 - sum_te ** 2
+    return np.vstack([(sum_te2 - sum_te * tes) / det,
+                      (sum_te - n_echos * tes) / det])
+
+
+def _fit_loglin(log_data, tes):
+    """
+    Log-linear fit of monoexponential decay from per-echo log signal
+
+    Because the design matrix of the log-linear model is the same for every
+    volume, the least-squares fit to the full (E*T) log time series is
+    identical to the fit to the per-echo temporal means of the log signal.
+
+    Parameters
+    ----------
+    log_data : (M x E [x T]) array_like
+        ``log(abs(data) + 1)`` for each sample and echo, or its temporal mean
+    tes : (E,) array_like
+        Echo times
+
+    Returns
+    -------
+    t2s : (M [x T]) :obj:`numpy.ndarray`
+        T2* estimates
+    s0 : (M [x T]) :obj:`numpy.ndarray`
+        S0 estimates
+    """
+    betas = np.tensordot(_loglin_design(tes), log_data, axes=(1, 1))
+    t2s = 1. / betas[1]
+    s0 = np.exp(betas[0])
+    return t2s, s0
+
+
+def _monoexp_jacobian(tes, s0, t2s):
+    """
+    Analytic Jacobian of :func:`mono_exp` with respect to S0 and T2*
+
+    Parameters
+    ----------
+    tes : (E,) array_like
+        Echo times
+    s0, t2s : (M x 1) array_like
+        S0 and T2* values at which to evaluate the Jacobian
+
+    Returns
+    -------
+    jac_s0, jac_t2s : (M x E) :obj:`numpy.ndarray`
+        Derivatives of the modeled signal at each echo with respect to S0
+        and T2*
+    """
+    jac_s0 = np.exp(-tes / t2s)
+    jac_t2s = s0 * jac_s0 * tes / t2s ** 2
+    return jac_s0, jac_t2s
+
+
+def _fit_error(means, sq_means, pred, jtj, n_vols):
+    """
+    Parameter standard errors and R-squared of a two-parameter fit to echoes
+
+    The fit statistics of the full (E*T) time series are derived from the
+    per-echo temporal means and mean squares, so no second pass over the
+    data is needed.
+
+    Parameters
+    ----------
+    means : (M x E) array_like
+        Temporal mean of the fitted signal for each sample and echo
+    sq_means : (M x E) array_like
+        Temporal mean of the squared fitted signal for each sample and echo
+    pred : (M x E) array_like
+        Model prediction for each sample and echo
+    jtj : (3 [x M]) array_like
+        Entries (0, 0), (0, 1) and (1, 1) of the normal matrix (the design or
+        Jacobian's cross-product) for a single volume
+    n_vols : :obj:`int`
+        Number of volumes the means were computed over
+
+    Returns
+    -------
+    se : (2 x M) :obj:`numpy.ndarray`
+        Standard errors of the two parameters
+    rsq : (M,) :obj:`numpy.ndarray`
+        Coefficient of determination of the fit
+    """
+    n_echos = means.shape[1]
+    sse = n_vols * ((sq_means - means ** 2).sum(axis=1) +
+                    ((means - pred) ** 2).sum(axis=1))
+    sst = n_vols * (sq_means.sum(axis=1) - n_echos * means.mean(axis=1) ** 2)
+    with np.errstate(all='ignore'):
+        sigma2 = np.maximum(sse, 0) / (n_echos * n_vols - 2)
+        det = jtj[0] * jtj[2] - jtj[1] ** 2
+        se = np.sqrt(np.vstack([sigma2 * jtj[2], sigma2 * jtj[0]]) /
+                     (det * n_vols))
+        rsq = 1 - sse / sst
+    return se, rsq
+
+
+def _fit_monoexp(data_means, tes, s0, t2s, max_iter=100, tol=1.5e-8):
+    """
+    Batched Levenberg-Marquardt fit of the monoexponential decay model
+
+    Because the echo times are the same for every volume, the sum of squared
+    errors of the model over the full (E*T) time series only differs by a
+    constant from the one over the per-echo temporal means, so all samples
+    are fit at once on the (M x E) means.
+
+    Parameters
+    ----------
+    data_means : (M x E) array_like
+        Temporal mean of the signal for each sample and echo
+    tes : (E,) array_like
+        Echo times
+    s0, t2s : (M,) array_like
+        Initial S0 and T2* estimates (e.g., from a log-linear fit)
+    max_iter : :obj:`int`, optional
+        Maximum number of damped Gauss-Newton iterations. Default is 100.
+    tol : :obj:`float`, optional
+        Relative tolerance on the reduction of the cost and on the size of
+        the parameter update used to declare convergence. Default is 1.5e-8.
+
+    Returns
+    -------
+    s0, t2s : (M,) :obj:`numpy.ndarray`
+        Fitted S0 and T2* estimates. Samples for which the fit failed keep
+        their initial estimates.
+    failed : (M,) :obj:`numpy.ndarray`
+        Boolean array of samples for which the fit did not converge
+    """
+    tes = np.asarray(tes, dtype=float)
+    s0 = np.array(s0, dtype=float)
+    t2s = np.array(t2s, dtype=float)
+    s0_init, t2s_init = s0.copy(), t2s.copy()
+    damping = np.full(s0.shape, 1e-3)
+
+    failed = ~(np.isfinite(s0) & np.isfinite(t2s) & (t2s != 0))
+    active = np.where(~failed)[0]
+    with np.errstate(all='ignore'):
+        for _ in range(max_iter):
+            if not active.size:
+                break
+            y = data_means[active]
+            act_s0, act_t2s = s0[active, np.newaxis], t2s[active, np.newaxis]
+
+            jac_s0, jac_t2s = _monoexp_jacobian(tes, act_s0, act_t2s)
+            resid = y - act_s0 * jac_s0
+            cost = (resid ** 2).sum(axis=1)
+
+            # solve the damped 2x2 normal equations in closed form
+            jtj_00 = (jac_s0 ** 2).sum(axis=1)
+            jtj_01 = (jac_s0 * jac_t2s).sum(axis=1)
+            jtj_11 = (jac_t2s ** 2).sum(axis=1)
+            grad_0 = (jac_s0 * resid).sum(axis=1)
+            grad_1 = (jac_t2s * resid).sum(axis=1)
+            a_00 = jtj_00 * (1 + damping[active])
+            a_11 = jtj_11 * (1 + damping[active])
+            det = a_00 * a_11 - jtj_01 ** 2
+            step_s0 = (a_11 * grad_0 - jtj_01 * grad_1) / det
+            step_t2s = (a_00 * grad_1 - jtj_01 * grad_0) / det
+
+            new_s0 = act_s0[:, 0] + step_s0
+            new_t2s = act_t2s[:, 0] + step_t2s
+            new_cost = ((y - mono_exp(tes, new_s0[:, np.newaxis],
+                                      new_t2s[:, np.newaxis])) ** 2).sum(axis=1)
+
+            improved = np.isfinite(new_cost) & (new_cost < cost)
+            s0[active[improved]] = new_s0[improved]
+            t2s[active[improved]] = new_t2s[improved]
+            damping[active] = np.where(improved, damping[active] / 10.,
+                                       damping[active] * 10.)
+
+            small_step = (np.sqrt(step_s0 ** 2 + step_t2s ** 2) <=
+                          tol * (np.sqrt(new_s0 ** 2 + new_t2s ** 2) + tol))
+            converged = ((cost == 0) | small_step |
+                         (improved & ((cost - new_cost) <= tol * cost)))
+            active = active[~converged]
+
+    # samples that did not converge fall back to their initial estimates
+    failed[active] = True
+    failed |= ~(np.isfinite(s0) & np.isfinite(t2s))
+    s0[failed] = s0_init[failed]
+    t2s[failed] = t2s_init[failed]
+    return s0, t2s, failed
+
+
+def _init_worker(shared):
+    """
+    Attach a worker process to the signal means shared with the pool
+    """
+    _SHARED['data_means'] = np.frombuffer(shared)
+
+
+def _fit_monoexp_chunk(args):
+    """
+    Run :func:`_fit_monoexp` on a contiguous chunk of the shared signal means
+    """
+    start, stop, shape, tes, s0, t2s = args
+    data_means = _SHARED['data_means'][:shape[0] * shape[1]].reshape(shape)
+    return _fit_monoexp(data_means[start:stop], tes, s0, t2s)
+
+
+class _MonoexpPool(object):
+    """
+    Worker processes for :func:`_fit_monoexp`, started once per decay fit
+
+    The pool is reused for every number of echoes and chunk of samples that
+    is fit. The signal means of each fit are copied into memory shared with
+    the workers, which read their chunk of samples from it directly, so only
+    the chunk bounds and initial estimates are sent with each task. Results
+    are identical to the serial fit. With one job, no processes are started
+    and samples are fit serially.
+
+    Parameters
+    ----------
+    n_jobs : :obj:`int`
+        Number of worker processes, as returned by
+        :func:`tedana.utils.check_n_jobs`
+    size : :obj:`int`
+        Largest number of signal means (samples times echoes) fit at once
+    """
+    def __init__(self, n_jobs, size):
+        self.n_jobs = n_jobs
+        self.size = size
+        self.pool = None
+        if n_jobs > 1:
+            self.shared = multiprocessing.RawArray('d', max(size, 1))
+            self.pool = utils.worker_pool(n_jobs, initializer=_init_worker,
+                                          initargs=(self.shared,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def fit(self, data_means, tes, s0, t2s):
+        """
+        Split samples into chunks and run :func:`_fit_monoexp` on the workers
+
+        Parameters
+        ----------
+        data_means : (M x E) array_like
+            Temporal mean of the signal for each sample and echo, with at
+            most `size` values
+        tes : (E,) array_like
+            Echo times
+        s0, t2s : (M,) array_like
+            Initial S0 and T2* estimates
+
+        Returns
+        -------
+        s0, t2s, failed : (M,) :obj:`numpy.ndarray`
+            See :func:`_fit_monoexp`
+        """
+        if self.pool is None:
+            return _fit_monoexp(data_means, tes, s0, t2s)
+
+        data_means = np.asarray(data_means)
+        if data_means.size > self.size:
+            raise ValueError('Cannot fit {0} signal means with a pool sized for '
+                             '{1}'.format(data_means.size, self.size))
+        shape = data_means.shape
+        np.frombuffer(self.shared, count=data_means.size).reshape(shape)[:] = data_means
+        bounds = np.unique(np.linspace(0, shape[0], self.n_jobs + 1).astype(int))
+        tasks = [(start, stop, shape, tes, s0[start:stop], t2s[start:stop])
+                 for start, stop in zip(bounds[:-1], bounds[1:])]
+        results = self.pool.map(_fit_monoexp_chunk, tasks)
+        s0, t2s, failed = [np.concatenate(res) for res in zip(*results)]
+        return s0, t2s, failed
+
+
+def _fit_echoes(log_data, data, tes, fittype, pool=None, sq_means=None,
+                n_vols=1):
+    """
+    Fit monoexponential decay using all echoes in `log_data`
+
+    Parameters
+    ----------
+    log_data : (M x E [x T]) array_like
+        ``log(abs(data) + 1)`` for each sample and echo, or its temporal mean
+    data : (M x E [x T]) array_like or None
+        Signal (or its temporal mean) matching `log_data`. Only used if
+        `fittype` is 'curvefit'.
+    tes : (E,) array_like
+        Echo times
+    fittype : {loglin, curvefit}
+        The type of model fit to use
+    pool : :obj:`_MonoexpPool` or None, optional
+        Worker processes for the 'curvefit' fit. If None (default), samples
+        are fit serially.
+    sq_means : (M x E) array_like or None, optional
+        Temporal mean of the squared log signal (for 'loglin') or squared
+        signal (for 'curvefit'), in which case `log_data` and `data` must be
+        temporal means as well. If provided, the standard errors and
+        R-squared of the fit are also returned. Default is None.
+    n_vols : :obj:`int`, optional
+        Number of volumes the means were computed over. Default is 1.
+
+    Returns
+    -------
+    t2s, s0 : (M [x T]) :obj:`numpy.ndarray`
+        T2* and S0 estimates, with infinite and negative T2* and NaN S0
+        values replaced
+    t2s_se, s0_se, rsq : (M,) :obj:`numpy.ndarray`
+        Standard errors of T2* and S0 and R-squared of the fit, with
+        non-finite values replaced by 0. Only returned if `sq_means` is
+        provided.
+    """
+    # perform log linear fit of echo times against MR signal
+    t2s, s0 = _fit_loglin(log_data, tes)
+
+    if fittype == 'curvefit':
+        # perform a monoexponential fit of echo times against MR signal
+        # using loglin estimates as initial starting points for fit
+        echo_data = np.moveaxis(data, 1, -1).reshape(-1, len(tes))
+        fit = _fit_monoexp if pool is None else pool.fit
+        s0_fit, t2s_fit, failed = fit(echo_data, tes, s0.ravel(), t2s.ravel())
+        s0, t2s = s0_fit.reshape(s0.shape), t2s_fit.reshape(t2s.shape)
+        fail_count = failed.sum()
+        if fail_count:
+            fail_percent = 100 * fail_count / t2s.size
+            LGR.debug('With {0} echoes, monoexponential fit failed on {1} ({2:.2f}%) voxel(s),'
+                      ' used log linear estimate instead'.format(len(tes), fail_count,
+                                                                 fail_percent))
+
+    if sq_means is not None:
+        # uncertainty from the same normal matrix used for the fit
+        if fittype == 'curvefit':
+            jac_s0, jac_t2s = _monoexp_jacobian(tes, s0[:, np.newaxis],
+                                                t2s[:, np.newaxis])
+            jtj = [(jac_s0 ** 2).sum(axis=1), (jac_s0 * jac_t2s).sum(axis=1),
+                   (jac_t2s ** 2).sum(axis=1)]
+            (s0_se, t2s_se), rsq = _fit_error(data, sq_means,
+                                              s0[:, np.newaxis] * jac_s0, jtj,
+                                              n_vols)
+        else:
+            # the log-linear parameters are log(S0) and R2*
+            jtj = [len(tes), -tes.sum(), (tes ** 2).sum()]
+            with np.errstate(all='ignore'):
+                pred = np.log(s0)[:, np.newaxis] - tes / t2s[:, np.newaxis]
+                se, rsq = _fit_error(log_data, sq_means, pred, jtj, n_vols)
+                s0_se = s0 * se[0]
+                t2s_se = t2s ** 2 * se[1]
+        for stat in (t2s_se, s0_se, rsq):
+            stat[~np.isfinite(stat)] = 0.
+
+    t2s[np.isinf(t2s)] = 500.  # why 500?
+    t2s[t2s <= 0] = 1.  # let's get rid of negative values!
+    s0[np.isnan(s0)] = 0.      # why 0?
+    if sq_means is not None:
+        return t2s, s0, t2s_se, s0_se, rsq
+    return t2s, s0
+
+
+def _fit_adaptive(log_data, data, tes, masksum, fittype, pool=None,
+                  sq_means=None, n_vols=1):
+    """
+    Fit each sample once, with the number of echoes given by the adaptive mask
+
+    Parameters
+    ----------
+    log_data : (M x E [x T]) array_like
+        ``log(abs(data) + 1)`` for each masked sample and echo, or its
+        temporal mean
+    data : (M x E [x T]) array_like or None
+        Masked signal (or its temporal mean) matching `log_data`. Only used
+        if `fittype` is 'curvefit'.
+    tes : (E,) array_like
+        Echo times
+    masksum : (M,) array_like
+        Valued array indicating number of echos that have sufficient signal in
+        given sample
+    fittype : {loglin, curvefit}
+        The type of model fit to use
+    pool : :obj:`_MonoexpPool` or None, optional
+        Worker processes for the 'curvefit' fit. If None (default), samples
+        are fit serially.
+    sq_means : (M x E) array_like or None, optional
+        Temporal mean of the squared log signal or signal. If provided, fit
+        statistics are also returned. See :func:`_fit_echoes`.
+    n_vols : :obj:`int`, optional
+        Number of volumes the means were computed over. Default is 1.
+
+    Returns
+    -------
+    t2s_limited, s0_limited, t2s_full, s0_full : (M [x T]) :obj:`numpy.ndarray`
+        Limited and full T2* and S0 maps, as returned by :func:`fit_decay`
+    t2s_se, s0_se, rsq : (M,) :obj:`numpy.ndarray`
+        Standard errors and R-squared of the fits used in the full maps. Only
+        returned if `sq_means` is provided.
+    """
+    n_echos = log_data.shape[1]
+    t2s_limited = np.zeros((log_data.shape[0],) + log_data.shape[2:])
+    s0_limited = np.zeros_like(t2s_limited)
+    t2s_full = np.zeros_like(t2s_limited)
+    s0_full = np.zeros_like(t2s_limited)
+    fit_stats = [np.zeros_like(t2s_limited) for _ in range(3)]
+
+    for echo_num in range(2, n_echos + 1):
+        # samples with a single good echo get the two-echo fit in the full
+        # maps only
+        limited = masksum == echo_num
+        if echo_num == 2:
+            full = limited | (masksum == 1)
+        else:
+            full = limited
+        fit_idx = np.where(full)[0]
+        if not fit_idx.size:
+            continue
+
+        outputs = _fit_echoes(
+            log_data[fit_idx, :echo_num, ...],
+            data[fit_idx, :echo_num, ...] if fittype == 'curvefit' else None,
+            tes[:echo_num], fittype, pool=pool,
+            sq_means=None if sq_means is None else sq_means[fit_idx, :echo_num],
+            n_vols=n_vols)
+        t2s, s0 = outputs[:2]
+        for stat, fit_stat in zip(fit_stats, outputs[2:]):
+            stat[fit_idx] = fit_stat
+
+        t2s_full[fit_idx] = t2s
+        s0_full[fit_idx] = s0
+        limited = limited[fit_idx]
+        t2s_limited[fit_idx[limited]] = t2s[limited]
+        s0_limited[fit_idx[limited]] = s0[limited]
+
+    if sq_means is not None:
+        return (t2s_limited, s0_limited, t2s_full, s0_full) + tuple(fit_stats)
+    return t2s_limited, s0_limited, t2s_full, s0_full
+
+
+def _mask_chunks(mask, sample_nbytes, max_memory=None):
+    """
+    Split the samples in `mask` into chunks that fit in a memory budget
+
+    Parameters
+    ----------
+    mask : (S,) array_like
+        Boolean mask of samples to process
+    sample_nbytes : :obj:`int`
+        Approximate number of bytes of temporary arrays needed per sample
+    max_memory : :obj:`float` or None, optional
+        Memory budget for a chunk, in gigabytes. If None, all samples are
+        returned in a single chunk. Default is None.
+
+    Returns
+    -------
+    chunks : :obj:`list` of :obj:`numpy.ndarray`
+        Indices (into the full `S` samples) of the samples in each chunk
+    """
+    mask_idx = np.where(mask)[0]
+    if max_memory is None:
+        return [mask_idx]
+    chunk_size = utils.memory_chunk_size(sample_nbytes, max_memory)
+    LGR.debug('Processing {0} samples in chunks of {1}'.format(
+        mask_idx.size, chunk_size))
+    return [mask_idx[start:start + chunk_size]
+            for start in range(0, mask_idx.size, chunk_size)]
+
+
+def _log_signal(data):
+    """
+    Compute ``log(abs(data) + 1)`` as float64 with a single temporary array
+    """
+    log_data = np.abs(data, dtype=float)
+    log_data += 1
+    np.log(log_data, out=log_data)
+    return log_data
+
+
+def fit_decay(data, tes, mask, masksum, fittype, n_jobs=1, verbose=True,
+              max_memory=None, getstats=False):
     """
     Fit voxel-wise monoexponential decay models to `data`
 
     Parameters
     ----------
-    data : (S x E [x T]) array_like
+    data : (S x E [x T]) array_like or :obj:`tedana.utils.MaskedData`
         Multi-echo data array, where `S` is samples, `E` is echos, and `T` is
-        time
+        time. Masked data must contain every sample in `mask`.
     tes : (E,) :obj:`list`
         Echo times
     mask : (S,) array_like
@@ -47,6 +550,25 @@ def fit_decay(data, tes, mask, masksum, fittype):
         given sample
     fittype : {loglin, curvefit}
         The type of model fit to use
+    n_jobs : :obj:`int`, optional
+        Number of worker processes used to fit voxels when `fittype` is
+        'curvefit'. The processes are started once and reused for every fit.
+        Negative values count back from the number of available CPUs (see
+        :func:`tedana.utils.check_n_jobs`), so -1 uses all of them.
+        Default is 1.
+    verbose : :obj:`bool`, optional
+        Whether to estimate `t2ss` and `s0vs`, which requires fitting every
+        voxel with every number of echoes. If False, each voxel is only fit
+        with the number of echoes given by `masksum` (and dropout voxels with
+        two echoes), and `t2ss` and `s0vs` are returned as None.
+        Default is True.
+    max_memory : :obj:`float` or None, optional
+        Approximate memory budget, in gigabytes, for the temporary copies of
+        the data. If provided, masked voxels are processed in chunks that fit
+        in this budget. Default is None (all voxels at once).
+    getstats : :obj:`bool`, optional
+        Whether to also return the standard errors of the full T2* and S0 maps
+        and the R-squared of the fits. Default is False.
 
     Returns
     -------
@@ -56,12 +578,12 @@ def fit_decay(data, tes, mask, masksum, fittype):
     s0_limited : (S,) :obj:`numpy.ndarray`
         Limited S0 map.  The limited map only keeps the S0 values for data
         where there are at least two echos with good signal.
-    t2ss : (S x E-1) :obj:`numpy.ndarray`
+    t2ss : (S x E-1) :obj:`numpy.ndarray` or None
         Voxel-wise T2* estimates using ascending numbers of echoes, starting
-        with 2.
-    s0vs : (S x E-1) :obj:`numpy.ndarray`
+        with 2. None if `verbose` is False.
+    s0vs : (S x E-1) :obj:`numpy.ndarray` or None
         Voxel-wise S0 estimates using ascending numbers of echoes, starting
-        with 2.
+        with 2. None if `verbose` is False.
     t2s_full : (S,) :obj:`numpy.ndarray`
         Full T2* map. For voxels affected by dropout, with good signal from
         only one echo, the full map uses the T2* estimate from the first two
@@ -70,6 +592,14 @@ def fit_decay(data, tes, mask, masksum, fittype):
         Full S0 map. For voxels affected by dropout, with good signal from
         only one echo, the full map uses the S0 estimate from the first two
         echoes.
+    t2s_se : (S,) :obj:`numpy.ndarray`
+        Standard error of the full T2* map. Only returned if `getstats` is
+        True.
+    s0_se : (S,) :obj:`numpy.ndarray`
+        Standard error of the full S0 map. Only returned if `getstats` is True.
+    rsquared : (S,) :obj:`numpy.ndarray`
+        Coefficient of determination of the fits used in the full maps, in the
+        log domain for 'loglin'. Only returned if `getstats` is True.
 
     Notes
     -----
@@ -100,63 +630,76 @@ def fit_decay(data, tes, mask, masksum, fittype):
                          'mask ({1}), and masksum ({2}) do not '
                          'match'.format(data.shape[0], mask.shape[0], masksum.shape[0]))
 
-    if len(data.shape) == 3:
-        n_samp, n_echos, n_vols = data.shape
-        fit_data = np.mean(data, axis=2)
-        fit_sigma = np.std(data, axis=2)
-    else:
-        n_samp, n_echos = data.shape
-        n_vols = 1
-
-    data = data[mask]
-    fit_data = fit_data[mask]
-    fit_sigma = fit_sigma[mask]
-    t2ss = np.zeros([n_samp, n_echos - 1])
-    s0vs = np.zeros([n_samp, n_echos - 1])
-
-    for i_echo, echo_num in enumerate(range(2, n_echos + 1)):
-        # perform log linear fit of echo times against MR signal
-        # make DV matrix: samples x (time series * echos)
-        data_2d = data[:, :echo_num, :].reshape(len(data), -1).T
-        log_data = np.log(np.abs(data_2d) + 1)
-
-        # make IV matrix: intercept/TEs x (time series * echos)
-        x = np.column_stack([np.ones(echo_num), [-te for te in tes[:echo_num]]])
-        X = np.repeat(x, n_vols, axis=0)
-        echo_times_1d = X[:, 1] * -1
-
-        # Log-linear fit
-        betas = np.linalg.lstsq(X, log_data, rcond=None)[0]
-        t2s = 1. / betas[1, :].T
-        s0 = np.exp(betas[0, :]).T
-
-        if fittype == 'curvefit':
-            # perform a monoexponential fit of echo times against MR signal
-            # using loglin estimates as initial starting points for fit
-
-            fail_count = 0
-            for voxel in range(t2s.size):
-                try:
-                    popt, cov = scipy.optimize.curve_fit(
-                        mono_exp, echo_times_1d, data_2d[:, voxel],
-                        p0=(s0[voxel], t2s[voxel]))
-                    s0[voxel] = popt[0]
-                    t2s[voxel] = popt[1]
-                except RuntimeError:
-                    # If curve_fit fails to converge, fall back to loglinear estimate
-                    fail_count += 1
-            if fail_count:
-                fail_percent = 100 * fail_count / t2s.size
-                LGR.debug('With {0} echoes, monoexponential fit failed on {1} ({2:.2f}%) voxel(s),'
-                          ' used log linear estimate instead'.format(echo_num, fail_count,
-                                                                     fail_percent))
-
-        t2s[np.isinf(t2s)] = 500.  # why 500?
-        t2s[t2s <= 0] = 1.  # let's get rid of negative values!
-        s0[np.isnan(s0)] = 0.      # why 0?
-
-        t2ss[..., i_echo] = np.squeeze(utils.unmask(t2s, mask))
-        s0vs[..., i_echo] = np.squeeze(utils.unmask(s0, mask))
+    n_jobs = utils.check_n_jobs(n_jobs)
+    mask = mask.astype(bool)
+    n_samp, n_echos = data.shape[:2]
+    n_vols = data.shape[2] if data.ndim == 3 else 1
+    tes = np.asarray(tes, dtype=float)
+
+    # the log-linear design only depends on the TEs, so the temporal mean of
+    # the log signal per echo is a sufficient statistic for every echo count.
+    # Only those (M x E) summaries are kept, so the data can be reduced in
+    # chunks of voxels.
+    n_mask = int(mask.sum())
+    log_means = np.zeros([n_mask, n_echos])
+    data_means = np.zeros([n_mask, n_echos]) if fittype == 'curvefit' else None
+    # the second moments give the residuals of the fit to every volume
+    sq_means = np.zeros([n_mask, n_echos]) if getstats else None
+    # per value: the data, their log and, for the statistics, their squares
+    # (of a float copy of the data, for curvefit)
+    value_nbytes = data.dtype.itemsize + 8
+    if getstats:
+        value_nbytes += 16 if fittype == 'curvefit' else 8
+    chunks = _mask_chunks(mask, n_echos * n_vols * value_nbytes,
+                          max_memory=max_memory)
+    start = 0
+    for chunk_idx in chunks:
+        stop = start + chunk_idx.size
+        data_chunk = utils.apply_mask(data, chunk_idx)
+        log_chunk = _log_signal(data_chunk)
+        if getstats:
+            fit_chunk = (data_chunk.astype(float) if fittype == 'curvefit'
+                         else log_chunk)
+            sq_chunk = fit_chunk ** 2
+            sq_means[start:stop] = (sq_chunk.mean(axis=-1) if data.ndim == 3
+                                    else sq_chunk)
+            del fit_chunk, sq_chunk
+        if data.ndim == 3:
+            log_means[start:stop] = log_chunk.mean(axis=-1)
+            if fittype == 'curvefit':
+                data_means[start:stop] = data_chunk.mean(axis=-1, dtype=float)
+        else:
+            log_means[start:stop] = log_chunk
+            if fittype == 'curvefit':
+                data_means[start:stop] = data_chunk
+        del data_chunk, log_chunk
+        start = stop
+
+    with _MonoexpPool(n_jobs if fittype == 'curvefit' else 1,
+                      n_mask * n_echos) as pool:
+        if not verbose:
+            # only fit the echo count that each voxel uses
+            outputs = _fit_adaptive(log_means, data_means, tes, masksum[mask],
+                                    fittype, pool=pool, sq_means=sq_means,
+                                    n_vols=n_vols)
+            outputs = [utils.unmask(out, mask) for out in outputs]
+            return tuple(outputs[:2]) + (None, None) + tuple(outputs[2:])
+
+        t2ss = np.zeros([n_samp, n_echos - 1])
+        s0vs = np.zeros([n_samp, n_echos - 1])
+        stats = [np.zeros([n_samp, n_echos - 1]) for _ in range(3 * getstats)]
+
+        for i_echo, echo_num in enumerate(range(2, n_echos + 1)):
+            outputs = _fit_echoes(
+                log_means[:, :echo_num],
+                data_means[:, :echo_num] if fittype == 'curvefit' else None,
+                tes[:echo_num], fittype, pool=pool,
+                sq_means=sq_means[:, :echo_num] if getstats else None,
+                n_vols=n_vols)
+            t2ss[..., i_echo] = np.squeeze(utils.unmask(outputs[0], mask))
+            s0vs[..., i_echo] = np.squeeze(utils.unmask(outputs[1], mask))
+            for stat, echo_stat in zip(stats, outputs[2:]):
+                stat[..., i_echo] = utils.unmask(echo_stat, mask)
 
     # create limited T2* and S0 maps
     echo_masks = np.zeros([n_samp, n_echos - 1], dtype=bool)
@@ -172,18 +715,27 @@ def fit_decay(data, tes, mask, masksum, fittype):
     t2s_full[masksum == 1] = t2ss[masksum == 1, 0]
     s0_full[masksum == 1] = s0vs[masksum == 1, 0]
 
+    if getstats:
+        # statistics of the fits that went into the full maps
+        full_masks = echo_masks.copy()
+        full_masks[masksum == 1, 0] = True
+        stats = [utils.unmask(stat[full_masks], full_masks.any(axis=1))
+                 for stat in stats]
+        return (t2s_limited, s0_limited, t2ss, s0vs, t2s_full,
+                s0_full) + tuple(stats)
+
     return t2s_limited, s0_limited, t2ss, s0vs, t2s_full, s0_full
 
 
-def fit_decay_ts(data, tes, mask, masksum, fittype):
+def fit_decay_ts(data, tes, mask, masksum, fittype, n_jobs=1, max_memory=None):
     """
     Fit voxel- and timepoint-wise monoexponential decay models to `data`
 
     Parameters
     ----------
-    data : (S x E x T) array_like
+    data : (S x E x T) array_like or :obj:`tedana.utils.MaskedData`
         Multi-echo data array, where `S` is samples, `E` is echos, and `T` is
-        time
+        time. Masked data must contain every sample in `mask`.
     tes : (E,) :obj:`list`
         Echo times
     mask : (S,) array_like
@@ -194,6 +746,16 @@ def fit_decay_ts(data, tes, mask, masksum, fittype):
         given sample
     fittype : :obj: `str`
         The type of model fit to use
+    n_jobs : :obj:`int`, optional
+        Number of worker processes used to fit voxels when `fittype` is
+        'curvefit'. The processes are started once and reused for every fit.
+        Negative values count back from the number of available CPUs (see
+        :func:`tedana.utils.check_n_jobs`), so -1 uses all of them.
+        Default is 1.
+    max_memory : :obj:`float` or None, optional
+        Approximate memory budget, in gigabytes, for the temporary arrays of
+        the fit. If provided, masked voxels are processed in chunks that fit
+        in this budget. Default is None (all voxels at once).
 
     Returns
     -------
@@ -212,20 +774,212 @@ def fit_decay_ts(data, tes, mask, masksum, fittype):
         from only one echo, the full timeseries uses the single echo's value
         at that voxel/volume.
     """
-    n_samples, _, n_vols = data.shape
-    tes = np.array(tes)
+    if data.shape[1] != len(tes):
+        raise ValueError('Second dimension of data ({0}) does not match number '
+                         'of echoes provided (tes; {1})'.format(data.shape[1], len(tes)))
+    elif not (data.shape[0] == mask.shape[0] == masksum.shape[0]):
+        raise ValueError('First dimensions (number of samples) of data ({0}), '
+                         'mask ({1}), and masksum ({2}) do not '
+                         'match'.format(data.shape[0], mask.shape[0], masksum.shape[0]))
+
+    n_jobs = utils.check_n_jobs(n_jobs)
+    mask = mask.astype(bool)
+    n_samples, n_echos, n_vols = data.shape
+    tes = np.asarray(tes, dtype=float)
 
     t2s_limited_ts = np.zeros([n_samples, n_vols])
     s0_limited_ts = np.copy(t2s_limited_ts)
     t2s_full_ts = np.copy(t2s_limited_ts)
     s0_full_ts = np.copy(t2s_limited_ts)
 
+    # per-voxel working set: data copy, log signal and per-volume estimates,
+    # plus the solver's temporaries for curvefit
+    sample_nbytes = n_echos * n_vols * (data.dtype.itemsize + 8) + 8 * 8 * n_vols
+    if fittype == 'curvefit':
+        sample_nbytes += 8 * 8 * n_echos * n_vols
+
+    chunks = _mask_chunks(mask, sample_nbytes, max_memory=max_memory)
+    max_chunk = max([chunk_idx.size for chunk_idx in chunks] + [0])
+    with _MonoexpPool(n_jobs if fittype == 'curvefit' else 1,
+                      max_chunk * n_echos * n_vols) as pool:
+        for chunk_idx in chunks:
+            # fit every volume at once, with each voxel's echo count from
+            # masksum
+            data_chunk = utils.apply_mask(data, chunk_idx)
+            outputs = _fit_adaptive(_log_signal(data_chunk), data_chunk, tes,
+                                    masksum[chunk_idx], fittype, pool=pool)
+            t2s_limited_ts[chunk_idx] = outputs[0]
+            s0_limited_ts[chunk_idx] = outputs[1]
+            t2s_full_ts[chunk_idx] = outputs[2]
+            s0_full_ts[chunk_idx] = outputs[3]
+
+    return t2s_limited_ts, s0_limited_ts, t2s_full_ts, s0_full_ts
+
+
+def _window_bounds(n_vols, window_size):
+    """
+    First and last (exclusive) volume of the window centered on each volume
+
+    Windows are shifted inward at the edges of the run so that every window
+    has `window_size` volumes, so consecutive windows differ by at most one
+    volume entering and one leaving.
+    """
+    window_size = min(window_size, n_vols)
+    starts = np.clip(np.arange(n_vols) - window_size // 2, 0,
+                     n_vols - window_size)
+    return starts, starts + window_size
+
+
+def _window_means(data, window_size, fittype):
+    """
+    Rolling per-echo means of the log signal (and signal) over sliding windows
+
+    The running sums are updated incrementally as the window moves, instead
+    of summing each window from scratch.
+
+    Parameters
+    ----------
+    data : (M x E x T) array_like
+        Masked multi-echo data
+    window_size : :obj:`int`
+        Number of volumes in each window
+    fittype : {loglin, curvefit}
+        The type of model fit to use. The signal means are only computed for
+        'curvefit'.
+
+    Returns
+    -------
+    log_means : (M x E x T) :obj:`numpy.ndarray`
+        Mean of ``log(abs(data) + 1)`` over the window centered on each volume
+    data_means : (M x E x T) :obj:`numpy.ndarray` or None
+        Mean of the signal over the window centered on each volume
+    """
+    n_vols = data.shape[-1]
+    starts, stops = _window_bounds(n_vols, window_size)
+    window_size = stops[0] - starts[0]
+    curvefit = fittype == 'curvefit'
+
+    log_means = np.empty(data.shape)
+    data_means = np.empty(data.shape) if curvefit else None
+    log_sum = _log_signal(data[..., :stops[0]]).sum(axis=-1)
+    if curvefit:
+        data_sum = data[..., :stops[0]].sum(axis=-1, dtype=float)
+
     for vol in range(n_vols):
-        t2s_limited, s0_limited, _, _, t2s_full, s0_full = fit_decay(
-            data[:, :, vol][:, :, None], tes, mask, masksum, fittype)
-        t2s_limited_ts[:, vol] = t2s_limited
-        s0_limited_ts[:, vol] = s0_limited
-        t2s_full_ts[:, vol] = t2s_full
-        s0_full_ts[:, vol] = s0_full
+        if vol and starts[vol] != starts[vol - 1]:
+            entering, leaving = stops[vol] - 1, starts[vol - 1]
+            log_sum += _log_signal(data[..., entering]) - _log_signal(data[..., leaving])
+            if curvefit:
+                data_sum += (data[..., entering].astype(float) -
+                             data[..., leaving])
+        log_means[..., vol] = log_sum / window_size
+        if curvefit:
+            data_means[..., vol] = data_sum / window_size
+
+    return log_means, data_means
+
+
+def fit_decay_window(data, tes, mask, masksum, fittype, window_size,
+                     n_jobs=1, max_memory=None):
+    """
+    Fit monoexponential decay models to `data` over sliding windows of volumes
+
+    Parameters
+    ----------
+    data : (S x E x T) array_like or :obj:`tedana.utils.MaskedData`
+        Multi-echo data array, where `S` is samples, `E` is echos, and `T` is
+        time. Masked data must contain every sample in `mask`.
+    tes : (E,) :obj:`list`
+        Echo times
+    mask : (S,) array_like
+        Boolean array indicating samples that are consistently (i.e., across
+        time AND echoes) non-zero
+    masksum : (S,) array_like
+        Valued array indicating number of echos that have sufficient signal in
+        given sample
+    fittype : {loglin, curvefit}
+        The type of model fit to use
+    window_size : :obj:`int`
+        Number of volumes in each window
+    n_jobs : :obj:`int`, optional
+        Number of worker processes used to fit voxels when `fittype` is
+        'curvefit'. The processes are started once and reused for every fit.
+        Negative values count back from the number of available CPUs (see
+        :func:`tedana.utils.check_n_jobs`), so -1 uses all of them.
+        Default is 1.
+    max_memory : :obj:`float` or None, optional
+        Approximate memory budget, in gigabytes, for the temporary arrays of
+        the fit. If provided, masked voxels are processed in chunks that fit
+        in this budget. Default is None (all voxels at once).
+
+    Returns
+    -------
+    t2s_limited_ts : (S x T) :obj:`numpy.ndarray`
+        Limited T2* timeseries. The limited timeseries only keeps the T2*
+        values for data where there are at least two echos with good signal.
+    s0_limited_ts : (S x T) :obj:`numpy.ndarray`
+        Limited S0 timeseries. The limited timeseries only keeps the S0
+        values for data where there are at least two echos with good signal.
+    t2s_full_ts : (S x T) :obj:`numpy.ndarray`
+        Full T2* timeseries. For voxels affected by dropout, with good signal
+        from only one echo, the full timeseries uses the estimate from the
+        first two echoes.
+    s0_full_ts : (S x T) :obj:`numpy.ndarray`
+        Full S0 timeseries. For voxels affected by dropout, with good signal
+        from only one echo, the full timeseries uses the estimate from the
+        first two echoes.
+
+    Notes
+    -----
+    The estimate for each volume is fit to the `window_size` volumes
+    centered on it. Near the beginning and end of the run, the window is
+    shifted so that it stays within the run. Per-voxel sums of the log
+    signal (and of the signal, for 'curvefit') are updated as the window
+    moves, so the cost does not grow with `window_size`.
+    """
+    if data.shape[1] != len(tes):
+        raise ValueError('Second dimension of data ({0}) does not match number '
+                         'of echoes provided (tes; {1})'.format(data.shape[1], len(tes)))
+    elif not (data.shape[0] == mask.shape[0] == masksum.shape[0]):
+        raise ValueError('First dimensions (number of samples) of data ({0}), '
+                         'mask ({1}), and masksum ({2}) do not '
+                         'match'.format(data.shape[0], mask.shape[0], masksum.shape[0]))
+    elif window_size < 1:
+        raise ValueError('Argument "window_size" must be a positive integer, '
+                         'not {0}'.format(window_size))
+
+    n_jobs = utils.check_n_jobs(n_jobs)
+    mask = mask.astype(bool)
+    n_samples, n_echos, n_vols = data.shape
+    tes = np.asarray(tes, dtype=float)
+
+    # windows cannot be longer than the run
+    RepLGR.info("T2* and S0 were estimated for each volume from the {0} "
+                "volumes surrounding it.".format(min(window_size, n_vols)))
+
+    t2s_limited_ts = np.zeros([n_samples, n_vols])
+    s0_limited_ts = np.copy(t2s_limited_ts)
+    t2s_full_ts = np.copy(t2s_limited_ts)
+    s0_full_ts = np.copy(t2s_limited_ts)
+
+    # per-voxel working set: data copy, window means and per-volume
+    # estimates, plus the solver's temporaries for curvefit
+    sample_nbytes = n_echos * n_vols * (data.dtype.itemsize + 8) + 8 * 8 * n_vols
+    if fittype == 'curvefit':
+        sample_nbytes += 9 * 8 * n_echos * n_vols
+
+    chunks = _mask_chunks(mask, sample_nbytes, max_memory=max_memory)
+    max_chunk = max([chunk_idx.size for chunk_idx in chunks] + [0])
+    with _MonoexpPool(n_jobs if fittype == 'curvefit' else 1,
+                      max_chunk * n_echos * n_vols) as pool:
+        for chunk_idx in chunks:
+            log_means, data_means = _window_means(utils.apply_mask(data, chunk_idx),
+                                                  window_size, fittype)
+            outputs = _fit_adaptive(log_means, data_means, tes,
+                                    masksum[chunk_idx], fittype, pool=pool)
+            t2s_limited_ts[chunk_idx] = outputs[0]
+            s0_limited_ts[chunk_idx] = outputs[1]
+            t2s_full_ts[chunk_idx] = outputs[2]
+            s0_full_ts[chunk_idx] = outputs[3]
 
     return t2s_limited_ts, s0_limited_ts, t2s_full_ts, s0_full_ts
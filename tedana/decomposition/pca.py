@@ -95,9 +95,9 @@ def tedpca(data_cat, data_oc, combmode, mask, t2s, t2sG,
 
     Parameters
     ----------
-    data_cat : (S x E x T) array_like
+    data_cat : (S x E x T) array_like or :obj:`tedana.utils.MaskedData`
         Input functional data
-    data_oc : (S x T) array_like
+    data_oc : (S x T) array_like or :obj:`tedana.utils.MaskedData`
         Optimally combined time series data
     combmode : {'t2s', 'paid'} str
         How optimal combination of echos should be made, where 't2s' indicates
@@ -236,13 +236,15 @@ def tedpca(data_cat, data_oc, combmode, mask, t2s, t2sG,
 
     if len(source_tes) == 1 and source_tes[0] == -1:
         LGR.info('Computing PCA of optimally combined multi-echo data')
-        data = data_oc[mask, :][:, np.newaxis, :]
+        data = utils.apply_mask(data_oc, mask)[:, np.newaxis, :]
     elif len(source_tes) == 1 and source_tes[0] == 0:
         LGR.info('Computing PCA of spatially concatenated multi-echo data')
-        data = data_cat[mask, ...]
+        data = utils.apply_mask(data_cat, mask)
     else:
         LGR.info('Computing PCA of echo #{0}'.format(','.join([str(ee) for ee in source_tes])))
-        data = np.stack([data_cat[mask, ee, :] for ee in source_tes - 1], axis=1)
+        data_cat_masked = utils.apply_mask(data_cat, mask)
+        data = np.stack([data_cat_masked[:, ee, :] for ee in source_tes - 1],
+                        axis=1)
 
     eim = np.squeeze(eimask(data))
     data = np.squeeze(data[eim])
@@ -285,7 +287,7 @@ def tedpca(data_cat, data_oc, combmode, mask, t2s, t2sG,
         comptable['normalized variance explained']
     comptable['normalized variance explained'] = varex_norm
 
-    np.savetxt('mepca_mix.1D', comp_ts)
+    io.write_matrix(comp_ts, 'mepca_mix.1D')
 
     # write component maps to 4D image
     comp_maps = np.zeros((data_oc.shape[0], comp_ts.shape[1]))
@@ -293,7 +295,7 @@ def tedpca(data_cat, data_oc, combmode, mask, t2s, t2sG,
         temp_comp_ts = comp_ts[:, i_comp][:, None]
         comp_map = utils.unmask(computefeats2(data_oc, temp_comp_ts, mask), mask)
         comp_maps[:, i_comp] = np.squeeze(comp_map)
-    io.filewrite(comp_maps, 'mepca_OC_components.nii', ref_img)
+    io.filewrite(comp_maps, 'mepca_OC_components.nii', ref_img, copy=False)
 
     # Select components using decision tree
     if algorithm == 'kundu':
@@ -306,8 +308,7 @@ def tedpca(data_cat, data_oc, combmode, mask, t2s, t2sG,
         comptable['classification'] = 'accepted'
         comptable['rationale'] = ''
 
-    comptable.to_csv('comp_table_pca.tsv', sep='\t', index=True,
-                     index_label='component', float_format='%.6f')
+    io.write_table(comptable, 'comp_table_pca.tsv')
 
     acc = comptable[comptable.classification == 'accepted'].index.values
     n_components = acc.size
@@ -27,10 +27,11 @@ def gscontrol_raw(catd, optcom, n_echos, ref_img, dtrank=4):
 
     Parameters
     ----------
-    catd : (S x E x T) array_like
+    catd : (S x E x T) array_like or :obj:`tedana.utils.MaskedData`
         Input functional data
-    optcom : (S x T) array_like
-        Optimally combined functional data (i.e., the output of `make_optcom`)
+    optcom : (S x T) array_like or :obj:`tedana.utils.MaskedData`
+        Optimally combined functional data (i.e., the output of `make_optcom`).
+        If masked, `catd` must contain every sample in its mask.
     n_echos : :obj:`int`
         Number of echos in data. Should be the same as `E` dimension of `catd`
     ref_img : :obj:`str` or img_like
@@ -41,9 +42,10 @@ def gscontrol_raw(catd, optcom, n_echos, ref_img, dtrank=4):
 
     Returns
     -------
-    dm_catd : (S x E x T) array_like
-        Input `catd` with global signal removed from time series
-    dm_optcom : (S x T) array_like
+    dm_catd : (S x E x T) array_like or :obj:`tedana.utils.MaskedData`
+        Input `catd` with global signal removed from time series. Masked like
+        `optcom` if `optcom` is masked.
+    dm_optcom : (S x T) array_like or :obj:`tedana.utils.MaskedData`
         Input `optcom` with global signal removed from time series
     """
     LGR.info('Applying amplitude-based T1 equilibration correction')
@@ -64,10 +66,18 @@ def gscontrol_raw(catd, optcom, n_echos, ref_img, dtrank=4):
     bounds = np.linspace(-1, 1, optcom.shape[-1])
     Lmix = np.column_stack([lpmv(0, vv, bounds) for vv in range(dtrank)])
 
+    # work on the samples within the mask of masked data
+    optcom_orig, mask = optcom, None
+    if isinstance(optcom, utils.MaskedData):
+        mask = optcom.mask
+        catd = utils.apply_mask(catd, mask)
+        optcom = optcom.data
+
     # compute mean, std, mask local to this function
     # inefficient, but makes this function a bit more modular
     Gmu = optcom.mean(axis=-1)  # temporal mean
     Gmask = Gmu != 0
+    full_Gmask = Gmask if mask is None else utils.unmask(Gmask, mask)
 
     # find spatial global signal
     dat = optcom[Gmask] - Gmu[Gmask][:, np.newaxis]
@@ -75,13 +85,13 @@ def gscontrol_raw(catd, optcom, n_echos, ref_img, dtrank=4):
     detr = dat - np.dot(sol.T, Lmix.T)[0]
     sphis = (detr).min(axis=1)
     sphis -= sphis.mean()
-    io.filewrite(utils.unmask(sphis, Gmask), 'T1gs', ref_img)
+    io.filewrite(utils.unmask(sphis, full_Gmask), 'T1gs', ref_img, copy=False)
 
     # find time course ofc the spatial global signal
     # make basis with the Legendre basis
     glsig = np.linalg.lstsq(np.atleast_2d(sphis).T, dat, rcond=None)[0]
     glsig = stats.zscore(glsig, axis=None)
-    np.savetxt('glsig.1D', glsig)
+    io.write_matrix(glsig, 'glsig.1D')
     glbase = np.hstack([Lmix, glsig.T])
 
     # Project global signal out of optimally combined data
@@ -89,8 +99,10 @@ def gscontrol_raw(catd, optcom, n_echos, ref_img, dtrank=4):
     tsoc_nogs = dat - np.dot(np.atleast_2d(sol[dtrank]).T,
                              np.atleast_2d(glbase.T[dtrank])) + Gmu[Gmask][:, np.newaxis]
 
-    io.filewrite(optcom, 'tsoc_orig', ref_img)
+    io.filewrite(optcom_orig, 'tsoc_orig', ref_img)
     dm_optcom = utils.unmask(tsoc_nogs, Gmask)
+    if mask is not None:
+        dm_optcom = utils.MaskedData(dm_optcom, mask, ref_img=ref_img)
     io.filewrite(dm_optcom, 'tsoc_nogs', ref_img)
 
     # Project glbase out of each echo
@@ -102,6 +114,8 @@ def gscontrol_raw(catd, optcom, n_echos, ref_img, dtrank=4):
                               np.atleast_2d(glbase.T[dtrank]))
         dm_catd[:, echo, :] = utils.unmask(e_nogs, Gmask)
 
+    if mask is not None:
+        dm_catd = utils.MaskedData(dm_catd, mask, ref_img=ref_img)
     return dm_catd, dm_optcom
 
 
@@ -111,7 +125,7 @@ def gscontrol_mmix(optcom_ts, mmix, mask, comptable, ref_img):
 
     Parameters
     ----------
-    optcom_ts : (S x T) array_like
+    optcom_ts : (S x T) array_like or :obj:`tedana.utils.MaskedData`
         Optimally combined time series data
     mmix : (T x C) array_like
         Mixing matrix for converting input data to component space, where `C`
@@ -148,7 +162,7 @@ def gscontrol_mmix(optcom_ts, mmix, mask, comptable, ref_img):
     ign = comptable[comptable.classification == 'ignored'].index.values
     not_ign = sorted(np.setdiff1d(all_comps, ign))
 
-    optcom_masked = optcom_ts[mask, :]
+    optcom_masked = utils.apply_mask(optcom_ts, mask)
     optcom_mu = optcom_masked.mean(axis=-1)[:, np.newaxis]
     optcom_std = optcom_masked.std(axis=-1)[:, np.newaxis]
 
@@ -165,7 +179,7 @@ def gscontrol_mmix(optcom_ts, mmix, mask, comptable, ref_img):
     bold_ts = np.dot(cbetas[:, acc], mmix[:, acc].T)
     t1_map = bold_ts.min(axis=-1)
     t1_map -= t1_map.mean()
-    io.filewrite(utils.unmask(t1_map, mask), 'sphis_hik', ref_img)
+    io.filewrite(utils.unmask(t1_map, mask), 'sphis_hik', ref_img, copy=False)
     t1_map = t1_map[:, np.newaxis]
 
     """
@@ -179,13 +193,15 @@ def gscontrol_mmix(optcom_ts, mmix, mask, comptable, ref_img):
     bold_noT1gs = bold_ts - np.dot(lstsq(glob_sig.T, bold_ts.T,
                                          rcond=None)[0].T, glob_sig)
     hik_ts = bold_noT1gs * optcom_std
-    io.filewrite(utils.unmask(hik_ts, mask), 'hik_ts_OC_T1c.nii', ref_img)
+    io.filewrite(utils.unmask(hik_ts, mask), 'hik_ts_OC_T1c.nii', ref_img,
+                 copy=False)
 
     """
     Make denoised version of T1-corrected time series
     """
     medn_ts = optcom_mu + ((bold_noT1gs + resid) * optcom_std)
-    io.filewrite(utils.unmask(medn_ts, mask), 'dn_ts_OC_T1c.nii', ref_img)
+    io.filewrite(utils.unmask(medn_ts, mask), 'dn_ts_OC_T1c.nii', ref_img,
+                 copy=False)
 
     """
     Orthogonalize mixing matrix w.r.t. T1-GS
@@ -203,5 +219,5 @@ def gscontrol_mmix(optcom_ts, mmix, mask, comptable, ref_img):
     """
     cbetas_norm = lstsq(mmixnogs_norm.T, data_norm.T, rcond=None)[0].T
     io.filewrite(utils.unmask(cbetas_norm[:, 2:], mask),
-                 'betas_hik_OC_T1c.nii', ref_img)
-    np.savetxt('meica_mix_T1c.1D', mmixnogs)
+                 'betas_hik_OC_T1c.nii', ref_img, copy=False)
+    io.write_matrix(mmixnogs, 'meica_mix_T1c.1D')
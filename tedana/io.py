@@ -1,30 +1,61 @@
 """
 Functions to handle file input/output
 """
+import gzip as gz
 import logging
+import os
 import os.path as op
+import threading
+from collections import deque
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 
 import numpy as np
 import nibabel as nib
+from nibabel.arrayproxy import ArrayProxy
+from nibabel.arraywriters import get_slope_inter, make_array_writer
+from nibabel.openers import ImageOpener
+from nibabel.volumeutils import apply_read_scaling
 from nibabel.filename_parser import splitext_addext
 from nilearn._utils import check_niimg
-from nilearn.image import new_img_like
 
 from tedana import utils
-from tedana.stats import computefeats2, get_coeffs
+from tedana.stats import ComponentProjection, computefeats2
 
 LGR = logging.getLogger(__name__)
 RepLGR = logging.getLogger('REPORT')
 RefLGR = logging.getLogger('REFERENCES')
 
+# background writer used by `filewrite`, set up by `enable_async_writes`
+_WRITER = {}
 
-def split_ts(data, mmix, mask, comptable):
+# gzip levels of the output compression settings; None writes uncompressed
+# files
+COMPRESSION_LEVELS = {'none': None, 'fast': 1, 'default': 6, 'max': 9}
+# output compression used by the writers, set by `set_output_compression`
+_COMPRESSION = {'level': COMPRESSION_LEVELS['default'], 'n_threads': None}
+# threads that compress gzipped images, shared by all writers
+_GZIP_POOL = {}
+_GZIP_LOCK = threading.Lock()
+
+# on-disk data types of floating-point outputs, set by `set_output_precision`
+OUTPUT_PRECISIONS = ('float64', 'float32', 'int16')
+_PRECISION = {'dtype': np.dtype('float64'), 'report': False}
+
+# formats the workflows can write their outputs in
+OUTPUT_FORMATS = ('nifti', 'hdf5')
+# HDF5 file the writers store outputs in, set up by `open_container`
+_CONTAINER = {}
+
+
+def split_ts(data, mmix, mask, comptable, projection=None, betas=None):
     """
     Splits `data` time series into accepted component time series and remainder
 
     Parameters
     ----------
-    data : (S x T) array_like
+    data : (S x T) array_like or :obj:`tedana.utils.MaskedData`
         Input data, where `S` is samples and `T` is time
     mmix : (T x C) array_like
         Mixing matrix for converting input data to component space, where `C`
@@ -35,6 +66,12 @@ def split_ts(data, mmix, mask, comptable):
         Component metric table. One row for each component, with a column for
         each metric. Requires at least two columns: "component" and
         "classification".
+    projection : :obj:`tedana.stats.ComponentProjection` or None, optional
+        Projection onto `mmix`, if already built. Default: None
+    betas : (M x C) array_like or None, optional
+        Betas of the masked `data` against `mmix`, from
+        :meth:`tedana.stats.ComponentProjection.coeffs`, if already computed.
+        Default: None
 
     Returns
     -------
@@ -45,26 +82,38 @@ def split_ts(data, mmix, mask, comptable):
     """
     acc = comptable[comptable.classification == 'accepted'].index.values
 
-    cbetas = get_coeffs(data - data.mean(axis=-1, keepdims=True),
-                        mmix, mask)
-    betas = cbetas[mask]
+    mdata = utils.apply_mask(data, mask)
+    if projection is None:
+        projection = ComponentProjection(mmix)
+    if betas is None:
+        betas = projection.coeffs(mdata)
+    betas = projection.demean(betas, mdata.mean(axis=-1))
     if len(acc) != 0:
-        hikts = utils.unmask(betas[:, acc].dot(mmix.T[acc, :]), mask)
+        hikts = betas[:, acc].dot(mmix.T[acc, :])
     else:
         hikts = None
 
+    if isinstance(data, utils.MaskedData):
+        resid = utils.MaskedData(mdata - hikts, mask, ref_img=data.ref_img)
+        if hikts is not None:
+            hikts = utils.MaskedData(hikts, mask, ref_img=data.ref_img)
+        return hikts, resid
+
+    if hikts is not None:
+        hikts = utils.unmask(hikts, mask)
     resid = data - hikts
 
     return hikts, resid
 
 
-def write_split_ts(data, mmix, mask, comptable, ref_img, suffix=''):
+def write_split_ts(data, mmix, mask, comptable, ref_img, suffix='',
+                   projection=None, betas=None):
     """
     Splits `data` into denoised / noise / ignored time series and saves to disk
 
     Parameters
     ----------
-    data : (S x T) array_like
+    data : (S x T) array_like or :obj:`tedana.utils.MaskedData`
         Input time series
     mmix : (C x T) array_like
         Mixing matrix for converting input data to component space, where `C`
@@ -75,6 +124,12 @@ def write_split_ts(data, mmix, mask, comptable, ref_img, suffix=''):
         Reference image to dictate how outputs are saved to disk
     suffix : :obj:`str`, optional
         Appended to name of saved files (before extension). Default: ''
+    projection : :obj:`tedana.stats.ComponentProjection` or None, optional
+        Projection onto `mmix`, if already built. Default: None
+    betas : (M x C) array_like or None, optional
+        Betas of the masked `data` against `mmix`, from
+        :meth:`tedana.stats.ComponentProjection.coeffs`, if already computed.
+        Default: None
 
     Returns
     -------
@@ -98,11 +153,15 @@ def write_split_ts(data, mmix, mask, comptable, ref_img, suffix=''):
     rej = comptable[comptable.classification == 'rejected'].index.values
 
     # mask and de-mean data
-    mdata = data[mask]
+    mdata = utils.apply_mask(data, mask)
     dmdata = mdata.T - mdata.T.mean(axis=0)
 
     # get variance explained by retained components
-    betas = get_coeffs(dmdata.T, mmix, mask=None)
+    if projection is None:
+        projection = ComponentProjection(mmix)
+    if betas is None:
+        betas = projection.coeffs(mdata)
+    betas = projection.demean(betas, mdata.mean(axis=-1))
     varexpl = (1 - ((dmdata.T - betas.dot(mmix.T))**2.).sum() /
                (dmdata**2.).sum()) * 100
     LGR.info('Variance explained by ICA decomposition: {:.02f}%'.format(varexpl))
@@ -110,20 +169,20 @@ def write_split_ts(data, mmix, mask, comptable, ref_img, suffix=''):
     # create component and de-noised time series and save to files
     hikts = betas[:, acc].dot(mmix.T[acc, :])
     lowkts = betas[:, rej].dot(mmix.T[rej, :])
-    dnts = data[mask] - lowkts
+    dnts = mdata - lowkts
 
     if len(acc) != 0:
         fout = filewrite(utils.unmask(hikts, mask),
-                         'hik_ts_{0}'.format(suffix), ref_img)
+                         'hik_ts_{0}'.format(suffix), ref_img, copy=False)
         LGR.info('Writing high-Kappa time series: {}'.format(op.abspath(fout)))
 
     if len(rej) != 0:
         fout = filewrite(utils.unmask(lowkts, mask),
-                         'lowk_ts_{0}'.format(suffix), ref_img)
+                         'lowk_ts_{0}'.format(suffix), ref_img, copy=False)
         LGR.info('Writing low-Kappa time series: {}'.format(op.abspath(fout)))
 
     fout = filewrite(utils.unmask(dnts, mask),
-                     'dn_ts_{0}'.format(suffix), ref_img)
+                     'dn_ts_{0}'.format(suffix), ref_img, copy=False)
     LGR.info('Writing denoised time series: {}'.format(op.abspath(fout)))
 
     return varexpl
@@ -135,7 +194,7 @@ def writefeats(data, mmix, mask, ref_img, suffix=''):
 
     Parameters
     ----------
-    data : (S x T) array_like
+    data : (S x T) array_like or :obj:`tedana.utils.MaskedData`
         Input time series
     mmix : (C x T) array_like
         Mixing matrix for converting input data to component space, where `C`
@@ -165,7 +224,7 @@ def writefeats(data, mmix, mask, ref_img, suffix=''):
 
     # write feature versions of components
     feats = utils.unmask(computefeats2(data, mmix, mask), mask)
-    fname = filewrite(feats, 'feats_{0}'.format(suffix), ref_img)
+    fname = filewrite(feats, 'feats_{0}'.format(suffix), ref_img, copy=False)
 
     return fname
 
@@ -176,7 +235,7 @@ def writeresults(ts, mask, comptable, mmix, n_vols, ref_img):
 
     Parameters
     ----------
-    ts : (S x T) array_like
+    ts : (S x T) array_like or :obj:`tedana.utils.MaskedData`
         Time series to denoise and save to disk
     mask : (S,) array_like
         Boolean mask array
@@ -219,17 +278,23 @@ def writeresults(ts, mask, comptable, mmix, n_vols, ref_img):
     fout = filewrite(ts, 'ts_OC', ref_img)
     LGR.info('Writing optimally combined time series: {}'.format(op.abspath(fout)))
 
-    write_split_ts(ts, mmix, mask, comptable, ref_img, suffix='OC')
+    # the betas of the data are shared by all of the outputs
+    projection = ComponentProjection(mmix)
+    betas = projection.coeffs(utils.apply_mask(ts, mask))
+
+    write_split_ts(ts, mmix, mask, comptable, ref_img, suffix='OC',
+                   projection=projection, betas=betas)
 
-    ts_B = get_coeffs(ts, mmix, mask)
-    fout = filewrite(ts_B, 'betas_OC', ref_img)
+    ts_B = utils.unmask(betas, mask)
+    fout = filewrite(ts_B, 'betas_OC', ref_img, copy=False)
     LGR.info('Writing full ICA coefficient feature set: {}'.format(op.abspath(fout)))
 
     if len(acc) != 0:
-        fout = filewrite(ts_B[:, acc], 'betas_hik_OC', ref_img)
+        fout = filewrite(ts_B[:, acc], 'betas_hik_OC', ref_img, copy=False)
         LGR.info('Writing denoised ICA coefficient feature set: {}'.format(op.abspath(fout)))
-        fout = writefeats(split_ts(ts, mmix, mask, comptable)[0],
-                          mmix[:, acc], mask, ref_img, suffix='OC2')
+        hikts = split_ts(ts, mmix, mask, comptable, projection=projection,
+                         betas=betas)[0]
+        fout = writefeats(hikts, mmix[:, acc], mask, ref_img, suffix='OC2')
         LGR.info('Writing Z-normalized spatial component maps: {}'.format(op.abspath(fout)))
 
 
@@ -239,7 +304,7 @@ def writeresults_echoes(catd, mmix, mask, comptable, ref_img):
 
     Parameters
     ----------
-    catd : (S x E x T) array_like
+    catd : (S x E x T) array_like or :obj:`tedana.utils.MaskedData`
         Input data time series
     mmix : (C x T) array_like
         Mixing matrix for converting input data to component space, where `C`
@@ -273,11 +338,68 @@ def writeresults_echoes(catd, mmix, mask, comptable, ref_img):
                               :py:func:`tedana.utils.io.write_split_ts`.
     ======================    =================================================
     """
-
+    projection = ComponentProjection(mmix)
     for i_echo in range(catd.shape[1]):
         LGR.info('Writing Kappa-filtered echo #{:01d} timeseries'.format(i_echo + 1))
-        write_split_ts(catd[:, i_echo, :], mmix, mask, comptable, ref_img,
-                       suffix='e%i' % (i_echo + 1))
+        if isinstance(catd, utils.MaskedData):
+            echo_data = utils.MaskedData(catd.data[:, i_echo, :], catd.mask)
+        else:
+            echo_data = catd[:, i_echo, :]
+        write_split_ts(echo_data, mmix, mask, comptable, ref_img,
+                       suffix='e%i' % (i_echo + 1), projection=projection)
+
+
+class ReferenceGeometry(object):
+    """
+    Geometry and header template of a reference image
+
+    Images like the reference are built from these without loading the
+    reference or copying its full header for each output, so workflows
+    create one after loading their data and pass it wherever a reference
+    image is expected.
+
+    Parameters
+    ----------
+    ref_img : :obj:`str`, img_like, :obj:`list` or :obj:`ReferenceGeometry`
+        Reference image. Only the first image of a list is used.
+
+    Attributes
+    ----------
+    shape : :obj:`tuple`
+        Shape of the reference image
+    affine : (4 x 4) :obj:`numpy.ndarray`
+        Affine of the reference image
+    header : :obj:`nibabel.nifti1.Nifti1Header`
+        Header of the reference image
+    """
+    def __init__(self, ref_img):
+        if isinstance(ref_img, ReferenceGeometry):
+            self.__dict__.update(ref_img.__dict__)
+            return
+        if isinstance(ref_img, list):
+            ref_img = ref_img[0]
+        ref_img = check_niimg(ref_img)
+        self.shape = ref_img.shape
+        self.affine = ref_img.affine
+        self.header = ref_img.header
+        self._is_nifti = '.nii' in ref_img.valid_exts
+        self._img_class = ref_img.__class__
+        if self._img_class is nib.Nifti1Pair:
+            self._img_class = nib.Nifti1Image
+        # the header of new images, as set by nilearn's `new_img_like`
+        self._template = ref_img.header.copy()
+        for field in ('scl_slope', 'scl_inter', 'glmax'):
+            if field in self._template:
+                self._template[field] = 0.
+
+
+def _as_geometry(ref_img):
+    """
+    Returns `ref_img` as a :obj:`ReferenceGeometry`, building one if needed
+    """
+    if isinstance(ref_img, ReferenceGeometry):
+        return ref_img
+    return ReferenceGeometry(ref_img)
 
 
 def new_nii_like(ref_img, data, affine=None, copy_header=True):
@@ -286,7 +408,7 @@ def new_nii_like(ref_img, data, affine=None, copy_header=True):
 
     Parameters
     ----------
-    ref_img : :obj:`str` or img_like
+    ref_img : :obj:`str`, img_like or :obj:`ReferenceGeometry`
         Reference image
     data : (S [x T]) array_like
         Data to be saved
@@ -301,38 +423,587 @@ def new_nii_like(ref_img, data, affine=None, copy_header=True):
         NiftiImage
     """
 
-    ref_img = check_niimg(ref_img)
+    ref_img = _as_geometry(ref_img)
     newdata = data.reshape(ref_img.shape[:3] + data.shape[1:])
-    if '.nii' not in ref_img.valid_exts:
+    if not ref_img._is_nifti:
         # this is rather ugly and may lose some information...
         nii = nib.Nifti1Image(newdata, affine=ref_img.affine,
                               header=ref_img.header)
     else:
-        # nilearn's `new_img_like` is a very nice function
-        nii = new_img_like(ref_img, newdata, affine=affine,
-                           copy_header=copy_header)
+        # as nilearn's `new_img_like`, from the prepared header template
+        if newdata.dtype == bool:
+            newdata = newdata.astype(np.uint8)
+        if affine is None:
+            affine = ref_img.affine
+        nii = ref_img._img_class(newdata, affine,
+                                 header=ref_img._template if copy_header else None)
+        if copy_header and 'cal_max' in nii.header:
+            nii.header['cal_max'] = np.max(newdata) if newdata.size else 0.
+            nii.header['cal_min'] = np.min(newdata) if newdata.size else 0.
     nii.set_data_dtype(data.dtype)
 
     return nii
 
 
-def filewrite(data, filename, ref_img, gzip=True, copy_header=True):
+def enable_async_writes(n_threads=2, max_pending=None):
     """
-    Writes `data` to `filename` in format of `ref_img`
+    Queues subsequent :func:`filewrite` calls to a pool of writer threads
+
+    Images are then built and compressed in the background, overlapping with
+    the computation that follows each write. Call :func:`flush_writes` to
+    wait for the queued writes.
 
     Parameters
     ----------
-    data : (S [x T]) array_like
+    n_threads : :obj:`int`, optional
+        Number of writer threads. Default: 2
+    max_pending : :obj:`int` or None, optional
+        Maximum number of queued writes, each holding its data (a copy,
+        unless :func:`filewrite` is called with ``copy=False``).
+        Further writes block until a queued write finishes. Default: None
+        (twice `n_threads`)
+    """
+    flush_writes()
+    if max_pending is None:
+        max_pending = 2 * n_threads
+    _WRITER['executor'] = ThreadPoolExecutor(max_workers=n_threads)
+    _WRITER['slots'] = threading.BoundedSemaphore(max_pending)
+    _WRITER['futures'] = []
+
+
+def wait_for_writes():
+    """
+    Waits for writes queued by :func:`filewrite`, keeping the writer threads
+
+    Worker processes are only forked once the writer threads are idle, since
+    forking while a thread holds a lock (e.g., of a logging handler) can
+    deadlock the child. Errors of the queued writes are raised by
+    :func:`flush_writes`. Does nothing if :func:`enable_async_writes` has not
+    been called.
+    """
+    futures = _WRITER.get('futures')
+    if futures:
+        wait(futures)
+
+
+def flush_writes():
+    """
+    Waits for writes queued by :func:`filewrite` and stops the writer threads
+
+    Writes are synchronous again afterwards. Does nothing if
+    :func:`enable_async_writes` has not been called.
+
+    Raises
+    ------
+    Exception
+        The first error raised by a queued write, if any
+    """
+    executor = _WRITER.pop('executor', None)
+    if executor is None:
+        return
+    futures = _WRITER.pop('futures')
+    _WRITER.pop('slots')
+    executor.shutdown(wait=True)
+    for future in futures:
+        future.result()
+
+
+@contextmanager
+def output_session(container=None, compression=None, precision=None,
+                   report=False, n_jobs=None):
+    """
+    Sets up writing the outputs of a workflow, and always cleans it up
+
+    Writes are queued to writer threads (see :func:`enable_async_writes`) and,
+    if `container` is given, go to that container (see
+    :func:`open_container`), with the given compression and precision. On
+    exit, even if the workflow failed, the queued writes are flushed, the
+    container is closed and the previous compression and precision are
+    restored.
+
+    Parameters
+    ----------
+    container : :obj:`str` or None, optional
+        Path of the HDF5 container to open. Default: None (no container)
+    compression : {'default', 'fast', 'max', 'none'} or None, optional
+        Compression of the outputs, as in :func:`set_output_compression`.
+        Default: None (the current compression)
+    precision : {'float64', 'float32', 'int16'} or None, optional
+        Data type of the outputs, as in :func:`set_output_precision`.
+        Default: None (the current precision)
+    report : :obj:`bool`, optional
+        Whether to log the rounding error of the outputs, if `precision` is
+        given. Default: False
+    n_jobs : :obj:`int` or None, optional
+        Number of threads compressing gzipped outputs, if `compression` is
+        given. Negative values count back from the number of CPUs (see
+        :func:`tedana.utils.check_n_jobs`). Default: None (the number of CPUs)
+
+    Raises
+    ------
+    Exception
+        The first error raised by a queued write, if the workflow itself
+        completed
+    """
+    previous = dict(_COMPRESSION), dict(_PRECISION)
+    try:
+        if compression is not None:
+            set_output_compression(
+                compression,
+                n_threads=None if n_jobs is None else utils.check_n_jobs(n_jobs))
+        if precision is not None:
+            set_output_precision(precision, report=report)
+        if container is not None:
+            open_container(container)
+        # write images in the background while the workflow keeps going
+        enable_async_writes()
+        completed = False
+        try:
+            yield
+            completed = True
+        finally:
+            try:
+                flush_writes()
+            except Exception:
+                if completed:
+                    raise
+                # the workflow's own error is the one raised
+                LGR.warning('A queued write failed as well', exc_info=True)
+    finally:
+        close_container()
+        _shutdown_compression()
+        _COMPRESSION.clear()
+        _COMPRESSION.update(previous[0])
+        _PRECISION.clear()
+        _PRECISION.update(previous[1])
+
+
+def set_output_compression(compression='default', n_threads=None):
+    """
+    Sets how :func:`filewrite` and :func:`filewrite_blocks` compress images
+
+    Parameters
+    ----------
+    compression : {'default', 'fast', 'max', 'none'}, optional
+        Compression of the written images. 'fast', 'default' and 'max' use
+        gzip levels 1, 6 and 9. 'none' writes uncompressed ``.nii`` files.
+        Default: 'default'
+    n_threads : :obj:`int` or None, optional
+        Number of threads compressing gzipped images, shared by all writers.
+        Default: None (the number of CPUs)
+    """
+    if compression not in COMPRESSION_LEVELS:
+        raise ValueError('Output compression must be one of {}, not '
+                         '{}'.format(sorted(COMPRESSION_LEVELS), compression))
+    _COMPRESSION['level'] = COMPRESSION_LEVELS[compression]
+    _COMPRESSION['n_threads'] = n_threads
+
+
+def set_output_precision(precision='float64', report=False):
+    """
+    Sets the data type in which the writers store floating-point images
+
+    Parameters
+    ----------
+    precision : {'float64', 'float32', 'int16'}, optional
+        On-disk data type of floating-point images. Data of a narrower type
+        are stored as they are. 'int16' images are scaled to the range of the
+        data with the NIFTI ``scl_slope`` and ``scl_inter`` fields, which
+        quarters their size; images written in blocks of volumes or to a
+        container cannot be scaled and are stored as 'float32' instead.
+        Integer images (e.g., masks) are not affected. Default: 'float64'
+    report : :obj:`bool`, optional
+        Whether to log the maximum absolute rounding error of each image
+        stored with reduced precision. Default: False
+    """
+    if precision not in OUTPUT_PRECISIONS:
+        raise ValueError('Output precision must be one of {0}, not '
+                         '{1}'.format(OUTPUT_PRECISIONS, precision))
+    _PRECISION['dtype'] = np.dtype(precision)
+    _PRECISION['report'] = report
+
+
+def _output_dtype(dtype, scaled=True):
+    """
+    Returns on-disk data type of data of `dtype`, given the output precision
+
+    If not `scaled`, floating-point types are used instead of integer ones.
+    """
+    dtype = np.dtype(dtype)
+    out_dtype = _PRECISION['dtype']
+    if not np.issubdtype(dtype, np.floating):
+        return dtype
+    if np.issubdtype(out_dtype, np.integer):
+        if scaled:
+            return out_dtype
+        out_dtype = np.dtype(np.float32)
+    return min(dtype, out_dtype, key=lambda dt: dt.itemsize)
+
+
+def _rounding_error(data, dtype):
+    """
+    Returns maximum absolute error of storing `data` as `dtype`
+
+    Integer types are scaled to the data range as nibabel does on writing.
+    """
+    data = np.asarray(data)
+    if data.dtype == dtype or not data.size:
+        return 0.
+    if np.issubdtype(dtype, np.floating):
+        stored = data.astype(dtype).astype(data.dtype)
+    else:
+        writer = make_array_writer(data, dtype, True, True)
+        slope, inter = get_slope_inter(writer)
+        slope = 1. if np.isnan(slope) else slope
+        inter = 0. if np.isnan(inter) else inter
+        info = np.iinfo(dtype)
+        stored = np.clip(np.rint((data - inter) / slope), info.min, info.max)
+        stored = stored * slope + inter
+    return np.nanmax(np.abs(stored - data))
+
+
+def _report_rounding(name, dtype, error):
+    """
+    Logs rounding error of `name` stored as `dtype`, if requested
+    """
+    LGR.info('Maximum rounding error of {0} stored as {1}: '
+             '{2:.3g}'.format(name, dtype, error))
+
+
+def _gzip_member(block, level):
+    """
+    Compresses `block` into a gzip member, with a fixed modification time
+    """
+    out = BytesIO()
+    with gz.GzipFile(fileobj=out, mode='wb', compresslevel=level,
+                     mtime=0) as fobj:
+        fobj.write(block)
+    return out.getvalue()
+
+
+def _compression_executor(n_threads):
+    """
+    Returns the pool of `n_threads` threads shared by the gzip writers
+
+    A pool of a different size replaces the previous one, whose submitted
+    blocks are still compressed.
+    """
+    with _GZIP_LOCK:
+        if _GZIP_POOL.get('n_threads') != n_threads:
+            if 'executor' in _GZIP_POOL:
+                _GZIP_POOL['executor'].shutdown(wait=False)
+            _GZIP_POOL['executor'] = ThreadPoolExecutor(max_workers=n_threads)
+            _GZIP_POOL['n_threads'] = n_threads
+        return _GZIP_POOL['executor']
+
+
+def _shutdown_compression():
+    """
+    Stops the threads shared by the gzip writers, if they were started
+    """
+    with _GZIP_LOCK:
+        executor = _GZIP_POOL.pop('executor', None)
+        _GZIP_POOL.clear()
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+class _ParallelGzipFile(object):
+    """
+    Write-only file object that gzips its contents in parallel
+
+    The written bytes are split into blocks that are compressed by the pool of
+    threads shared by all gzip writers, each into its own gzip member. The
+    members are concatenated in order, which is still a valid gzip file (as
+    written by pigz).
+
+    Parameters
+    ----------
+    filename : :obj:`str`
+        Path of the gzip file
+    level : :obj:`int`, optional
+        gzip compression level. Default: 6
+    n_threads : :obj:`int` or None, optional
+        Number of threads in the shared pool. Default: None (the number of
+        CPUs)
+    block_size : :obj:`int`, optional
+        Number of uncompressed bytes in each gzip member. Default: 4 MiB
+    """
+    def __init__(self, filename, level=6, n_threads=None,
+                 block_size=2 ** 22):
+        if n_threads is None:
+            n_threads = os.cpu_count() or 1
+        self.level = level
+        self.n_threads = max(1, n_threads)
+        self.block_size = block_size
+        self._fobj = open(filename, 'wb')
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._pos = 0
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        self._buffer.extend(data)
+        self._pos += len(data)
+        while len(self._buffer) >= self.block_size:
+            self._compress(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def read(self, *args):
+        # defined so that nibabel accepts this as a file object
+        raise IOError('Cannot read from a parallel gzip file')
+
+    def tell(self):
+        return self._pos
+
+    @property
+    def closed(self):
+        return self._fobj.closed
+
+    def seek(self, offset, whence=0):
+        # only "seeking" to the current position is supported; nibabel pads
+        # with zeros otherwise
+        if whence != 0 or offset != self._pos:
+            raise IOError('Cannot seek in a parallel gzip file')
+        return self._pos
+
+    def _compress(self, block):
+        if self.n_threads == 1:
+            self._fobj.write(_gzip_member(block, self.level))
+            return
+        # zlib releases the GIL, so the blocks are compressed concurrently;
+        # the oldest ones are written out to bound the memory in flight
+        executor = _compression_executor(self.n_threads)
+        self._pending.append(executor.submit(_gzip_member, block, self.level))
+        while len(self._pending) > 2 * self.n_threads:
+            self._fobj.write(self._pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer or self._pos == 0:
+                self._compress(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._fobj.write(self._pending.popleft().result())
+        finally:
+            self._fobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _open_output(name):
+    """
+    Opens `name` for writing, gzipped in parallel if it ends with ``.gz``
+    """
+    if name.endswith('.gz'):
+        level = _COMPRESSION['level'] or COMPRESSION_LEVELS['default']
+        return _ParallelGzipFile(name, level=level,
+                                 n_threads=_COMPRESSION['n_threads'])
+    return open(name, 'wb')
+
+
+def _output_name(filename, gzip=True):
+    """
+    Returns NIFTI path for `filename`, gzipped unless compression is disabled
+    """
+    gzip = gzip and _COMPRESSION['level'] is not None
+    root, ext, add = splitext_addext(filename)
+    return '{}.{}'.format(root, 'nii.gz' if gzip else 'nii')
+
+
+def open_container(filename):
+    """
+    Stores subsequent outputs in a single chunked HDF5 container
+
+    While the container is open, :func:`filewrite`, :func:`filewrite_blocks`,
+    :func:`write_matrix` and :func:`write_table` store their outputs as
+    datasets in `filename`, named after the file they would otherwise have
+    written (e.g., ``ts_OC`` or ``comp_table_ica``). Images are stored as
+    (S [x T]) datasets in the sample order of :func:`load_data`, chunked along
+    samples and volumes and compressed as set by
+    :func:`set_output_compression`, so slices of a few voxels or components
+    can be read without decompressing the rest. The affine and spatial shape
+    of the reference image are stored as attributes of the container. Call
+    :func:`close_container` to finish writing.
+
+    Parameters
+    ----------
+    filename : :obj:`str`
+        Path of the HDF5 container. An existing file is overwritten.
+
+    Raises
+    ------
+    ImportError
+        If h5py is not installed
+    """
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError('h5py is required to write outputs to an HDF5 '
+                          'container. Install it with '
+                          '`pip install tedana[hdf5]`.')
+    close_container()
+    _CONTAINER['file'] = h5py.File(filename, 'w')
+
+
+def close_container():
+    """
+    Closes the container opened by :func:`open_container`
+
+    Outputs are written to separate files again afterwards. Does nothing if
+    no container is open.
+    """
+    h5 = _CONTAINER.pop('file', None)
+    if h5 is not None:
+        h5.close()
+
+
+def _dataset_key(filename):
+    """
+    Returns name of the container dataset that replaces `filename`
+    """
+    return op.basename(splitext_addext(filename)[0])
+
+
+def _create_dataset(key, shape, dtype, ref_img=None):
+    """
+    Creates chunked, compressed dataset `key` in the open container
+    """
+    h5 = _CONTAINER['file']
+    if ref_img is not None and 'affine' not in h5.attrs:
+        ref_img = _as_geometry(ref_img)
+        h5.attrs['affine'] = ref_img.affine
+        h5.attrs['shape'] = ref_img.shape[:3]
+    if key in h5:
+        del h5[key]
+    kwargs = {}
+    if 0 not in shape:
+        # chunks span a block of samples and volumes (or components)
+        kwargs['chunks'] = ((min(shape[0], 4096),) +
+                            tuple(min(n, 64) for n in shape[1:]))
+        if _COMPRESSION['level'] is not None:
+            kwargs.update(compression='gzip',
+                          compression_opts=_COMPRESSION['level'],
+                          shuffle=True)
+    return h5.create_dataset(key, shape=shape, dtype=dtype, **kwargs)
+
+
+def write_matrix(data, filename):
+    """
+    Writes 2D array `data`, such as a mixing matrix, to text file `filename`
+
+    Parameters
+    ----------
+    data : (T x C) array_like
         Data to be saved
     filename : :obj:`str`
-        Filepath where data should be saved to
-    ref_img : :obj:`str` or img_like
-        Reference image
+        Filepath where data should be saved to. If a container is open (see
+        :func:`open_container`), names the dataset instead.
+
+    Returns
+    -------
+    name : :obj:`str`
+        Path of saved file or container dataset
+    """
+    if 'file' in _CONTAINER:
+        data = np.asarray(data)
+        dset = _create_dataset(_dataset_key(filename), data.shape, data.dtype)
+        dset[...] = data
+        return '{0}:/{1}'.format(dset.file.filename, dset.name.lstrip('/'))
+    np.savetxt(filename, data)
+    return filename
+
+
+def write_table(table, filename, index_label='component'):
+    """
+    Writes `table`, such as a component table, to TSV file `filename`
+
+    Parameters
+    ----------
+    table : :obj:`pandas.DataFrame`
+        Table to be saved
+    filename : :obj:`str`
+        Filepath where table should be saved to. If a container is open (see
+        :func:`open_container`), names the group instead, which holds the
+        index and each column as separate datasets.
+    index_label : :obj:`str`, optional
+        Name of the index column. Default: 'component'
+
+    Returns
+    -------
+    name : :obj:`str`
+        Path of saved file or container group
+    """
+    if 'file' not in _CONTAINER:
+        table.to_csv(filename, sep='\t', index=True, index_label=index_label,
+                     float_format='%.6f')
+        return filename
+
+    h5 = _CONTAINER['file']
+    key = _dataset_key(filename)
+    if key in h5:
+        del h5[key]
+    group = h5.create_group(key)
+    columns = [index_label] + [str(col) for col in table.columns]
+    values = [table.index.values] + [table[col].values for col in table.columns]
+    for col, col_values in zip(columns, values):
+        if col_values.dtype == object:
+            # strings are stored as fixed-length UTF-8
+            col_values = np.char.encode(col_values.astype(str), 'utf-8')
+        group.create_dataset(col, data=col_values)
+    group.attrs['columns'] = columns
+    return '{0}:/{1}'.format(h5.filename, key)
+
+
+def _write_image(data, name, ref_img, copy_header=True):
+    """
+    Builds a NIFTI image of `data` like `ref_img` and saves it to `name`
+    """
+    out = new_nii_like(ref_img, data, copy_header=copy_header)
+    dtype = _output_dtype(data.dtype)
+    out.set_data_dtype(dtype)
+    if _PRECISION['report'] and dtype != data.dtype:
+        _report_rounding(name, dtype, _rounding_error(data, dtype))
+    with _open_output(name) as fobj:
+        out.to_file_map({'image': nib.FileHolder(fileobj=fobj)})
+
+
+def filewrite(data, filename, ref_img=None, gzip=True, copy_header=True,
+              copy=True):
+    """
+    Writes `data` to `filename` in format of `ref_img`
+
+    Parameters
+    ----------
+    data : (S [x T]) array_like or :obj:`tedana.utils.MaskedData`
+        Data to be saved. Masked data are unmasked, with zeros outside of the
+        mask.
+    filename : :obj:`str`
+        Filepath where data should be saved to. If a container is open (see
+        :func:`open_container`), names the dataset instead.
+    ref_img : :obj:`str` or img_like or None, optional
+        Reference image. Only optional if `data` is masked data with a
+        reference image.
     gzip : :obj:`bool`, optional
-        Whether to gzip output (if not specified in `filename`). Only applies
-        if output dtype is NIFTI. Default: True
+        Whether to gzip output (if not specified in `filename`), with the
+        compression set by :func:`set_output_compression`. Only applies if
+        output dtype is NIFTI. Default: True
     copy_header : :obj:`bool`, optional
         Whether to copy header from `ref_img` to new image. Default: True
+    copy : :obj:`bool`, optional
+        Whether a queued write (see :func:`enable_async_writes`) keeps its own
+        copy of `data`, so that the caller may modify them afterwards. Pass
+        False for data that are not modified again, such as arrays built only
+        to be written, so that pending writes do not hold a second copy in
+        memory. Masked data are always unmasked into a new array, which is
+        not copied again. Default: True
 
     Returns
     -------
@@ -340,23 +1011,252 @@ def filewrite(data, filename, ref_img, gzip=True, copy_header=True):
         Path of saved image (with added extensions, as appropriate)
     """
 
+    if isinstance(data, utils.MaskedData):
+        if ref_img is None:
+            ref_img = data.ref_img
+        data = data.unmask()
+        copy = False
+    if ref_img is None:
+        raise ValueError('A reference image must be provided to write '
+                         '{}'.format(filename))
+
     # get reference image for comparison
     if isinstance(ref_img, list):
         ref_img = ref_img[0]
 
-    # generate out file for saving
-    out = new_nii_like(ref_img, data, copy_header=copy_header)
+    if 'file' in _CONTAINER:
+        data = np.asarray(data)
+        dtype = _output_dtype(data.dtype, scaled=False)
+        dset = _create_dataset(_dataset_key(filename), data.shape, dtype,
+                               ref_img=ref_img)
+        dset[...] = data
+        name = '{0}:/{1}'.format(dset.file.filename, dset.name.lstrip('/'))
+        if _PRECISION['report'] and dtype != data.dtype:
+            _report_rounding(name, dtype, _rounding_error(data, dtype))
+        return name
 
     # FIXME: we only handle writing to nifti right now
     # get root of desired output file and save as nifti image
-    root, ext, add = splitext_addext(filename)
-    name = '{}.{}'.format(root, 'nii.gz' if gzip else 'nii')
-    out.to_filename(name)
+    name = _output_name(filename, gzip=gzip)
+
+    if 'executor' in _WRITER:
+        # the queued write gets resolved paths and, unless the caller leaves
+        # the data alone, its own copy of them, since callers may modify the
+        # data or change directory before it runs
+        ref_img = _as_geometry(ref_img)
+        if copy:
+            data = np.array(data)
+        else:
+            data = np.asarray(data).view()
+            data.flags.writeable = False
+        slots = _WRITER['slots']
+        slots.acquire()
+        future = _WRITER['executor'].submit(_write_image, data,
+                                            op.abspath(name), ref_img,
+                                            copy_header=copy_header)
+        future.add_done_callback(lambda f: slots.release())
+        _WRITER['futures'].append(future)
+    else:
+        _write_image(data, name, ref_img, copy_header=copy_header)
 
     return name
 
 
-def load_data(data, n_echos=None):
+def filewrite_blocks(blocks, filename, ref_img, n_vols, gzip=True):
+    """
+    Writes `blocks` of volumes to `filename` one at a time in format of
+    `ref_img`
+
+    Only one block of volumes is held in memory at a time. The output is
+    always a NIFTI image.
+
+    Parameters
+    ----------
+    blocks : iterable of (S [x E] x t) array_like
+        Consecutive blocks of volumes to be saved, stacked along their last
+        axis. The dtype and shape of the first block are used for the whole
+        image.
+    filename : :obj:`str`
+        Filepath where data should be saved to. If a container is open (see
+        :func:`open_container`), names the dataset instead.
+    ref_img : :obj:`str` or img_like
+        Reference image
+    n_vols : :obj:`int`
+        Total number of volumes (along the last axis) in `blocks`
+    gzip : :obj:`bool`, optional
+        Whether to gzip output (if not specified in `filename`), with the
+        compression set by :func:`set_output_compression`. Default: True
+
+    Returns
+    -------
+    name : :obj:`str`
+        Path of saved image (with added extensions, as appropriate)
+    """
+    ref_img = _as_geometry(ref_img)
+
+    if 'file' in _CONTAINER:
+        return _write_dataset_blocks(blocks, filename, ref_img, n_vols)
+
+    name = _output_name(filename, gzip=gzip)
+
+    n_written, error = 0, 0.
+    with _open_output(name) as fobj:
+        for block in blocks:
+            block = np.asarray(block)
+            if block.ndim == 1:
+                block = block[:, np.newaxis]
+            if n_written == 0:
+                # header of a single-volume image like `ref_img`, extended to
+                # the full number of volumes; the scaling of integer types
+                # would depend on all of the volumes, so they are not used
+                hdr = new_nii_like(ref_img, block[..., :1]).header.copy()
+                hdr.set_data_shape(ref_img.shape[:3] + block.shape[1:-1] + (n_vols,))
+                hdr.set_data_dtype(_output_dtype(block.dtype, scaled=False))
+                hdr.set_slope_inter(None, None)
+                hdr['vox_offset'] = 0
+                hdr.write_to(fobj)
+                fobj.write(b'\x00' * (hdr.get_data_offset() - fobj.tell()))
+                dtype = hdr.get_data_dtype()
+            if _PRECISION['report']:
+                error = max(error, _rounding_error(block, dtype))
+            # volumes are stored consecutively, each in Fortran order
+            vols = block.reshape(ref_img.shape[:3] + block.shape[1:])
+            fobj.write(vols.astype(dtype, copy=False).tobytes(order='F'))
+            n_written += block.shape[-1]
+
+    if n_written != n_vols:
+        raise ValueError('Number of volumes written ({0}) does not match '
+                         'n_vols ({1})'.format(n_written, n_vols))
+    if _PRECISION['report'] and dtype != block.dtype:
+        _report_rounding(name, dtype, error)
+
+    return name
+
+
+def _write_dataset_blocks(blocks, filename, ref_img, n_vols):
+    """
+    Writes `blocks` of volumes to a dataset of the open container
+    """
+    dset = None
+    n_written, error = 0, 0.
+    for block in blocks:
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block[:, np.newaxis]
+        if dset is None:
+            dset = _create_dataset(_dataset_key(filename),
+                                   block.shape[:-1] + (n_vols,),
+                                   _output_dtype(block.dtype, scaled=False),
+                                   ref_img=ref_img)
+        if _PRECISION['report']:
+            error = max(error, _rounding_error(block, dset.dtype))
+        dset[..., n_written:n_written + block.shape[-1]] = block
+        n_written += block.shape[-1]
+
+    if n_written != n_vols:
+        raise ValueError('Number of volumes written ({0}) does not match '
+                         'n_vols ({1})'.format(n_written, n_vols))
+    name = '{0}:/{1}'.format(dset.file.filename, dset.name.lstrip('/'))
+    if _PRECISION['report'] and dset.dtype != block.dtype:
+        _report_rounding(name, dset.dtype, error)
+
+    return name
+
+
+def load_data_blocks(data, n_echos=None, block_size=100):
+    """
+    Reads input `data` files in blocks of volumes
+
+    Parameters
+    ----------
+    data : :obj:`list` of img_like
+        Input multi-echo data, as accepted by :func:`load_data`
+    n_echos : :obj:`int`, optional
+        Number of echos in provided data. Default: None
+    block_size : :obj:`int`, optional
+        Maximum number of volumes in each block. Default: 100
+
+    Yields
+    ------
+    fdata : (S x E x t) :obj:`numpy.ndarray`
+        Block of up to `block_size` consecutive volumes, where `S` is samples
+        and `E` is echos
+    """
+    if n_echos is None:
+        raise ValueError('Number of echos must be specified. '
+                         'Confirm that TE times are provided with the `-e` argument.')
+    if block_size < 1:
+        raise ValueError('block_size must be a positive integer, '
+                         'not {}'.format(block_size))
+
+    if isinstance(data, str):
+        data = [data]
+    if len(data) == 2:  # inviable -- need more than 2 echos
+        raise ValueError('Cannot run `tedana` with only two echos: '
+                         '{}'.format(data))
+    imgs = [check_niimg(f) for f in data]
+
+    readers = [_volume_blocks(img, block_size) for img in imgs]
+    try:
+        for blocks in zip(*readers):
+            if len(blocks) == 1:  # a z-concatenated file was provided
+                block = blocks[0]
+                (nx, ny), nz = block.shape[:2], block.shape[2] // n_echos
+                block = block.reshape(nx, ny, nz, n_echos, -1, order='F')
+                yield block.reshape(-1, n_echos, block.shape[-1])
+            else:
+                yield np.stack([block.reshape(-1, block.shape[-1])
+                                for block in blocks], axis=1)
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+def _volume_blocks(img, block_size):
+    """
+    Yields (X x Y x Z x t) blocks of consecutive volumes of `img`
+
+    Images stored in a file are read through a single open stream, volume
+    after volume, so that compressed files are decompressed only once.
+    """
+    proxy = img.dataobj
+    n_vols = img.shape[3] if len(img.shape) > 3 else 1
+    if not (isinstance(proxy, ArrayProxy) and proxy.order == 'F' and
+            len(proxy.shape) <= 4):
+        for start in range(0, n_vols, block_size):
+            yield np.asarray(img.dataobj[:, :, :, start:start + block_size])
+        return
+
+    vol_shape = img.shape[:3]
+    vol_nbytes = int(np.prod(vol_shape)) * proxy.dtype.itemsize
+    with ImageOpener(proxy.file_like, 'rb') as fobj:
+        fobj.seek(proxy.offset)
+        for start in range(0, n_vols, block_size):
+            n_block = min(block_size, n_vols - start)
+            raw = fobj.read(n_block * vol_nbytes)
+            if len(raw) != n_block * vol_nbytes:
+                raise IOError('Unexpected end of data in '
+                              '{0}'.format(proxy.file_like))
+            block = np.frombuffer(raw, dtype=proxy.dtype).reshape(
+                vol_shape + (n_block,), order='F')
+            yield apply_read_scaling(block, proxy.slope, proxy.inter)
+
+
+def _load_echo(img, out):
+    """
+    Reads the data of `img` into `out`, an (S [x T]) view of the loaded data
+    """
+    # memory-mapped if the file is uncompressed and unscaled, otherwise read
+    # into memory once
+    echo_data = np.asanyarray(img.dataobj)
+    # copy straight into the (S x E x T) array through a view indexed like the
+    # image, so this is the only copy
+    echo_view = out.view()
+    echo_view.shape = img.shape
+    echo_view[...] = echo_data
+
+
+def load_data(data, n_echos=None, n_threads=None):
     """
     Coerces input `data` files to required 3D array output
 
@@ -370,6 +1270,10 @@ def load_data(data, n_echos=None):
     n_echos : :obj:`int`, optional
         Number of echos in provided data array. Only necessary if `data` is
         array_like. Default: None
+    n_threads : :obj:`int` or None, optional
+        Number of threads reading echo-specific files concurrently. Each
+        thread holds one decompressed echo in memory while copying it.
+        Default: None (one per echo, up to the number of CPUs)
 
     Returns
     -------
@@ -389,14 +1293,37 @@ def load_data(data, n_echos=None):
             raise ValueError('Cannot run `tedana` with only two echos: '
                              '{}'.format(data))
         else:  # individual echo files were provided (surface or volumetric)
-            fdata = np.stack([utils.load_image(f) for f in data], axis=1)
-            ref_img = check_niimg(data[0])
+            imgs = [check_niimg(f) for f in data]
+            # the first value of each echo gives its (possibly scaled) dtype
+            # without reading the rest of the file
+            dtype = np.result_type(*[
+                np.asanyarray(img.dataobj[(slice(0, 1),) * len(img.shape)])
+                for img in imgs])
+            fdata = np.empty((np.prod(imgs[0].shape[:3]), len(imgs)) +
+                             imgs[0].shape[3:], dtype=dtype)
+            if n_threads is None:
+                n_threads = min(len(imgs), os.cpu_count() or 1)
+            # zlib releases the GIL, so compressed echoes are decompressed
+            # concurrently
+            with ThreadPoolExecutor(max_workers=max(1, n_threads)) as pool:
+                futures = [pool.submit(_load_echo, img, fdata[:, i_echo])
+                           for i_echo, img in enumerate(imgs)]
+                for future in futures:
+                    future.result()
+            ref_img = imgs[0]
             ref_img.header.extensions = []
             return np.atleast_3d(fdata), ref_img
 
     img = check_niimg(data)
     (nx, ny), nz = img.shape[:2], img.shape[2] // n_echos
-    fdata = utils.load_image(img.get_data().reshape(nx, ny, nz, n_echos, -1, order='F'))
+    # the echoes of a memory-mapped image are split without copying
+    img_data = np.asanyarray(img.dataobj).reshape(nx, ny, nz, n_echos, -1,
+                                                  order='F')
+    fdata = np.empty((nx * ny * nz,) + img_data.shape[3:], dtype=img_data.dtype)
+    fdata_view = fdata.view()
+    fdata_view.shape = img_data.shape
+    fdata_view[...] = img_data
+    del img_data
     # create reference image
     ref_img = img.__class__(np.zeros((nx, ny, nz, 1)), affine=img.affine,
                             header=img.header, extra=img.extra)
@@ -9,7 +9,8 @@ import pandas as pd
 from scipy import stats
 
 from tedana import io, utils
-from tedana.stats import getfbounds, computefeats2, get_coeffs
+from tedana.stats import (getfbounds, computefeats2, get_coeffs,
+                          ComponentProjection)
 
 
 LGR = logging.getLogger(__name__)
@@ -20,17 +21,71 @@ F_MAX = 500
 Z_MAX = 8
 
 
+def _component_chunks(n_components, component_nbytes, max_memory=None):
+    """
+    Split components into chunks that fit in a memory budget
+
+    Parameters
+    ----------
+    n_components : :obj:`int`
+        Number of components to process
+    component_nbytes : :obj:`int`
+        Approximate number of bytes of temporary arrays needed per component
+    max_memory : :obj:`float` or None, optional
+        Memory budget for a chunk, in gigabytes. If None, all components are
+        returned in a single chunk. Default is None.
+
+    Returns
+    -------
+    chunks : :obj:`list` of :obj:`slice`
+        Slices of the components in each chunk
+    """
+    if max_memory is None:
+        return [slice(0, n_components)]
+    chunk_size = utils.memory_chunk_size(component_nbytes, max_memory)
+    LGR.debug('Fitting {0} components in chunks of {1}'.format(
+        n_components, chunk_size))
+    return [slice(start, min(start + chunk_size, n_components))
+            for start in range(0, n_components, chunk_size)]
+
+
+def _predicted_maps(betas, X, X_ss, mask):
+    """
+    Yields the echo-specific model predictions of each component
+
+    Parameters
+    ----------
+    betas : (M x E x C) array_like
+        Echo-specific component betas, for the samples in `mask`
+    X : (M x E) array_like
+        Model design, for the samples in `mask`
+    X_ss : (M,) array_like
+        Sum of squares of `X` over echos
+    mask : (S,) array_like
+        Boolean mask of the samples in `betas`
+
+    Yields
+    ------
+    pred : (S x E x 1) :obj:`numpy.ndarray`
+        Predicted values of one component
+    """
+    for i_comp in range(betas.shape[-1]):
+        coeffs = (betas[:, :, i_comp] * X).sum(axis=1) / X_ss
+        yield utils.unmask(X * coeffs[:, np.newaxis], mask)[..., np.newaxis]
+
+
 def dependence_metrics(catd, tsoc, mmix, t2s, tes, ref_img,
                        reindex=False, mmixN=None, algorithm=None, label=None,
-                       out_dir='.', verbose=False):
+                       out_dir='.', verbose=False, max_memory=None,
+                       n_jobs=1):
     """
     Fit TE-dependence and -independence models to components.
 
     Parameters
     ----------
-    catd : (S x E x T) array_like
+    catd : (S x E x T) array_like or :obj:`tedana.utils.MaskedData`
         Input data, where `S` is samples, `E` is echos, and `T` is time
-    tsoc : (S x T) array_like
+    tsoc : (S x T) array_like or :obj:`tedana.utils.MaskedData`
         Optimally combined data
     mmix : (T x C) array_like
         Mixing matrix for converting input data to component space, where `C`
@@ -55,6 +110,13 @@ def dependence_metrics(catd, tsoc, mmix, t2s, tes, ref_img,
         directory.
     verbose : :obj:`bool`, optional
         Whether or not to generate additional files. Default is False.
+    max_memory : :obj:`float` or None, optional
+        Memory budget, in gigabytes, for the temporary arrays used to fit the
+        models. Components are fit in chunks that fit in the budget. If None,
+        all components are fit at once. Default is None.
+    n_jobs : :obj:`int`, optional
+        Number of worker processes used for the spatial clustering of the
+        component maps. -1 uses all available CPUs. Default is 1.
 
     Returns
     -------
@@ -94,8 +156,8 @@ def dependence_metrics(catd, tsoc, mmix, t2s, tes, ref_img,
                 "explained.")
 
     # mask everything we can
-    tsoc = tsoc[mask, :]
-    catd = catd[mask, ...]
+    tsoc = utils.apply_mask(tsoc, mask)
+    catd = utils.apply_mask(catd, mask)
     t2s = t2s[mask]
 
     # demean optimal combination
@@ -123,73 +185,55 @@ def dependence_metrics(catd, tsoc, mmix, t2s, tes, ref_img,
     totvar = (tsoc_B**2).sum()
     totvar_norm = (WTS**2).sum()
 
-    # compute Betas and means over TEs for TE-dependence analysis
-    betas = get_coeffs(utils.unmask(catd, mask),
-                       mmix,
-                       np.repeat(mask[:, np.newaxis], len(tes), axis=1))
-    betas = betas[mask, ...]
+    # compute Betas and means over TEs for TE-dependence analysis, solving
+    # all echoes of the masked data against the same pseudo-inverse
+    betas = ComponentProjection(mmix).coeffs(catd)
     n_voxels, n_echos, n_components = betas.shape
     mu = catd.mean(axis=-1, dtype=float)
     tes = np.reshape(tes, (n_echos, 1))
     fmin, _, _ = getfbounds(n_echos)
 
-    # set up Xmats
-    X1 = mu.T  # Model 1
-    X2 = np.tile(tes, (1, n_voxels)) * mu.T / t2s.T  # Model 2
+    # set up Xmats, with samples along the first axis, and their
+    # sums of squares, which are shared by all components
+    X1 = mu  # Model 1
+    X2 = tes.T * mu / t2s[:, np.newaxis]  # Model 2
+    X1_ss = (X1**2).sum(axis=1)
+    X2_ss = (X2**2).sum(axis=1)
 
     # tables for component selection
-    kappas = np.zeros([n_components])
-    rhos = np.zeros([n_components])
-    varex = np.zeros([n_components])
-    varex_norm = np.zeros([n_components])
-    Z_maps = np.zeros([n_voxels, n_components])
+    varex = (tsoc_B**2).sum(axis=0) / totvar * 100.
+    varex_norm = (WTS**2).sum(axis=0) / totvar_norm
     F_R2_maps = np.zeros([n_voxels, n_components])
     F_S0_maps = np.zeros([n_voxels, n_components])
-    pred_R2_maps = np.zeros([n_voxels, n_echos, n_components])
-    pred_S0_maps = np.zeros([n_voxels, n_echos, n_components])
 
     LGR.info('Fitting TE- and S0-dependent models to components')
-    for i_comp in range(n_components):
-        # size of comp_betas is (n_echoes, n_samples)
-        comp_betas = np.atleast_3d(betas)[:, :, i_comp].T
-        alpha = (np.abs(comp_betas)**2).sum(axis=0)
-        varex[i_comp] = (tsoc_B[:, i_comp]**2).sum() / totvar * 100.
-        varex_norm[i_comp] = (WTS[:, i_comp]**2).sum() / totvar_norm
-
-        # S0 Model
-        # (S,) model coefficient map
-        coeffs_S0 = (comp_betas * X1).sum(axis=0) / (X1**2).sum(axis=0)
-        pred_S0 = X1 * np.tile(coeffs_S0, (n_echos, 1))
-        pred_S0_maps[:, :, i_comp] = pred_S0.T
-        SSE_S0 = (comp_betas - pred_S0)**2
-        SSE_S0 = SSE_S0.sum(axis=0)  # (S,) prediction error map
-        F_S0 = (alpha - SSE_S0) * (n_echos - 1) / (SSE_S0)
-        F_S0_maps[:, i_comp] = F_S0
-
-        # R2 Model
-        coeffs_R2 = (comp_betas * X2).sum(axis=0) / (X2**2).sum(axis=0)
-        pred_R2 = X2 * np.tile(coeffs_R2, (n_echos, 1))
-        pred_R2_maps[:, :, i_comp] = pred_R2.T
-        SSE_R2 = (comp_betas - pred_R2)**2
-        SSE_R2 = SSE_R2.sum(axis=0)
-        F_R2 = (alpha - SSE_R2) * (n_echos - 1) / (SSE_R2)
-        F_R2_maps[:, i_comp] = F_R2
-
-        # compute weights as Z-values
-        wtsZ = (WTS[:, i_comp] - WTS[:, i_comp].mean()) / WTS[:, i_comp].std()
-        wtsZ[np.abs(wtsZ) > Z_MAX] = (Z_MAX * (np.abs(wtsZ) / wtsZ))[
-            np.abs(wtsZ) > Z_MAX]
-        Z_maps[:, i_comp] = wtsZ
-
-        # compute Kappa and Rho
-        F_S0[F_S0 > F_MAX] = F_MAX
-        F_R2[F_R2 > F_MAX] = F_MAX
-        norm_weights = np.abs(wtsZ ** 2.)
-        kappas[i_comp] = np.average(F_R2, weights=norm_weights)
-        rhos[i_comp] = np.average(F_S0, weights=norm_weights)
-    del SSE_S0, SSE_R2, wtsZ, F_S0, F_R2, norm_weights, comp_betas
+    # each component in a chunk needs one (S x E) residual array
+    for comps in _component_chunks(n_components, n_voxels * n_echos * 8,
+                                   max_memory=max_memory):
+        # size of comp_betas is (n_samples, n_echoes, n_chunk_components)
+        comp_betas = betas[:, :, comps]
+        alpha = np.einsum('sec,sec->sc', comp_betas, comp_betas)
+        for X, X_ss, F_maps in ((X1, X1_ss, F_S0_maps), (X2, X2_ss, F_R2_maps)):
+            # (S x C) model coefficient maps
+            coeffs = np.einsum('sec,se->sc', comp_betas, X) / X_ss[:, np.newaxis]
+            pred = X[:, :, np.newaxis] * coeffs[:, np.newaxis, :]
+            resid = np.subtract(comp_betas, pred, out=pred)
+            SSE = np.square(resid, out=resid).sum(axis=1)  # (S x C) prediction error maps
+            F_maps[:, comps] = (alpha - SSE) * (n_echos - 1) / SSE
+        del comp_betas, alpha, coeffs, pred, resid, SSE
+
+    # compute weights as Z-values
+    Z_maps = (WTS - WTS.mean(axis=0)) / WTS.std(axis=0)
+    Z_maps = np.clip(Z_maps, -Z_MAX, Z_MAX)
+
+    # compute Kappa and Rho
+    norm_weights = Z_maps ** 2.
+    weight_sums = norm_weights.sum(axis=0)
+    kappas = (np.minimum(F_R2_maps, F_MAX) * norm_weights).sum(axis=0) / weight_sums
+    rhos = (np.minimum(F_S0_maps, F_MAX) * norm_weights).sum(axis=0) / weight_sums
+    del norm_weights, weight_sums
     if algorithm != 'kundu_v3':
-        del WTS, PSC, tsoc_B
+        WTS = PSC = tsoc_B = None
 
     # tabulate component values
     comptable = np.vstack([kappas, rhos, varex, varex_norm]).T
@@ -199,8 +243,6 @@ def dependence_metrics(catd, tsoc, mmix, t2s, tes, ref_img,
         comptable = comptable[sort_idx, :]
         mmix_new = mmix[:, sort_idx]
         betas = betas[..., sort_idx]
-        pred_R2_maps = pred_R2_maps[:, :, sort_idx]
-        pred_S0_maps = pred_S0_maps[:, :, sort_idx]
         F_R2_maps = F_R2_maps[:, sort_idx]
         F_S0_maps = F_S0_maps[:, sort_idx]
         Z_maps = Z_maps[:, sort_idx]
@@ -217,19 +259,21 @@ def dependence_metrics(catd, tsoc, mmix, t2s, tes, ref_img,
         # Echo-specific weight maps for each of the ICA components.
         io.filewrite(utils.unmask(betas, mask),
                      op.join(out_dir, '{0}betas_catd.nii'.format(label)),
-                     ref_img)
+                     ref_img, copy=False)
 
         # Echo-specific maps of predicted values for R2 and S0 models for each
-        # component.
-        io.filewrite(utils.unmask(pred_R2_maps, mask),
-                     op.join(out_dir, '{0}R2_pred.nii'.format(label)), ref_img)
-        io.filewrite(utils.unmask(pred_S0_maps, mask),
-                     op.join(out_dir, '{0}S0_pred.nii'.format(label)), ref_img)
+        # component, computed and written one component at a time.
+        io.filewrite_blocks(_predicted_maps(betas, X2, X2_ss, mask),
+                            op.join(out_dir, '{0}R2_pred.nii'.format(label)),
+                            ref_img, n_components)
+        io.filewrite_blocks(_predicted_maps(betas, X1, X1_ss, mask),
+                            op.join(out_dir, '{0}S0_pred.nii'.format(label)),
+                            ref_img, n_components)
         # Weight maps used to average metrics across voxels
         io.filewrite(utils.unmask(Z_maps ** 2., mask),
                      op.join(out_dir, '{0}metric_weights.nii'.format(label)),
-                     ref_img)
-    del pred_R2_maps, pred_S0_maps
+                     ref_img, copy=False)
+    del X1, X2
 
     comptable = pd.DataFrame(comptable,
                              columns=['kappa', 'rho',
@@ -239,54 +283,33 @@ def dependence_metrics(catd, tsoc, mmix, t2s, tes, ref_img,
 
     # Generate clustering criteria for component selection
     if algorithm in ['kundu_v2', 'kundu_v3']:
-        Z_clmaps = np.zeros([n_voxels, n_components], bool)
-        F_R2_clmaps = np.zeros([n_voxels, n_components], bool)
-        F_S0_clmaps = np.zeros([n_voxels, n_components], bool)
-        Br_R2_clmaps = np.zeros([n_voxels, n_components], bool)
-        Br_S0_clmaps = np.zeros([n_voxels, n_components], bool)
-
         LGR.info('Performing spatial clustering of components')
         csize = np.max([int(n_voxels * 0.0005) + 5, 20])
         LGR.debug('Using minimum cluster size: {}'.format(csize))
-        for i_comp in range(n_components):
-            # Cluster-extent threshold and binarize F-maps
-            ccimg = io.new_nii_like(
-                ref_img,
-                np.squeeze(utils.unmask(F_R2_maps[:, i_comp], mask)))
-            F_R2_clmaps[:, i_comp] = utils.threshold_map(
-                ccimg, min_cluster_size=csize, threshold=fmin, mask=mask,
-                binarize=True)
-            countsigFR2 = F_R2_clmaps[:, i_comp].sum()
-
-            ccimg = io.new_nii_like(
-                ref_img,
-                np.squeeze(utils.unmask(F_S0_maps[:, i_comp], mask)))
-            F_S0_clmaps[:, i_comp] = utils.threshold_map(
-                ccimg, min_cluster_size=csize, threshold=fmin, mask=mask,
-                binarize=True)
-            countsigFS0 = F_S0_clmaps[:, i_comp].sum()
-
-            # Cluster-extent threshold and binarize Z-maps with CDT of p < 0.05
-            ccimg = io.new_nii_like(
-                ref_img,
-                np.squeeze(utils.unmask(Z_maps[:, i_comp], mask)))
-            Z_clmaps[:, i_comp] = utils.threshold_map(
-                ccimg, min_cluster_size=csize, threshold=1.95, mask=mask,
-                binarize=True)
-
-            # Cluster-extent threshold and binarize ranked signal-change map
-            ccimg = io.new_nii_like(
-                ref_img,
-                utils.unmask(stats.rankdata(tsoc_Babs[:, i_comp]), mask))
-            Br_R2_clmaps[:, i_comp] = utils.threshold_map(
-                ccimg, min_cluster_size=csize,
-                threshold=(max(tsoc_Babs.shape) - countsigFR2), mask=mask,
-                binarize=True)
-            Br_S0_clmaps[:, i_comp] = utils.threshold_map(
-                ccimg, min_cluster_size=csize,
-                threshold=(max(tsoc_Babs.shape) - countsigFS0), mask=mask,
-                binarize=True)
-        del ccimg, tsoc_Babs
+        # the neighbor graph of the mask is shared by all maps
+        graph = utils.MaskGraph(mask, io.ReferenceGeometry(ref_img).shape[:3])
+
+        # Cluster-extent threshold and binarize F-maps
+        F_R2_clmaps = graph.threshold(F_R2_maps, csize, threshold=fmin,
+                                      n_jobs=n_jobs)
+        F_S0_clmaps = graph.threshold(F_S0_maps, csize, threshold=fmin,
+                                      n_jobs=n_jobs)
+        countsigFR2 = F_R2_clmaps.sum(axis=0)
+        countsigFS0 = F_S0_clmaps.sum(axis=0)
+
+        # Cluster-extent threshold and binarize Z-maps with CDT of p < 0.05
+        Z_clmaps = graph.threshold(Z_maps, csize, threshold=1.95,
+                                   n_jobs=n_jobs)
+
+        # Cluster-extent threshold and binarize ranked signal-change map
+        Br_maps = np.apply_along_axis(stats.rankdata, 0, tsoc_Babs)
+        Br_R2_clmaps = graph.threshold(
+            Br_maps, csize, threshold=(max(tsoc_Babs.shape) - countsigFR2),
+            n_jobs=n_jobs)
+        Br_S0_clmaps = graph.threshold(
+            Br_maps, csize, threshold=(max(tsoc_Babs.shape) - countsigFS0),
+            n_jobs=n_jobs)
+        del graph, Br_maps, tsoc_Babs
 
         if algorithm == 'kundu_v2':
             # WTS, tsoc_B, PSC, and F_S0_maps are not used by Kundu v2.5
@@ -303,15 +326,86 @@ def dependence_metrics(catd, tsoc, mmix, t2s, tes, ref_img,
         else:
             raise ValueError('Algorithm "{0}" not recognized.'.format(algorithm))
 
-        seldict = {}
-        for vv in selvars:
-            seldict[vv] = eval(vv)
+        maps = {'WTS': WTS, 'tsoc_B': tsoc_B, 'PSC': PSC,
+                'Z_maps': Z_maps, 'F_R2_maps': F_R2_maps, 'F_S0_maps': F_S0_maps,
+                'Z_clmaps': Z_clmaps, 'F_R2_clmaps': F_R2_clmaps,
+                'F_S0_clmaps': F_S0_clmaps, 'Br_R2_clmaps': Br_R2_clmaps,
+                'Br_S0_clmaps': Br_S0_clmaps}
+        seldict = {vv: maps[vv] for vv in selvars}
     else:
         seldict = None
 
     return comptable, seldict, betas, mmix_new
 
 
+def _unique_log_moments(values, select):
+    """
+    Describes the log10 of the unique selected values of each column
+
+    Parameters
+    ----------
+    values : (S x C) array_like
+        Values, such as F-statistic maps of `C` components
+    select : (S x C) array_like
+        Boolean array of the values to describe
+
+    Returns
+    -------
+    n, mean, var : (C,) :obj:`numpy.ndarray`
+        Number, mean and variance (with one degree of freedom) of the log10
+        of the unique selected values
+    """
+    values = np.asarray(values, dtype=float)
+    select = np.asarray(select, dtype=bool)
+    # selected NaNs propagate, as they do through np.unique
+    has_nan = (np.isnan(values) & select).any(axis=0)
+
+    # pack the selected values of each column into a row, padded with NaNs
+    # (which sort last), so that only the selected values are sorted
+    comps, samples = np.nonzero(select.T)
+    counts = np.bincount(comps, minlength=values.shape[1])
+    cols = np.arange(comps.size) - (np.cumsum(counts) - counts)[comps]
+    width = counts.max() if counts.size else 0
+    packed = np.full((values.shape[1], width), np.nan)
+    packed[comps, cols] = values[samples, comps]
+    packed.sort(axis=1)
+    unique = ~np.isnan(packed)
+    unique[:, 1:] &= packed[:, 1:] != packed[:, :-1]
+
+    n = unique.sum(axis=1)
+    logs = np.log10(packed, out=np.zeros(packed.shape), where=unique)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = logs.sum(axis=1) / n
+        var = (np.where(unique, logs - mean[:, np.newaxis], 0)**2).sum(axis=1) / (n - 1)
+    mean[has_nan] = np.nan
+    return n, mean, var
+
+
+def _welch_ttest(moments1, moments2):
+    """
+    Performs Welch's two-sample t-test of each column from group moments
+
+    Parameters
+    ----------
+    moments1, moments2 : :obj:`tuple` of (C,) array_like
+        Number, mean and variance of the two samples, as returned by
+        :func:`_unique_log_moments`
+
+    Returns
+    -------
+    t, p : (C,) :obj:`numpy.ndarray`
+        T-statistics and two-sided p-values, as :func:`scipy.stats.ttest_ind`
+        with ``equal_var=False``
+    """
+    (n1, mean1, var1), (n2, mean2, var2) = moments1, moments2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        se1, se2 = var1 / n1, var2 / n2
+        t = (mean1 - mean2) / np.sqrt(se1 + se2)
+        df = (se1 + se2)**2 / (se1**2 / (n1 - 1) + se2**2 / (n2 - 1))
+        p = 2 * stats.t.sf(np.abs(t), df)
+    return t, p
+
+
 def kundu_metrics(comptable, metric_maps):
     """
     Compute metrics used by Kundu v2.5 and v3.2 decision trees.
@@ -353,16 +447,8 @@ def kundu_metrics(comptable, metric_maps):
     - dice_FS0: Dice value of cluster-extent thresholded maps of S0-model betas
       and F-statistics.
     """
-    comptable['dice_FR2'] = np.zeros(comptable.shape[0])
-    comptable['dice_FS0'] = np.zeros(comptable.shape[0])
-    for i_comp in comptable.index:
-        comptable.loc[i_comp, 'dice_FR2'] = utils.dice(Br_R2_clmaps[:, i_comp],
-                                                       F_R2_clmaps[:, i_comp])
-        comptable.loc[i_comp, 'dice_FS0'] = utils.dice(Br_S0_clmaps[:, i_comp],
-                                                       F_S0_clmaps[:, i_comp])
-
-    comptable.loc[np.isnan(comptable['dice_FR2']), 'dice_FR2'] = 0
-    comptable.loc[np.isnan(comptable['dice_FS0']), 'dice_FS0'] = 0
+    comptable['dice_FR2'] = utils.dice(Br_R2_clmaps, F_R2_clmaps, axis=0)
+    comptable['dice_FS0'] = utils.dice(Br_S0_clmaps, F_S0_clmaps, axis=0)
 
     """
     Generate three metrics of component noise:
@@ -373,25 +459,15 @@ def kundu_metrics(comptable, metric_maps):
       in clusters) for R2 model.
     - signal-noise_p: P-value from t-test.
     """
-    comptable['countnoise'] = 0
-    comptable['signal-noise_t'] = 0
-    comptable['signal-noise_p'] = 0
-    for i_comp in comptable.index:
-        # index voxels significantly loading on component but not from clusters
-        comp_noise_sel = ((np.abs(Z_maps[:, i_comp]) > 1.95) &
-                          (Z_clmaps[:, i_comp] == 0))
-        comptable.loc[i_comp, 'countnoise'] = np.array(
-            comp_noise_sel, dtype=np.int).sum()
-        # NOTE: Why only compare distributions of *unique* F-statistics?
-        noise_FR2_Z = np.log10(np.unique(F_R2_maps[comp_noise_sel, i_comp]))
-        signal_FR2_Z = np.log10(np.unique(
-            F_R2_maps[Z_clmaps[:, i_comp] == 1, i_comp]))
-        (comptable.loc[i_comp, 'signal-noise_t'],
-         comptable.loc[i_comp, 'signal-noise_p']) = stats.ttest_ind(
-             signal_FR2_Z, noise_FR2_Z, equal_var=False)
-
-    comptable.loc[np.isnan(comptable['signal-noise_t']), 'signal-noise_t'] = 0
-    comptable.loc[np.isnan(comptable['signal-noise_p']), 'signal-noise_p'] = 0
+    # index voxels significantly loading on component but not from clusters
+    noise_sel = (np.abs(Z_maps) > 1.95) & (Z_clmaps == 0)
+    comptable['countnoise'] = noise_sel.sum(axis=0)
+    # NOTE: Why only compare distributions of *unique* F-statistics?
+    signal_t, signal_p = _welch_ttest(
+        _unique_log_moments(F_R2_maps, Z_clmaps == 1),
+        _unique_log_moments(F_R2_maps, noise_sel))
+    comptable['signal-noise_t'] = np.nan_to_num(signal_t)
+    comptable['signal-noise_p'] = np.nan_to_num(signal_p)
 
     """
     Assemble decision table with five metrics:
@@ -40,7 +40,7 @@ def computefeats2(data, mmix, mask=None, normalize=True):
 
     Parameters
     ----------
-    data : (S x T) array_like
+    data : (S x T) array_like or :obj:`tedana.utils.MaskedData`
         Input data
     mmix : (T [x C]) array_like
         Mixing matrix for converting input data to component space, where `C`
@@ -73,7 +73,7 @@ def computefeats2(data, mmix, mask=None, normalize=True):
 
     # demean masked data
     if mask is not None:
-        data = data[mask, ...]
+        data = utils.apply_mask(data, mask)
     data_vn = stats.zscore(data, axis=-1)
 
     # get betas of `data`~`mmix` and limit to range [-0.999, 0.999]
@@ -101,7 +101,7 @@ def get_coeffs(data, X, mask=None, add_const=False):
 
     Parameters
     ----------
-    data : (S [x E] x T) array_like
+    data : (S [x E] x T) array_like or :obj:`tedana.utils.MaskedData`
         Array where `S` is samples, `E` is echoes, and `T` is time
     X : (T [x C]) array_like
         Array where `T` is time and `C` is predictor variables
@@ -131,7 +131,7 @@ def get_coeffs(data, X, mask=None, add_const=False):
         elif data.shape[0] != mask.shape[0]:
             raise ValueError('First dimensions of data ({0}) and mask ({1}) do not '
                              'match'.format(data.shape[0], mask.shape[0]))
-        mdata = data[mask, :].T
+        mdata = utils.apply_mask(data, mask).T
     else:
         mdata = data.T
 
@@ -152,3 +152,83 @@ def get_coeffs(data, X, mask=None, add_const=False):
         betas = utils.unmask(betas, mask)
 
     return betas
+
+
+class ComponentProjection(object):
+    """
+    Least-squares projection of data onto the components of a mixing matrix
+
+    The pseudo-inverse of the mixing matrix is computed once, so that fitting
+    several data sets against the same components takes one matrix product
+    each instead of a least-squares solve.
+
+    Parameters
+    ----------
+    mmix : (T [x C]) array_like
+        Mixing matrix, where `T` is time and `C` is components
+
+    Attributes
+    ----------
+    mmix : (T x C) :obj:`numpy.ndarray`
+        Mixing matrix
+    pinv : (C x T) :obj:`numpy.ndarray`
+        Moore-Penrose pseudo-inverse of `mmix`
+    """
+    def __init__(self, mmix):
+        mmix = np.asarray(mmix)
+        if mmix.ndim == 1:
+            mmix = mmix[:, np.newaxis]
+        elif mmix.ndim != 2:
+            raise ValueError('Parameter mmix should be 1d or 2d, not '
+                             '{0}d'.format(mmix.ndim))
+        self.mmix = mmix
+        self.pinv = np.linalg.pinv(mmix)
+
+    def coeffs(self, data, demean=False):
+        """
+        Performs least-squares fit of the components against `data`
+
+        Parameters
+        ----------
+        data : (S [x E] x T) array_like
+            Array where `S` is samples, `E` is echoes, and `T` is time
+        demean : :obj:`bool`, optional
+            Fit the data demeaned over time. Default: False
+
+        Returns
+        -------
+        betas : (S [x E] x C) :obj:`numpy.ndarray`
+            Array of `S` sample betas for `C` components
+        """
+        data = np.asarray(data)
+        if data.shape[-1] != self.mmix.shape[0]:
+            raise ValueError('Last dimension (dimension {0}) of data ({1}) '
+                             'does not match first dimension of mmix '
+                             '({2})'.format(data.ndim, data.shape[-1],
+                                            self.mmix.shape[0]))
+        # samples (and echoes) are solved together in a single product
+        betas = np.dot(data.reshape(-1, data.shape[-1]), self.pinv.T)
+        betas = betas.reshape(data.shape[:-1] + (-1,))
+        if demean:
+            betas = self.demean(betas, data.mean(axis=-1))
+        return betas
+
+    def demean(self, betas, means):
+        """
+        Converts `betas` of data into those of the data demeaned over time
+
+        Parameters
+        ----------
+        betas : (S [x E] x C) array_like
+            Betas of data, as returned by :meth:`coeffs`
+        means : (S [x E]) array_like
+            Means of the data over time
+
+        Returns
+        -------
+        betas : (S [x E] x C) :obj:`numpy.ndarray`
+            Betas of the demeaned data
+        """
+        # the fit is linear, so removing the mean removes its (constant
+        # time series') betas
+        return betas - np.multiply.outer(means, self.pinv.sum(axis=1))
@@ -2,9 +2,10 @@
 Tests for tedana.combine
 """
 
+import nibabel as nib
 import numpy as np
 
-from tedana import combine
+from tedana import combine, io, utils
 
 
 def test__combine_t2s():
@@ -25,6 +26,18 @@ def test__combine_t2s():
     t2s = np.random.random((n_voxels, 1))  # M x 1
     comb = combine._combine_t2s(data, tes, t2s)
     assert comb.shape == (n_voxels, n_trs)
+    alpha = np.tile((tes * np.exp(-tes / t2s))[:, :, np.newaxis], (1, 1, n_trs))
+    assert np.allclose(comb, np.average(data, axis=1, weights=alpha))
+
+    # Combination in single precision, with T2* values that keep the weights
+    # within float32 range
+    t2s = np.random.uniform(10, 60, (n_voxels, 1))
+    alpha = np.tile((tes * np.exp(-tes / t2s))[:, :, np.newaxis], (1, 1, n_trs))
+    comb = combine._combine_t2s(data.astype(np.float32), tes, t2s,
+                                keep_dtype=True)
+    assert comb.dtype == np.float32
+    assert np.allclose(comb, np.average(data, axis=1, weights=alpha),
+                       rtol=1e-5)
 
 
 def test__combine_paid():
@@ -68,3 +81,40 @@ def test_make_optcom():
     # Normal STE call
     comb = combine.make_optcom(data, tes, mask, t2s=None, combmode='paid')
     assert comb.shape == (n_voxels, n_trs)
+
+    # Masked data stay masked
+    masked_comb = combine.make_optcom(utils.MaskedData.from_full(data, mask),
+                                      tes, mask, t2s=None, combmode='paid')
+    assert isinstance(masked_comb, utils.MaskedData)
+    assert np.array_equal(masked_comb.unmask(), comb)
+
+
+def test_write_optcom(tmp_path):
+    """
+    Test tedana.combine.write_optcom against tedana.combine.make_optcom
+    """
+    np.random.seed(0)
+    shape, n_echos, n_trs = (4, 5, 3), 3, 10
+    n_voxels = np.prod(shape)
+    tes = np.array([10, 20, 30])
+    echo_files = []
+    for i_echo in range(n_echos):
+        echo_img = nib.Nifti1Image(np.random.random(shape + (n_trs,)), np.eye(4))
+        echo_files.append(str(tmp_path / 'echo{}.nii'.format(i_echo + 1)))
+        echo_img.to_filename(echo_files[-1])
+    data, ref_img = io.load_data(echo_files, n_echos=n_echos)
+    mask = np.zeros(n_voxels, dtype=bool)
+    mask[:40] = True
+
+    for t2s, combmode in [(np.random.uniform(10, 60, n_voxels), 't2s'),
+                          (np.random.uniform(10, 60, (n_voxels, n_trs)), 't2s'),
+                          (None, 'paid')]:
+        # blocks of three volumes
+        fname = combine.write_optcom(echo_files, tes, mask,
+                                     str(tmp_path / 'ts_OC.nii'), ref_img,
+                                     t2s=t2s, combmode=combmode,
+                                     max_memory=3 * n_voxels * 7 * 8 / 1e9)
+        comb = combine.make_optcom(data, tes, mask, t2s=t2s, combmode=combmode)
+        out_img = nib.load(fname)
+        assert out_img.shape == shape + (n_trs,)
+        assert np.allclose(utils.load_image(out_img), comb)
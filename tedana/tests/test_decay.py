@@ -2,6 +2,7 @@
 Tests for tedana.decay
 """
 
+import logging
 import os.path as op
 
 import numpy as np
@@ -60,6 +61,269 @@ def test_fit_decay_ts(testdata1):
     assert s0vG.ndim == 2
 
 
+def test__fit_loglin():
+    """
+    The closed-form log-linear fit should match a least-squares fit of the
+    log signal against the TEs repeated over time.
+    """
+    np.random.seed(0)
+    n_samples, n_echos, n_vols = 50, 4, 10
+    tes = np.array([14.5, 38.5, 62.5, 86.5])
+    data = np.random.random((n_samples, n_echos, n_vols)) * 1000
+    log_data = np.log(np.abs(data) + 1)
+
+    t2s, s0 = me._fit_loglin(log_data.mean(axis=-1), tes)
+
+    X = np.repeat(np.column_stack([np.ones(n_echos), -tes]), n_vols, axis=0)
+    betas = np.linalg.lstsq(X, log_data.reshape(n_samples, -1).T, rcond=None)[0]
+    assert np.allclose(t2s, 1. / betas[1, :])
+    assert np.allclose(s0, np.exp(betas[0, :]))
+
+
+def test__fit_monoexp():
+    """
+    The batched monoexponential fit should agree with scipy's curve_fit on
+    the full time series, and flag samples that cannot be fit.
+    """
+    from scipy.optimize import curve_fit
+
+    np.random.seed(0)
+    n_samples, n_vols = 20, 10
+    tes = np.array([14.5, 38.5, 62.5, 86.5])
+    s0_true = np.random.uniform(500, 3000, n_samples)
+    t2s_true = np.random.uniform(15, 80, n_samples)
+    data = me.mono_exp(tes[np.newaxis, :, np.newaxis],
+                       s0_true[:, np.newaxis, np.newaxis],
+                       t2s_true[:, np.newaxis, np.newaxis])
+    data = data + np.random.normal(0, 30, (n_samples, len(tes), n_vols))
+
+    t2s_init, s0_init = me._fit_loglin(np.log(np.abs(data) + 1).mean(axis=-1), tes)
+    t2s_init[0] = np.inf
+    s0, t2s, failed = me._fit_monoexp(data.mean(axis=-1), tes, s0_init, t2s_init)
+    assert failed[0] and not failed[1:].any()
+    assert s0[0] == s0_init[0] and t2s[0] == t2s_init[0]
+
+    for i_samp in range(1, n_samples):
+        popt, _ = curve_fit(me.mono_exp, np.repeat(tes, n_vols),
+                            data[i_samp].ravel(),
+                            p0=(s0_init[i_samp], t2s_init[i_samp]))
+        assert np.allclose(popt, [s0[i_samp], t2s[i_samp]], rtol=1e-4)
+
+
+def test_fit_decay_n_jobs(testdata1):
+    """
+    Fitting voxel chunks in worker processes should give the same results as
+    the serial fit.
+    """
+    serial = me.fit_decay(testdata1['data'], testdata1['tes'],
+                          testdata1['mask'], testdata1['mask_sum'], 'curvefit')
+    parallel = me.fit_decay(testdata1['data'], testdata1['tes'],
+                            testdata1['mask'], testdata1['mask_sum'], 'curvefit',
+                            n_jobs=2)
+    for serial_arr, parallel_arr in zip(serial, parallel):
+        assert np.array_equal(serial_arr, parallel_arr)
+
+
+def test_fit_decay_ts_n_jobs(testdata1, monkeypatch):
+    """
+    One pool of worker processes should be reused for every echo count and
+    chunk of voxels.
+    """
+    pools = []
+    pool_cls = me.multiprocessing.Pool
+
+    def counting_pool(*args, **kwargs):
+        pools.append(args)
+        return pool_cls(*args, **kwargs)
+
+    monkeypatch.setattr(me.multiprocessing, 'Pool', counting_pool)
+    # queued writes are waited for before the workers are forked
+    monkeypatch.setattr(io, 'wait_for_writes', lambda: pools.append('wait'))
+    data = testdata1['data'][..., :5]
+    args = (data, testdata1['tes'], testdata1['mask'], testdata1['mask_sum'],
+            'curvefit')
+    serial = me.fit_decay_ts(*args, max_memory=1e-3)
+    parallel = me.fit_decay_ts(*args, n_jobs=2, max_memory=1e-3)
+    assert pools[0] == 'wait' and len(pools) == 2
+    for serial_arr, parallel_arr in zip(serial, parallel):
+        assert np.array_equal(serial_arr, parallel_arr)
+    me.fit_decay(*args, n_jobs=2)
+    assert len(pools) == 4
+    # no processes are started for the log-linear fit
+    me.fit_decay(*args[:-1], 'loglin', n_jobs=2)
+    assert len(pools) == 4
+
+    for func in [me.fit_decay, me.fit_decay_ts]:
+        with pytest.raises(ValueError):
+            func(*args, n_jobs=0)
+    with pytest.raises(ValueError):
+        me.fit_decay_window(*args, window_size=3, n_jobs=0)
+
+
+def test_fit_decay_ts_matches_fit_decay(testdata1):
+    """
+    Fitting all volumes at once should match fitting each volume separately.
+    """
+    data = testdata1['data'][:, :, :2]
+    t2s_limited_ts, s0_limited_ts, t2s_full_ts, s0_full_ts = me.fit_decay_ts(
+        data, testdata1['tes'], testdata1['mask'], testdata1['mask_sum'],
+        testdata1['fittype'])
+    for vol in range(data.shape[-1]):
+        t2s_limited, s0_limited, _, _, t2s_full, s0_full = me.fit_decay(
+            data[:, :, vol], testdata1['tes'], testdata1['mask'],
+            testdata1['mask_sum'], testdata1['fittype'])
+        assert np.allclose(t2s_limited_ts[:, vol], t2s_limited)
+        assert np.allclose(s0_limited_ts[:, vol], s0_limited)
+        assert np.allclose(t2s_full_ts[:, vol], t2s_full)
+        assert np.allclose(s0_full_ts[:, vol], s0_full)
+
+
+def test_fit_decay_not_verbose(testdata1):
+    """
+    Fitting each voxel only with its adaptive mask echo count should give the
+    same limited and full maps, without the per-echo-count estimates.
+    """
+    verbose_outputs = me.fit_decay(testdata1['data'], testdata1['tes'],
+                                   testdata1['mask'], testdata1['mask_sum'],
+                                   testdata1['fittype'])
+    outputs = me.fit_decay(testdata1['data'], testdata1['tes'],
+                           testdata1['mask'], testdata1['mask_sum'],
+                           testdata1['fittype'], verbose=False)
+    assert outputs[2] is None
+    assert outputs[3] is None
+    for i_out in [0, 1, 4, 5]:
+        assert np.allclose(outputs[i_out], verbose_outputs[i_out])
+
+
+def test_fit_decay_max_memory(testdata1):
+    """
+    Processing voxels in chunks should not change the estimates.
+    """
+    for verbose in [True, False]:
+        outputs = me.fit_decay(testdata1['data'], testdata1['tes'],
+                               testdata1['mask'], testdata1['mask_sum'],
+                               'curvefit', verbose=verbose)
+        chunked = me.fit_decay(testdata1['data'], testdata1['tes'],
+                               testdata1['mask'], testdata1['mask_sum'],
+                               'curvefit', verbose=verbose, max_memory=1e-4)
+        for out, chunked_out in zip(outputs, chunked):
+            assert np.array_equal(out, chunked_out)
+
+    outputs = me.fit_decay_ts(testdata1['data'], testdata1['tes'],
+                              testdata1['mask'], testdata1['mask_sum'],
+                              testdata1['fittype'])
+    chunked = me.fit_decay_ts(testdata1['data'], testdata1['tes'],
+                              testdata1['mask'], testdata1['mask_sum'],
+                              testdata1['fittype'], max_memory=1e-4)
+    for out, chunked_out in zip(outputs, chunked):
+        assert np.array_equal(out, chunked_out)
+
+
+def test_fit_decay_max_memory_getstats(testdata1, monkeypatch):
+    """
+    The temporaries of the fit statistics should count toward the budget.
+    """
+    calls = []
+    mask_chunks = me._mask_chunks
+
+    def spy(mask, sample_nbytes, max_memory=None):
+        chunks = mask_chunks(mask, sample_nbytes, max_memory=max_memory)
+        calls.append((sample_nbytes, len(chunks)))
+        return chunks
+
+    monkeypatch.setattr(me, '_mask_chunks', spy)
+    data = testdata1['data']
+    n_values = data.shape[1] * data.shape[2]
+    for fittype, getstats in [('loglin', False), ('loglin', True),
+                              ('curvefit', True)]:
+        me.fit_decay(data, testdata1['tes'], testdata1['mask'],
+                     testdata1['mask_sum'], fittype, verbose=False,
+                     max_memory=1e-4, getstats=getstats)
+    # data and log, plus squares, plus a float copy of the data
+    itemsize = data.dtype.itemsize
+    assert [nbytes for nbytes, _ in calls] == [
+        n_values * (itemsize + 8), n_values * (itemsize + 16),
+        n_values * (itemsize + 24)]
+    n_chunks = [n for _, n in calls]
+    assert n_chunks[0] < n_chunks[1] < n_chunks[2]
+
+
+def test_fit_decay_window(testdata1):
+    """
+    Each volume's estimate should match a fit to the window of volumes
+    centered on it.
+    """
+    window_size = 3
+    for fittype in ['loglin', 'curvefit']:
+        outputs = me.fit_decay_window(testdata1['data'], testdata1['tes'],
+                                      testdata1['mask'], testdata1['mask_sum'],
+                                      fittype, window_size)
+        n_vols = testdata1['data'].shape[-1]
+        for vol, start in enumerate([0, 0, 1, 2, 2]):
+            t2s_limited, s0_limited, _, _, t2s_full, s0_full = me.fit_decay(
+                testdata1['data'][:, :, start:start + window_size],
+                testdata1['tes'], testdata1['mask'], testdata1['mask_sum'],
+                fittype, verbose=False)
+            # running sums differ from direct sums by rounding, which matters
+            # for voxels with near-zero R2* estimates
+            assert outputs[0].shape == (len(testdata1['mask']), n_vols)
+            assert np.allclose(outputs[0][:, vol], t2s_limited, rtol=1e-3)
+            assert np.allclose(outputs[1][:, vol], s0_limited, rtol=1e-3)
+            assert np.allclose(outputs[2][:, vol], t2s_full, rtol=1e-3)
+            assert np.allclose(outputs[3][:, vol], s0_full, rtol=1e-3)
+
+    with pytest.raises(ValueError):
+        me.fit_decay_window(testdata1['data'], testdata1['tes'],
+                            testdata1['mask'], testdata1['mask_sum'],
+                            'loglin', 0)
+
+
+def test_fit_decay_window_report(testdata1, caplog):
+    """
+    The report should give the window size after clamping it to the run.
+    """
+    n_vols = testdata1['data'].shape[-1]
+    with caplog.at_level(logging.INFO, logger='REPORT'):
+        me.fit_decay_window(testdata1['data'], testdata1['tes'],
+                            testdata1['mask'], testdata1['mask_sum'],
+                            'loglin', n_vols + 10)
+    messages = [rec.getMessage() for rec in caplog.records
+                if rec.name == 'REPORT']
+    assert messages == ['T2* and S0 were estimated for each volume from the '
+                        '{0} volumes surrounding it.'.format(n_vols)]
+
+
+def test_fit_decay_getstats(testdata1):
+    """
+    Standard errors should match an ordinary least squares fit of the
+    log-linear model to every volume.
+    """
+    data, tes = testdata1['data'], np.array(testdata1['tes'])
+    mask, masksum = testdata1['mask'], testdata1['mask_sum']
+    outputs = me.fit_decay(data, tes, mask, masksum, 'loglin', getstats=True)
+    assert len(outputs) == 9
+    t2s_se, s0_se, rsquared = outputs[6:]
+    assert t2s_se.shape == s0_se.shape == rsquared.shape == mask.shape
+
+    # statistics are the same whether or not every echo count is fit
+    fast_outputs = me.fit_decay(data, tes, mask, masksum, 'loglin',
+                                verbose=False, getstats=True)
+    for i_out in range(6, 9):
+        assert np.allclose(outputs[i_out], fast_outputs[i_out])
+
+    voxel = np.where(masksum == len(tes))[0][0]
+    n_vols = data.shape[-1]
+    design = np.column_stack([np.ones(len(tes) * n_vols),
+                              -np.repeat(tes, n_vols)])
+    log_data = np.log(np.abs(data[voxel]) + 1).ravel()
+    betas, sse = np.linalg.lstsq(design, log_data, rcond=None)[:2]
+    cov = sse[0] / (design.shape[0] - 2) * np.linalg.inv(design.T @ design)
+    assert np.isclose(s0_se[voxel], np.exp(betas[0]) * np.sqrt(cov[0, 0]),
+                      rtol=1e-4)
+    assert np.isclose(t2s_se[voxel], np.sqrt(cov[1, 1]) / betas[1] ** 2,
+                      rtol=1e-4)
+    assert 0 <= rsquared[voxel] <= 1
+
 # SMOKE TESTS
 
 def test_smoke_fit_decay():
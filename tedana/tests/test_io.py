@@ -2,12 +2,17 @@
 Tests for tedana.io
 """
 
+import gzip
+import time
+
 import nibabel as nib
 import numpy as np
 import pytest
 import pandas as pd
+from nilearn.image import new_img_like
 
 from tedana import io as me
+from tedana import utils
 from tedana.tests.test_utils import fnames, tes
 
 from tedana.tests.utils import get_test_data_path
@@ -24,10 +29,252 @@ def test_new_nii_like():
     assert nimg.shape == (39, 50, 33, 3, 5)
 
 
+def test_reference_geometry():
+    data, ref = me.load_data(fnames, n_echos=len(tes))
+    geom = me.ReferenceGeometry(ref)
+    assert geom.shape == ref.shape
+    assert np.array_equal(geom.affine, ref.affine)
+    assert me.ReferenceGeometry(geom).shape == ref.shape
+
+    # images are built as from the reference image itself
+    arr = np.random.random((64350, 5))
+    nimg = me.new_nii_like(geom, arr)
+    exp = new_img_like(ref, arr.reshape(39, 50, 33, 5), copy_header=True)
+    exp.set_data_dtype(arr.dtype)
+    assert nimg.header.binaryblock == exp.header.binaryblock
+    assert np.array_equal(nimg.get_fdata(), exp.get_fdata())
+
+
 def test_filewrite():
     pass
 
 
+def test_async_filewrite(tmp_path):
+    ref_img = os.path.join(data_dir, 'mask.nii.gz')
+    data = np.random.random((64350, 4))
+    fname = str(tmp_path / 'async.nii')
+
+    me.enable_async_writes(n_threads=2, max_pending=1)
+    name = me.filewrite(data, fname, ref_img)
+    expected = data.copy()
+    data[:] = 0  # the queued write must not see changes made afterwards
+    me.flush_writes()
+
+    assert name == str(tmp_path / 'async.nii.gz')
+    out = nib.load(name).get_fdata().reshape(-1, 4)
+    assert np.allclose(out, expected)
+
+    # errors from the writer threads are raised when flushing
+    me.enable_async_writes()
+    me.filewrite(data, str(tmp_path / 'missing' / 'async.nii'), ref_img)
+    with pytest.raises(Exception):
+        me.flush_writes()
+    # writes are synchronous again afterwards
+    me.flush_writes()
+
+
+def test_async_filewrite_copy(tmp_path, monkeypatch):
+    # data that are not modified again are written without a copy
+    ref_img = os.path.join(data_dir, 'mask.nii.gz')
+    data = np.random.random((64350, 2))
+    queued = []
+    write_image = me._write_image
+
+    def record_write(data, *args, **kwargs):
+        queued.append(data)
+        write_image(data, *args, **kwargs)
+
+    monkeypatch.setattr(me, '_write_image', record_write)
+    with me.output_session():
+        me.filewrite(data, str(tmp_path / 'copied'), ref_img)
+        me.filewrite(data, str(tmp_path / 'viewed'), ref_img, copy=False)
+    assert not np.shares_memory(queued[0], data)
+    assert np.shares_memory(queued[1], data)
+    assert not queued[1].flags.writeable
+    assert data.flags.writeable
+    assert np.allclose(nib.load(str(tmp_path / 'viewed.nii.gz')).get_fdata(),
+                       data.reshape(nib.load(ref_img).shape + (2,)))
+
+
+def test_wait_for_writes(tmp_path, monkeypatch):
+    ref_img = os.path.join(data_dir, 'mask.nii.gz')
+    written = []
+    write_image = me._write_image
+
+    def slow_write(*args, **kwargs):
+        time.sleep(0.2)
+        write_image(*args, **kwargs)
+        written.append(args[1])
+
+    monkeypatch.setattr(me, '_write_image', slow_write)
+    me.wait_for_writes()
+    me.enable_async_writes()
+    name = me.filewrite(np.zeros(64350), str(tmp_path / 'wait'), ref_img)
+    me.wait_for_writes()
+    # the write is done, but the writer threads keep running
+    assert written == [name]
+    assert 'executor' in me._WRITER
+    me.flush_writes()
+
+
+def test_output_session(tmp_path, caplog):
+    ref_img = os.path.join(data_dir, 'mask.nii.gz')
+    data = np.random.random((64350, 2))
+
+    with me.output_session(compression='fast', n_jobs=2):
+        assert me._COMPRESSION['n_threads'] == 2
+        me.filewrite(data, str(tmp_path / 'fast'), ref_img)
+    # the compressing threads are stopped with the writers
+    assert not me._GZIP_POOL
+    assert me._COMPRESSION['n_threads'] is None
+
+    with me.output_session(compression='none', precision='float32'):
+        assert 'executor' in me._WRITER
+        name = me.filewrite(data, str(tmp_path / 'session'), ref_img)
+    assert not me._WRITER
+    assert name.endswith('.nii')
+    assert nib.load(name).get_data_dtype() == np.float32
+    # the previous settings are restored
+    name = me.filewrite(data, str(tmp_path / 'after'), ref_img)
+    assert name.endswith('.nii.gz')
+    assert nib.load(name).get_data_dtype() == np.float64
+
+    # the writer threads are stopped when the workflow fails, and the
+    # workflow's error is raised instead of those of the queued writes
+    with pytest.raises(KeyError):
+        with me.output_session():
+            me.filewrite(data, str(tmp_path / 'missing' / 'session'), ref_img)
+            raise KeyError('failed')
+    assert not me._WRITER
+    assert 'queued write failed' in caplog.text
+    # errors of the queued writes are raised otherwise
+    with pytest.raises(Exception):
+        with me.output_session():
+            me.filewrite(data, str(tmp_path / 'missing' / 'session'), ref_img)
+    assert not me._WRITER
+
+
+def test_filewrite_blocks_echos(tmp_path):
+    # blocks of (S x E x c) volumes give the same image as the whole array
+    ref_img = os.path.join(data_dir, 'mask.nii.gz')
+    data = np.random.random((64350, 3, 4))
+    full = nib.load(me.filewrite(data, str(tmp_path / 'full'), ref_img))
+    name = me.filewrite_blocks((data[..., i:i + 1] for i in range(4)),
+                               str(tmp_path / 'blocks'), ref_img, n_vols=4)
+    img = nib.load(name)
+    assert img.shape == full.shape == (39, 50, 33, 3, 4)
+    assert np.array_equal(img.get_fdata(), full.get_fdata())
+
+
+def test_output_compression(tmp_path):
+    ref_img = os.path.join(data_dir, 'mask.nii.gz')
+    # large enough to be split across several gzip members
+    data = np.random.random((64350, 10))
+
+    me.set_output_compression('fast', n_threads=3)
+    name = me.filewrite(data, str(tmp_path / 'fast'), ref_img)
+    assert name.endswith('.nii.gz')
+    out = nib.load(name).get_fdata().reshape(-1, 10)
+    assert np.allclose(out, data)
+    # all writers share one pool of compressing threads
+    executor = me._GZIP_POOL['executor']
+    me.filewrite(data, str(tmp_path / 'fast2'), ref_img)
+    assert me._GZIP_POOL['executor'] is executor
+    assert executor._max_workers == 3
+    me._shutdown_compression()
+    assert not me._GZIP_POOL
+
+    # a single compressing thread writes the same, reproducible bytes
+    me.set_output_compression('fast', n_threads=1)
+    serial = me.filewrite(data, str(tmp_path / 'serial'), ref_img)
+    with open(name, 'rb') as f1, open(serial, 'rb') as f2:
+        assert f1.read() == f2.read()
+    member = me._gzip_member(b'tedana', 1)
+    assert member[4:8] == b'\x00' * 4  # no modification time
+    assert gzip.decompress(member) == b'tedana'
+
+    me.set_output_compression('none')
+    name = me.filewrite(data, str(tmp_path / 'none.nii.gz'), ref_img)
+    assert name == str(tmp_path / 'none.nii')
+    out = nib.load(name).get_fdata().reshape(-1, 10)
+    assert np.allclose(out, data)
+
+    me.set_output_compression()
+    with pytest.raises(ValueError):
+        me.set_output_compression('zstd')
+
+
+def test_output_precision(tmp_path, caplog):
+    ref_img = os.path.join(data_dir, 'mask.nii.gz')
+    data = np.random.random((64350, 3)) * 1000 - 500
+    mask = np.zeros(64350, dtype=np.int16)
+    mask[::2] = 3
+
+    me.set_output_precision('float32')
+    img = nib.load(me.filewrite(data, str(tmp_path / 'f32'), ref_img))
+    assert img.get_data_dtype() == np.float32
+    assert np.allclose(img.get_fdata().reshape(-1, 3), data)
+
+    me.set_output_precision('int16', report=True)
+    with caplog.at_level('INFO', logger='tedana.io'):
+        img = nib.load(me.filewrite(data, str(tmp_path / 'i16'), ref_img))
+    assert img.get_data_dtype() == np.int16
+    error = np.abs(img.get_fdata().reshape(-1, 3) - data).max()
+    assert error < 1000 / 2 ** 15
+    assert 'Maximum rounding error' in caplog.text
+    assert np.isclose(float(caplog.text.split()[-1]), error, rtol=1e-2)
+    # integer data are written as they are
+    img = nib.load(me.filewrite(mask, str(tmp_path / 'mask'), ref_img))
+    assert img.get_data_dtype() == np.int16
+    assert np.array_equal(img.get_fdata().ravel(), mask)
+    # blocks of volumes can't be scaled to the whole image
+    name = me.filewrite_blocks([data[:, :2], data[:, 2:]],
+                               str(tmp_path / 'blocks'), ref_img, n_vols=3)
+    assert nib.load(name).get_data_dtype() == np.float32
+
+    me.set_output_precision()
+    assert nib.load(me.filewrite(data, str(tmp_path / 'f64'),
+                                 ref_img)).get_data_dtype() == np.float64
+    with pytest.raises(ValueError):
+        me.set_output_precision('float16')
+
+
+def test_container(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    ref_img = os.path.join(data_dir, 'mask.nii.gz')
+    data = np.random.random((64350, 10))
+    mmix = np.random.random((10, 3))
+    comptable = pd.DataFrame({'kappa': [3., 2., 1.],
+                              'classification': ['accepted', 'rejected',
+                                                 'ignored']})
+    fname = str(tmp_path / 'outputs.h5')
+
+    me.open_container(fname)
+    try:
+        me.filewrite(data, str(tmp_path / 'ts_OC.nii'), ref_img)
+        me.filewrite_blocks((data[:, i:i + 4] for i in range(0, 10, 4)),
+                            'ts_blocks.nii', ref_img, n_vols=10)
+        me.write_matrix(mmix, 'meica_mix.1D')
+        me.write_table(comptable, 'comp_table_ica.tsv')
+    finally:
+        me.close_container()
+
+    # nothing is written outside of the container
+    assert os.listdir(str(tmp_path)) == ['outputs.h5']
+    with h5py.File(fname, 'r') as h5:
+        assert np.allclose(h5.attrs['affine'], nib.load(ref_img).affine)
+        assert tuple(h5.attrs['shape']) == (39, 50, 33)
+        assert np.allclose(h5['ts_OC'][...], data)
+        assert np.allclose(h5['ts_blocks'][...], data)
+        assert h5['ts_OC'].chunks is not None
+        assert np.allclose(h5['meica_mix'][...], mmix)
+        table = h5['comp_table_ica']
+        assert list(table.attrs['columns']) == ['component', 'kappa',
+                                                'classification']
+        assert np.array_equal(table['component'][...], [0, 1, 2])
+        assert table['classification'][1].decode() == 'rejected'
+
+
 def test_load_data():
     fimg = [nib.load(f) for f in fnames]
     exp_shape = (64350, 3, 5)
@@ -38,6 +285,14 @@ def test_load_data():
     assert isinstance(ref, nib.Nifti1Image)
     assert np.allclose(ref.get_data(), nib.load(fnames[0]).get_data())
 
+    # echoes read one at a time or concurrently are the same
+    d_serial, _ = me.load_data(fnames, n_echos=len(tes), n_threads=1)
+    assert d_serial.dtype == d.dtype
+    assert np.array_equal(d_serial, d)
+    for i_echo, f in enumerate(fnames):
+        assert np.array_equal(d[:, i_echo], nib.load(f).get_fdata().reshape(
+            exp_shape[0], -1))
+
     # list of img_like
     d, ref = me.load_data(fimg, n_echos=len(tes))
     assert d.shape == exp_shape
@@ -54,6 +309,62 @@ def test_load_data():
         me.load_data(fnames[0])
 
 
+def test_load_data_uncompressed(tmp_path):
+    """
+    Memory-mapped uncompressed files should load like gzipped files.
+    """
+    nii_fnames = []
+    for i_echo, fname in enumerate(fnames):
+        nii_fnames.append(str(tmp_path / 'echo{}.nii'.format(i_echo + 1)))
+        nib.load(fname).to_filename(nii_fnames[-1])
+
+    d, ref = me.load_data(fnames, n_echos=len(tes))
+    nii_d, nii_ref = me.load_data(nii_fnames, n_echos=len(tes))
+    assert nii_d.dtype == d.dtype
+    assert np.array_equal(nii_d, d)
+    assert np.array_equal(nii_d[:, 1], utils.load_image(nii_fnames[1]))
+
+    # imagine z-cat img
+    d, ref = me.load_data(fnames[0], n_echos=3)
+    nii_d, nii_ref = me.load_data(nii_fnames[0], n_echos=3)
+    assert np.array_equal(nii_d, d)
+
+
+def test_load_data_blocks(tmp_path, monkeypatch):
+    """
+    Blocks of volumes should match the loaded data, reading each file once.
+    """
+    opened = []
+
+    class CountingOpener(me.ImageOpener):
+        def __init__(self, *args, **kwargs):
+            opened.append(args[0])
+            super(CountingOpener, self).__init__(*args, **kwargs)
+
+    monkeypatch.setattr(me, 'ImageOpener', CountingOpener)
+
+    # scaled integer images are read like their data arrays
+    scaled_fnames = []
+    for i_echo, fname in enumerate(fnames):
+        img = nib.load(fname)
+        img.set_data_dtype(np.int16)
+        scaled_fnames.append(str(tmp_path / 'echo{}.nii.gz'.format(i_echo + 1)))
+        img.to_filename(scaled_fnames[-1])
+
+    for data in (fnames, scaled_fnames, fnames[0]):
+        n_echos = len(tes) if isinstance(data, list) else 3
+        d, _ = me.load_data(data, n_echos=n_echos)
+        del opened[:]
+        blocks = list(me.load_data_blocks(data, n_echos=n_echos, block_size=2))
+        assert [block.shape[-1] for block in blocks] == [2, 2, 1]
+        assert np.allclose(np.concatenate(blocks, axis=-1), d)
+        # one stream per file, instead of one per block
+        assert len(opened) == (len(data) if isinstance(data, list) else 1)
+
+    with pytest.raises(ValueError):
+        next(me.load_data_blocks(fnames, n_echos=len(tes), block_size=0))
+
+
 # SMOKE TESTS
 
 def test_smoke_split_ts():
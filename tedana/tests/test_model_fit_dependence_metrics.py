@@ -4,8 +4,10 @@ Tests for tedana.metrics.fit
 
 import numpy as np
 import pytest
+from scipy import stats
 
 from tedana.metrics import kundu_fit
+from tedana.stats import computefeats2
 
 
 def test_break_dependence_metrics():
@@ -95,3 +97,35 @@ def test_break_dependence_metrics():
     assert str(e_info.value) == ('Number of volumes in catd ({0}) '
                                  'does not match number of volumes in '
                                  't2s ({1})'.format(catd.shape[2], t2s.shape[1]))
+
+
+def test_dependence_metrics_chunked():
+    """
+    Ensure that fitting components in memory-bounded chunks matches fitting
+    them all at once, and a direct per-component fit.
+    """
+    rs = np.random.RandomState(0)
+    n_samples, n_echos, n_vols, n_comps = 200, 3, 40, 6
+    tes = np.array([14.5, 38.5, 62.5])
+    t2s = rs.uniform(20, 60, n_samples)
+    catd = rs.uniform(100, 200, (n_samples, n_echos, n_vols))
+    tsoc = catd.mean(axis=1)
+    mmix = rs.randn(n_vols, n_comps)
+
+    comptable, _, betas, _ = kundu_fit.dependence_metrics(catd, tsoc, mmix,
+                                                          t2s, tes, None)
+    chunked = kundu_fit.dependence_metrics(catd, tsoc, mmix, t2s, tes, None,
+                                           max_memory=1e-9)[0]
+    assert np.allclose(comptable.values, chunked.values)
+
+    # kappa of one component from a direct fit of the R2 model
+    comp_betas = betas[:, :, 0]
+    X2 = tes * catd.mean(axis=-1) / t2s[:, None]
+    coeffs = (comp_betas * X2).sum(axis=1) / (X2**2).sum(axis=1)
+    SSE = ((comp_betas - X2 * coeffs[:, None])**2).sum(axis=1)
+    F_R2 = ((comp_betas**2).sum(axis=1) - SSE) * (n_echos - 1) / SSE
+    wts = computefeats2(tsoc, mmix, normalize=False)[:, 0]
+    wts *= np.sign(stats.skew(wts))
+    wtsZ = np.clip((wts - wts.mean()) / wts.std(), -kundu_fit.Z_MAX, kundu_fit.Z_MAX)
+    kappa = np.average(np.minimum(F_R2, kundu_fit.F_MAX), weights=wtsZ**2)
+    assert np.isclose(comptable.loc[0, 'kappa'], kappa)
@@ -5,6 +5,7 @@ Tests for tedana.model.fit
 import pytest
 import numpy as np
 import pandas as pd
+from scipy import stats
 
 from tedana.metrics import kundu_fit
 
@@ -36,3 +37,42 @@ def test_smoke_kundu_metrics():
 
     comptable = kundu_fit.kundu_metrics(comptable, metric_maps)
     assert comptable is not None
+    assert list(comptable.columns[4:11]) == [
+        'countsigFR2', 'countsigFS0', 'dice_FR2', 'dice_FS0', 'countnoise',
+        'signal-noise_t', 'signal-noise_p']
+
+
+def test_unique_log_ttest():
+    """
+    Ensure that the batched t-tests of unique log F-statistics match
+    scipy.stats.ttest_ind for each component.
+    """
+    rs = np.random.RandomState(42)
+    F_maps = np.round(rs.gamma(2, 10, (500, 10)), 1)
+    signal = rs.rand(500, 10) > 0.7
+    noise = ~signal & (rs.rand(500, 10) > 0.5)
+    # one signal voxel gives an undefined test
+    signal[:, 0] = False
+    signal[3, 0] = True
+    t, p = kundu_fit._welch_ttest(kundu_fit._unique_log_moments(F_maps, signal),
+                                  kundu_fit._unique_log_moments(F_maps, noise))
+    assert np.isnan(t[0]) and np.isnan(p[0])
+    for i_comp in range(1, 10):
+        ref = stats.ttest_ind(np.log10(np.unique(F_maps[signal[:, i_comp], i_comp])),
+                              np.log10(np.unique(F_maps[noise[:, i_comp], i_comp])),
+                              equal_var=False)
+        assert np.allclose([t[i_comp], p[i_comp]], ref)
+
+
+def test_unique_log_moments_empty():
+    """
+    Ensure that components without selected values, or no components at all,
+    give empty moments.
+    """
+    n, mean, var = kundu_fit._unique_log_moments(np.ones((5, 3)),
+                                                 np.zeros((5, 3), dtype=bool))
+    assert np.array_equal(n, [0, 0, 0])
+    assert np.isnan(mean).all()
+    n, mean, var = kundu_fit._unique_log_moments(np.ones((5, 0)),
+                                                 np.ones((5, 0), dtype=bool))
+    assert n.shape == mean.shape == var.shape == (0,)
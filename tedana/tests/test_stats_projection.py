@@ -0,0 +1,49 @@
+"""
+Tests for tedana.stats.ComponentProjection
+"""
+
+import numpy as np
+import pytest
+
+from tedana.stats import ComponentProjection, get_coeffs
+
+
+def test_component_projection():
+    """
+    Check projection coefficients against least squares fits.
+    """
+    rs = np.random.RandomState(0)
+    mmix = rs.random_sample((40, 4))
+    data = rs.random_sample((10, 40)) + 5
+    proj = ComponentProjection(mmix)
+
+    betas = proj.coeffs(data)
+    assert np.allclose(betas, get_coeffs(data, mmix))
+
+    # demeaned betas from the data or from its betas
+    dm_betas = get_coeffs(data - data.mean(axis=-1, keepdims=True), mmix)
+    assert np.allclose(proj.coeffs(data, demean=True), dm_betas)
+    assert np.allclose(proj.demean(betas, data.mean(axis=-1)), dm_betas)
+
+    # echo-wise data
+    data_3d = rs.random_sample((10, 3, 40))
+    betas_3d = proj.coeffs(data_3d)
+    assert betas_3d.shape == (10, 3, 4)
+    for i_echo in range(3):
+        assert np.allclose(betas_3d[:, i_echo],
+                           get_coeffs(data_3d[:, i_echo], mmix))
+
+    # single component
+    assert ComponentProjection(mmix[:, 0]).coeffs(data).shape == (10, 1)
+
+
+def test_break_component_projection():
+    """
+    Ensure that ComponentProjection fails with mismatched inputs.
+    """
+    with pytest.raises(ValueError):
+        ComponentProjection(np.empty((40, 4, 2)))
+
+    proj = ComponentProjection(np.empty((40, 4)))
+    with pytest.raises(ValueError):
+        proj.coeffs(np.empty((10, 39)))
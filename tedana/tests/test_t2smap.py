@@ -6,8 +6,11 @@ import os.path as op
 from shutil import rmtree
 
 import nibabel as nib
+import numpy as np
+import pytest
 
-from tedana import workflows
+from tedana import io, workflows
+from tedana.workflows import t2smap, tedana
 from tedana.tests.utils import get_test_data_path
 
 
@@ -35,6 +38,12 @@ class TestT2smap():
         assert len(img.shape) == 3
         img = nib.load(op.join(out_dir, 's0vG.nii.gz'))
         assert len(img.shape) == 3
+        img = nib.load(op.join(out_dir, 't2svSE.nii.gz'))
+        assert len(img.shape) == 3
+        img = nib.load(op.join(out_dir, 's0vSE.nii.gz'))
+        assert len(img.shape) == 3
+        img = nib.load(op.join(out_dir, 'rsqv.nii.gz'))
+        assert len(img.shape) == 3
         img = nib.load(op.join(out_dir, 'ts_OC.nii.gz'))
         assert len(img.shape) == 4
 
@@ -64,6 +73,27 @@ class TestT2smap():
         img = nib.load(op.join(out_dir, 'ts_OC.nii.gz'))
         assert len(img.shape) == 4
 
+    def test_basic_t2smap_window(self):
+        """
+        A very simple test, to confirm that t2smap creates output
+        files when fitmode is set to window.
+        """
+        data_dir = get_test_data_path()
+        data = [op.join(data_dir, 'echo1.nii.gz'),
+                op.join(data_dir, 'echo2.nii.gz'),
+                op.join(data_dir, 'echo3.nii.gz')]
+        workflows.t2smap_workflow(data, [14.5, 38.5, 62.5], combmode='t2s',
+                                  fitmode='window', window_size=3,
+                                  label='t2smap')
+        out_dir = 'TED.echo1.t2smap'
+
+        # Check outputs
+        assert op.isfile(op.join(out_dir, 'ts_OC.nii.gz'))
+        img = nib.load(op.join(out_dir, 't2sv.nii.gz'))
+        assert len(img.shape) == 4
+        img = nib.load(op.join(out_dir, 's0vG.nii.gz'))
+        assert len(img.shape) == 4
+
     def test_basic_t2smap3(self):
         """
         A very simple test, to confirm that t2smap creates output
@@ -118,6 +148,81 @@ class TestT2smap():
         img = nib.load(op.join(out_dir, 'ts_OC.nii.gz'))
         assert len(img.shape) == 4
 
+    def test_basic_t2smap_max_memory(self):
+        """
+        Streaming the optimal combination in blocks of volumes should write
+        the same time series as combining in memory.
+        """
+        data_dir = get_test_data_path()
+        data = [op.join(data_dir, 'echo1.nii.gz'),
+                op.join(data_dir, 'echo2.nii.gz'),
+                op.join(data_dir, 'echo3.nii.gz')]
+        workflows.t2smap_workflow(data, [14.5, 38.5, 62.5], combmode='t2s',
+                                  fitmode='all', label='t2smap')
+        out_dir = 'TED.echo1.t2smap'
+        oc_data = nib.load(op.join(out_dir, 'ts_OC.nii.gz')).get_fdata()
+        workflows.t2smap_workflow(data, [14.5, 38.5, 62.5], combmode='t2s',
+                                  fitmode='all', label='t2smap',
+                                  max_memory=0.01)
+
+        # Check outputs
+        img = nib.load(op.join(out_dir, 'ts_OC.nii.gz'))
+        assert img.shape == oc_data.shape
+        assert np.allclose(img.get_fdata(), oc_data)
+
+    def test_basic_t2smap_uncompressed(self):
+        """
+        Uncompressed outputs should be written as plain NIFTI images.
+        """
+        data_dir = get_test_data_path()
+        data = [op.join(data_dir, 'echo1.nii.gz'),
+                op.join(data_dir, 'echo2.nii.gz'),
+                op.join(data_dir, 'echo3.nii.gz')]
+        workflows.t2smap_workflow(data, [14.5, 38.5, 62.5], combmode='t2s',
+                                  fitmode='all', label='t2smap',
+                                  output_compression='none',
+                                  output_precision='int16')
+        out_dir = 'TED.echo1.t2smap'
+        # the settings of the workflow don't outlast it
+        assert io._COMPRESSION['level'] == io.COMPRESSION_LEVELS['default']
+        assert io._PRECISION['dtype'] == np.float64
+
+        # Check outputs
+        assert not op.isfile(op.join(out_dir, 'ts_OC.nii.gz'))
+        img = nib.load(op.join(out_dir, 'ts_OC.nii'))
+        assert len(img.shape) == 4
+        img = nib.load(op.join(out_dir, 't2sv.nii'))
+        assert len(img.shape) == 3
+
+    def test_failed_t2smap_cleanup(self):
+        """
+        A failing workflow should not leave writer threads or a container.
+        """
+        data_dir = get_test_data_path()
+        data = [op.join(data_dir, 'echo1.nii.gz'),
+                op.join(data_dir, 'echo2.nii.gz'),
+                op.join(data_dir, 'echo3.nii.gz')]
+        with pytest.raises(ValueError):
+            workflows.t2smap_workflow(data, [14.5, 38.5, 62.5, 80.],
+                                      label='t2smap')
+        assert not io._WRITER
+        assert not io._CONTAINER
+
     def teardown_method(self):
         # Clean up folders
         rmtree('TED.echo1.t2smap')
+
+
+def test_n_jobs_parser():
+    """
+    Both command line interfaces should reject 0 jobs, and accept negative
+    numbers of jobs.
+    """
+    data_dir = get_test_data_path()
+    args = ['-d', op.join(data_dir, 'echo1.nii.gz'), '-e', '14.5']
+    for parser in [t2smap._get_parser(), tedana._get_parser()]:
+        assert parser.parse_args(args + ['--n-jobs', '-1']).n_jobs == -1
+        assert parser.parse_args(args + ['--n-jobs', '4']).n_jobs == 4
+        for n_jobs in ['0', 'all']:
+            with pytest.raises(SystemExit):
+                parser.parse_args(args + ['--n-jobs', n_jobs])
@@ -36,6 +36,29 @@ def test_unmask():
         assert out.dtype == dtype
 
 
+def test_masked_data():
+    mask = rs.choice([0, 1], size=(100,)).astype(bool)
+    data = rs.rand(100, 3, 4)
+    masked = utils.MaskedData.from_full(data, mask)
+    assert masked.shape == data.shape
+    assert masked.data.shape == (mask.sum(), 3, 4)
+    assert np.array_equal(masked.unmask(), utils.unmask(data[mask], mask))
+
+    # the same mask returns the masked array without copying
+    assert utils.apply_mask(masked, mask) is masked.data
+    assert utils.apply_mask(masked, np.where(mask)[0]) is masked.data
+    # subsets of the mask are selected from the masked array
+    sub_mask = mask.copy()
+    sub_mask[np.where(mask)[0][::2]] = False
+    assert np.array_equal(utils.apply_mask(masked, sub_mask), data[sub_mask])
+    assert np.array_equal(utils.apply_mask(data, sub_mask), data[sub_mask])
+
+    with pytest.raises(ValueError):
+        utils.apply_mask(masked, ~mask)
+    with pytest.raises(ValueError):
+        utils.MaskedData(data, mask)
+
+
 def test_dice():
     arr = rs.choice([0, 1], size=(100, 100))
     # identical arrays should have a Dice index of 1
@@ -49,6 +72,45 @@ def test_dice():
     # different size arrays raise a ValueError
     with pytest.raises(ValueError):
         utils.dice(arr, rs.choice([0, 1], size=(20, 20)))
+    # indices along an axis match those of each column
+    arr2 = rs.choice([0, 1], size=(100, 100))
+    arr2[:, 0] = arr[:, 0] = 0
+    assert np.allclose(utils.dice(arr, arr2, axis=0),
+                       [utils.dice(arr[:, i], arr2[:, i]) for i in range(100)])
+
+
+def test_memory_chunk_size():
+    # budgets are in units of 1024 ** 3 bytes
+    assert utils.memory_chunk_size(1024, 1.) == 1024 ** 2
+    assert utils.memory_chunk_size(3 * 1024 ** 3, 1.) == 1
+    assert utils.memory_chunk_size(8, 1e-6) == int(1e-6 * 1024 ** 3 // 8)
+
+
+def test_check_n_jobs(monkeypatch):
+    monkeypatch.setattr(utils.multiprocessing, 'cpu_count', lambda: 4)
+    assert utils.check_n_jobs(2) == 2
+    assert utils.check_n_jobs(np.int64(8)) == 8
+    # negative values count back from the number of CPUs
+    assert utils.check_n_jobs(-1) == 4
+    assert utils.check_n_jobs(-2) == 3
+    assert utils.check_n_jobs(-10) == 1
+    for n_jobs in [0, 1.5, True, '2']:
+        with pytest.raises(ValueError):
+            utils.check_n_jobs(n_jobs)
+
+
+def test_worker_pool(monkeypatch):
+    # queued writes are waited for before the workers are forked
+    calls = []
+    monkeypatch.setattr(io, 'wait_for_writes', lambda: calls.append(True))
+    with utils.worker_pool(2) as pool:
+        assert pool.map(abs, [-1, 2, -3]) == [1, 2, 3]
+    assert calls == [True]
+    shape = (6, 7, 5)
+    mask = np.ones(np.prod(shape), bool)
+    graph = utils.MaskGraph(mask, shape)
+    graph.threshold(rs.randn(mask.sum(), 2), 3, threshold=1., n_jobs=2)
+    assert calls == [True, True]
 
 
 def test_andb():
@@ -208,4 +270,38 @@ def test_smoke_threshold_map():
     assert utils.threshold_map(img, min_cluster_size, sided='bi') is not None 
 
 
+def test_mask_graph():
+    # clusters of the graph match those of threshold_map for each map
+    shape = (12, 13, 11)
+    mask = rs.rand(*shape).ravel() > 0.2
+    maps = rs.randn(mask.sum(), 4) * 2
+    thresholds = np.array([0.5, 1., 2., 0.])
+    graph = utils.MaskGraph(mask, shape)
+    for sided in ['two', 'one', 'bi']:
+        clmaps = graph.threshold(maps, 5, threshold=thresholds, sided=sided)
+        assert clmaps.shape == maps.shape
+        for i_map, thr in enumerate(thresholds):
+            vol = utils.unmask(maps[:, i_map], mask).reshape(shape)
+            assert np.array_equal(clmaps[:, i_map],
+                                  utils.threshold_map(vol, 5, threshold=thr,
+                                                      mask=mask, sided=sided))
+    assert graph.threshold(maps[:, 0], 5).shape == (mask.sum(),)
+    # worker processes threshold chunks of the maps, in order
+    assert np.array_equal(graph.threshold(maps, 5, threshold=thresholds, n_jobs=2),
+                          graph.threshold(maps, 5, threshold=thresholds))
+    # of any dtype
+    for dtype in [np.float32, bool]:
+        assert np.array_equal(graph.threshold(maps.astype(dtype), 5, n_jobs=2),
+                              graph.threshold(maps.astype(dtype), 5))
+
+    with pytest.raises(ValueError):
+        utils.MaskGraph(mask, (12, 13, 12))
+    with pytest.raises(ValueError):
+        graph.threshold(maps[1:], 5)
+    with pytest.raises(ValueError):
+        graph.threshold(maps, 5, sided='three')
+    with pytest.raises(ValueError):
+        graph.threshold(maps, 5, n_jobs=0)
+
+
 # TODO: "BREAK" AND UNIT TESTS
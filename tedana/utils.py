@@ -2,10 +2,12 @@
 Utilities for tedana package
 """
 import logging
+import multiprocessing
 
 import numpy as np
 import nibabel as nib
-from scipy import ndimage
+from scipy import ndimage, sparse
+from scipy.sparse import csgraph
 from nilearn._utils import check_niimg
 from sklearn.utils import check_array
 
@@ -15,6 +17,9 @@ LGR = logging.getLogger(__name__)
 RepLGR = logging.getLogger('REPORT')
 RefLGR = logging.getLogger('REFERENCES')
 
+# per-process view of the graph and maps shared with the worker pool
+_SHARED = {}
+
 
 def load_image(data):
     """
@@ -133,6 +138,193 @@ def unmask(data, mask):
     return out
 
 
+def memory_chunk_size(item_nbytes, max_memory):
+    """
+    Number of items that fit in a memory budget
+
+    All ``max_memory`` options use this, so that a budget means the same
+    everywhere.
+
+    Parameters
+    ----------
+    item_nbytes : :obj:`int`
+        Approximate number of bytes of temporary arrays needed per item (such
+        as a sample, component or volume)
+    max_memory : :obj:`float`
+        Memory budget, in gigabytes (1024 ** 3 bytes)
+
+    Returns
+    -------
+    chunk_size : :obj:`int`
+        Number of items in a chunk, at least one
+    """
+    return max(1, int(max_memory * 1024 ** 3 // item_nbytes))
+
+
+def check_n_jobs(n_jobs):
+    """
+    Number of worker processes to use
+
+    All ``n_jobs`` options use this, so that they mean the same everywhere.
+
+    Parameters
+    ----------
+    n_jobs : :obj:`int`
+        Requested number of worker processes. Negative values count back from
+        the number of available CPUs, so that -1 uses all of them and -2 all
+        but one (but always at least one).
+
+    Returns
+    -------
+    n_jobs : :obj:`int`
+        Number of worker processes, at least one
+
+    Raises
+    ------
+    ValueError
+        If `n_jobs` is zero or not an integer
+    """
+    if not isinstance(n_jobs, (int, np.integer)) or isinstance(n_jobs, bool):
+        raise ValueError('n_jobs must be an integer, not {0!r}'.format(n_jobs))
+    elif n_jobs == 0:
+        raise ValueError('n_jobs must not be 0; use -1 for all CPUs')
+    elif n_jobs < 0:
+        n_jobs = max(1, multiprocessing.cpu_count() + 1 + n_jobs)
+    return int(n_jobs)
+
+
+def worker_pool(n_jobs, initializer=None, initargs=()):
+    """
+    Starts a pool of worker processes once no outputs are being written
+
+    Writes queued to writer threads (see :func:`tedana.io.filewrite`) are
+    waited for first, since forking while another thread holds a lock (e.g.,
+    of a logging handler) can deadlock the workers.
+
+    Parameters
+    ----------
+    n_jobs : :obj:`int`
+        Number of worker processes
+    initializer : callable or None, optional
+        Function each worker runs when it starts. Default is None.
+    initargs : :obj:`tuple`, optional
+        Arguments of `initializer`. Default is no arguments.
+
+    Returns
+    -------
+    pool : :obj:`multiprocessing.pool.Pool`
+        Pool of worker processes
+    """
+    # tedana.io imports this module
+    from tedana import io
+    io.wait_for_writes()
+    return multiprocessing.Pool(n_jobs, initializer=initializer,
+                                initargs=initargs)
+
+
+class MaskedData(object):
+    """
+    Data for the samples within a mask, without the samples outside of it
+
+    Stages of the workflow accept this in place of full (S [x E [x T]])
+    arrays, so that data are masked once and only unmasked when written to
+    disk.
+
+    Parameters
+    ----------
+    data : (M [x E [x T]]) array_like
+        Masked array, where `M` is the number of `True` values in `mask`
+    mask : (S,) array_like
+        Boolean array of `S` samples that was used to mask `data`
+    ref_img : :obj:`str` or img_like or None, optional
+        Reference image to dictate how the data are saved to disk.
+        Default is None.
+
+    Attributes
+    ----------
+    data : (M [x E [x T]]) :obj:`numpy.ndarray`
+        Masked array
+    mask : (S,) :obj:`numpy.ndarray`
+        Boolean mask array
+    ref_img : :obj:`str` or img_like or None
+        Reference image
+    """
+    def __init__(self, data, mask, ref_img=None):
+        data = np.asarray(data)
+        mask = np.asarray(mask, dtype=bool)
+        if mask.ndim != 1:
+            raise ValueError('Mask is not 1D')
+        elif data.shape[0] != mask.sum():
+            raise ValueError('First dimension of data ({0}) does not match '
+                             'number of samples in mask '
+                             '({1})'.format(data.shape[0], mask.sum()))
+        self.data = data
+        self.mask = mask
+        self.ref_img = ref_img
+
+    @classmethod
+    def from_full(cls, data, mask, ref_img=None):
+        """
+        Masks full (S [x E [x T]]) `data` with `mask`
+        """
+        return cls(data[mask], mask, ref_img=ref_img)
+
+    @property
+    def shape(self):
+        """Shape of the unmasked data, (S [x E [x T]])"""
+        return self.mask.shape + self.data.shape[1:]
+
+    @property
+    def ndim(self):
+        return self.data.ndim
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def unmask(self):
+        """
+        Returns the unmasked (S [x E [x T]]) data, with zeros outside the mask
+        """
+        return unmask(self.data, self.mask)
+
+
+def apply_mask(data, mask):
+    """
+    Returns the samples of `data` selected by `mask`
+
+    Parameters
+    ----------
+    data : (S [x E [x T]]) array_like or :obj:`MaskedData`
+        Full data array or masked data
+    mask : (S,) array_like
+        Boolean array or integer indices of samples to select. For
+        :obj:`MaskedData`, all selected samples must be within its mask.
+
+    Returns
+    -------
+    out : (M [x E [x T]]) :obj:`numpy.ndarray`
+        Selected samples. For :obj:`MaskedData` with the same mask, this is
+        its masked array, without copying.
+    """
+    if not isinstance(data, MaskedData):
+        return data[mask]
+
+    mask = np.asarray(mask)
+    if mask.dtype == bool:
+        if np.array_equal(mask, data.mask):
+            return data.data
+        mask = np.where(mask)[0]
+    if not np.all(data.mask[mask]):
+        raise ValueError('Samples outside of the mask of the data were '
+                         'requested')
+    if mask.size == data.data.shape[0] and np.all(np.diff(mask) > 0):
+        # every sample in the mask, in order
+        return data.data
+    rows = np.cumsum(data.mask) - 1
+    return data.data[rows[mask]]
+
+
 @due.dcite(BibTeX('@article{dice1945measures,'
                   'author={Dice, Lee R},'
                   'title={Measures of the amount of ecologic association between species},'
@@ -154,7 +346,7 @@ def unmask(data, mask):
                   'volume={5},'
                   'pages={1--34}}'),
            description='Introduction of Sorenson-Dice index by Sorenson in 1948.')
-def dice(arr1, arr2):
+def dice(arr1, arr2, axis=None):
     """
     Compute Dice's similarity index between two numpy arrays. Arrays will be
     binarized before comparison.
@@ -163,11 +355,15 @@ def dice(arr1, arr2):
     ----------
     arr1, arr2 : array_like
         Input arrays, arrays to binarize and compare.
+    axis : :obj:`int` or None, optional
+        Axis along which to compare the arrays, such as the voxel axis of
+        (S x C) component maps. If None (default), the whole arrays are
+        compared.
 
     Returns
     -------
-    dsi : :obj:`float`
-        Dice-Sorenson index.
+    dsi : :obj:`float` or :obj:`numpy.ndarray`
+        Dice-Sorenson index, or an array of indices if `axis` is given.
 
     References
     ----------
@@ -175,12 +371,19 @@ def dice(arr1, arr2):
 
     .. _REF: https://gist.github.com/brunodoamaral/e130b4e97aa4ebc468225b7ce39b3137
     """
-    arr1 = np.array(arr1 != 0).astype(int)
-    arr2 = np.array(arr2 != 0).astype(int)
+    arr1 = np.asarray(arr1) != 0
+    arr2 = np.asarray(arr2) != 0
 
     if arr1.shape != arr2.shape:
         raise ValueError('Shape mismatch: arr1 and arr2 must have the same shape.')
 
+    if axis is not None:
+        arr_sum = (np.count_nonzero(arr1, axis=axis) +
+                   np.count_nonzero(arr2, axis=axis))
+        intersection = np.count_nonzero(arr1 & arr2, axis=axis)
+        return np.divide(2. * intersection, arr_sum,
+                         out=np.zeros(arr_sum.shape), where=arr_sum != 0)
+
     arr_sum = arr1.sum() + arr2.sum()
     if arr_sum == 0:
         dsi = 0
@@ -324,3 +527,180 @@ def threshold_map(img, min_cluster_size, threshold=None, mask=None,
         clust_thresholded = clust_thresholded[mask]
 
     return clust_thresholded
+
+
+class MaskGraph(object):
+    """
+    Neighbor graph of the voxels in a mask, for cluster-extent thresholding
+
+    The graph is built once, so that many maps of the same mask can be
+    thresholded without rebuilding volumes. Clusters are the connected
+    components of the supra-threshold voxels, with 6 connectivity, as in
+    :func:`threshold_map`.
+
+    Parameters
+    ----------
+    mask : (S,) array_like
+        Boolean array of `S` samples, for the voxels of a volume in C order
+    shape : :obj:`tuple` of :obj:`int`
+        Shape of the 3D volume
+
+    Attributes
+    ----------
+    mask : (S,) :obj:`numpy.ndarray`
+        Boolean mask array
+    shape : :obj:`tuple` of :obj:`int`
+        Shape of the 3D volume
+    edges : (2 x N) :obj:`numpy.ndarray`
+        Indices (into the `M` voxels in `mask`) of each pair of neighbors
+    """
+    def __init__(self, mask, shape):
+        mask = np.asarray(mask, dtype=bool)
+        if mask.ndim != 1:
+            raise ValueError('Mask is not 1D')
+        elif mask.size != np.prod(shape):
+            raise ValueError('Size of mask ({0}) does not match volume shape '
+                             '({1})'.format(mask.size, shape))
+        self.mask = mask
+        self.shape = tuple(shape)
+
+        index = np.full(self.shape, -1)
+        index[mask.reshape(self.shape)] = np.arange(mask.sum())
+        edges = []
+        for axis in range(len(self.shape)):
+            first = np.take(index, np.arange(self.shape[axis] - 1), axis=axis)
+            second = np.take(index, np.arange(1, self.shape[axis]), axis=axis)
+            both = (first >= 0) & (second >= 0)
+            edges.append(np.vstack((first[both], second[both])))
+        self.edges = np.hstack(edges)
+
+    def threshold(self, maps, min_cluster_size, threshold=None, sided='two',
+                  n_jobs=1):
+        """
+        Cluster-extent threshold and binarize maps
+
+        Parameters
+        ----------
+        maps : (M [x K]) array_like
+            Maps of the `M` voxels in `mask` to be clustered
+        min_cluster_size : :obj:`int`
+            Minimum cluster size (in voxels)
+        threshold : :obj:`float` or (K,) array_like or None, optional
+            Cluster-defining threshold for all maps, or for each map. If None
+            (default), assume maps are already thresholded.
+        sided : {'two', 'one', 'bi'}, optional
+            How to apply thresholding. One-sided thresholds on the positive
+            side. Two-sided thresholds positive and negative values together.
+            Bi-sided thresholds positive and negative values separately.
+            Default is 'two'.
+        n_jobs : :obj:`int`, optional
+            Number of worker processes, which threshold consecutive chunks of
+            the maps. The maps are copied once into memory shared by the
+            workers. Negative values count back from the number of available
+            CPUs (see :func:`check_n_jobs`), so -1 uses all of them. Default
+            is 1.
+
+        Returns
+        -------
+        clmaps : (M [x K]) :obj:`numpy.ndarray`
+            Boolean maps of the voxels in clusters of at least
+            `min_cluster_size` voxels
+        """
+        maps = np.asarray(maps)
+        if maps.shape[0] != self.mask.sum():
+            raise ValueError('First dimension of maps ({0}) does not match '
+                             'number of voxels in mask '
+                             '({1})'.format(maps.shape[0], self.mask.sum()))
+        elif sided not in ('two', 'one', 'bi'):
+            raise ValueError('Unrecognized sided "{0}"'.format(sided))
+        squeeze = maps.ndim == 1
+        maps = np.atleast_2d(maps.T).T
+        thresholds = np.broadcast_to(np.asarray(threshold, dtype=object),
+                                     maps.shape[1:])
+
+        n_jobs = check_n_jobs(n_jobs)
+        if n_jobs == 1 or maps.shape[1] < 2:
+            clmaps = self._threshold(maps, min_cluster_size, thresholds, sided)
+        else:
+            clmaps = self._threshold_parallel(maps, min_cluster_size,
+                                              thresholds, sided, n_jobs)
+
+        return clmaps[:, 0] if squeeze else clmaps
+
+    def _threshold(self, maps, min_cluster_size, thresholds, sided):
+        """
+        Thresholds each of the (M x K) `maps` at its value of `thresholds`
+        """
+        clmaps = np.zeros(maps.shape, bool)
+        for i_map in range(maps.shape[1]):
+            arr, thr = maps[:, i_map], thresholds[i_map]
+            if thr is not None and thr <= 0 and not self.mask.all():
+                # voxels outside of the mask pass the threshold too, and can
+                # join clusters in the mask, so the whole volume is clustered
+                clmaps[:, i_map] = threshold_map(
+                    unmask(arr, self.mask).reshape(self.shape),
+                    min_cluster_size, threshold=thr, mask=self.mask,
+                    sided=sided)
+                continue
+            if sided == 'two':
+                arr = np.abs(arr)
+            supra = arr >= thr if thr is not None else arr > 0
+            clmaps[:, i_map] = self._clusters(supra, min_cluster_size)
+            if sided == 'bi':
+                supra = arr <= -thr if thr is not None else arr < 0
+                clmaps[:, i_map] |= self._clusters(supra, min_cluster_size)
+        return clmaps
+
+    def _threshold_parallel(self, maps, min_cluster_size, thresholds, sided,
+                            n_jobs):
+        """
+        Runs :meth:`_threshold` on chunks of maps in worker processes
+        """
+        # the maps are shared as raw bytes, which works for any dtype
+        shared = multiprocessing.RawArray('b', maps.nbytes)
+        _shared_array(shared, maps.dtype, maps.shape)[:] = maps
+        bounds = np.unique(np.linspace(0, maps.shape[1], n_jobs + 1).astype(int))
+        tasks = [(start, stop, min_cluster_size, thresholds[start:stop], sided)
+                 for start, stop in zip(bounds[:-1], bounds[1:])]
+        with worker_pool(len(tasks), initializer=_init_cluster_worker,
+                         initargs=(self, shared, maps.dtype,
+                                   maps.shape)) as pool:
+            results = pool.map(_threshold_chunk, tasks)
+        return np.hstack(results)
+
+    def _clusters(self, supra, min_cluster_size):
+        """
+        Returns the voxels of `supra` in clusters of `min_cluster_size`
+        """
+        n_voxels = supra.size
+        keep = supra[self.edges[0]] & supra[self.edges[1]]
+        graph = sparse.coo_matrix(
+            (np.ones(keep.sum(), bool), (self.edges[0, keep], self.edges[1, keep])),
+            shape=(n_voxels, n_voxels))
+        _, labels = csgraph.connected_components(graph, directed=False)
+        sizes = np.bincount(labels[supra], minlength=n_voxels)
+        return supra & (sizes[labels] >= min_cluster_size)
+
+
+def _shared_array(shared, dtype, shape):
+    """
+    Returns a view of `shared` memory as an array
+    """
+    return np.frombuffer(shared, dtype=dtype).reshape(shape)
+
+
+def _init_cluster_worker(graph, shared, dtype, shape):
+    """
+    Attach a worker process to a :obj:`MaskGraph` and the shared maps
+    """
+    _SHARED['graph'] = graph
+    _SHARED['maps'] = _shared_array(shared, dtype, shape)
+
+
+def _threshold_chunk(args):
+    """
+    Run :meth:`MaskGraph._threshold` on a chunk of the shared maps
+    """
+    start, stop, min_cluster_size, thresholds, sided = args
+    return _SHARED['graph']._threshold(_SHARED['maps'][:, start:stop],
+                                       min_cluster_size, thresholds, sided)
@@ -15,6 +15,23 @@ def is_valid_file(parser, arg):
     return arg
 
 
+def is_valid_n_jobs(parser, arg):
+    """
+    Check if argument is a valid number of worker processes.
+
+    Negative values count back from the number of available CPUs (so -1 uses
+    all of them), and 0 is not allowed.
+    """
+    try:
+        n_jobs = int(arg)
+    except ValueError:
+        parser.error('Number of jobs must be an integer, not {0}'.format(arg))
+    if n_jobs == 0:
+        parser.error('Number of jobs must not be 0; use -1 for all CPUs')
+
+    return n_jobs
+
+
 class ContextFilter(logging.Filter):
     """
     A filter to allow specific logging handlers to ignore specific loggers.
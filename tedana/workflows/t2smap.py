@@ -10,7 +10,7 @@ import numpy as np
 from scipy import stats
 
 from tedana import (combine, decay, io, utils)
-from tedana.workflows.parser_utils import is_valid_file
+from tedana.workflows.parser_utils import is_valid_file, is_valid_n_jobs
 
 LGR = logging.getLogger(__name__)
 RepLGR = logging.getLogger('REPORT')
@@ -59,13 +59,22 @@ def _get_parser():
     optional.add_argument('--fitmode',
                           dest='fitmode',
                           action='store',
-                          choices=['all', 'ts'],
+                          choices=['all', 'ts', 'window'],
                           help=('Monoexponential model fitting scheme. '
                                 '"all" means that the model is fit, per voxel, '
                                 'across all timepoints. '
                                 '"ts" means that the model is fit, per voxel '
-                                'and per timepoint.'),
+                                'and per timepoint. '
+                                '"window" means that the model is fit, per '
+                                'voxel and per timepoint, across a sliding '
+                                'window of timepoints.'),
                           default='all')
+    optional.add_argument('--window-size',
+                          dest='window_size',
+                          type=int,
+                          help=('Number of timepoints in each window when '
+                                'fitmode is "window". Default is 10.'),
+                          default=10)
     optional.add_argument('--combmode',
                           dest='combmode',
                           action='store',
@@ -89,6 +98,57 @@ def _get_parser():
                                'demanding monoexponential model is fit'
                                'to the raw data',
                           default='loglin')
+    optional.add_argument('--n-jobs',
+                          dest='n_jobs',
+                          type=lambda x: is_valid_n_jobs(parser, x),
+                          help=('Number of worker processes used to fit '
+                                'voxels with "curvefit", and of threads '
+                                'compressing outputs. Negative values count '
+                                'back from the number of available CPUs, so '
+                                '-1 uses all of them. Default is 1.'),
+                          default=1)
+    optional.add_argument('--max-memory',
+                          dest='max_memory',
+                          type=float,
+                          help=('Approximate memory budget, in gigabytes, for '
+                                'the temporary arrays of the T2*/S0 fit and '
+                                'the optimal combination. If provided, voxels '
+                                'are fit in chunks that fit in this budget, '
+                                'and the optimally combined time series is '
+                                'computed and written in blocks of volumes '
+                                'read from the input files.'),
+                          default=None)
+    optional.add_argument('--output-compression',
+                          dest='output_compression',
+                          choices=['none', 'fast', 'default', 'max'],
+                          help=('Compression of the output images. "fast", '
+                                '"default" and "max" write gzipped images, '
+                                'compressed in parallel by --n-jobs '
+                                'threads. "none" writes uncompressed images, '
+                                'which is fastest but uses the most disk '
+                                'space. Default is "default".'),
+                          default='default')
+    optional.add_argument('--output-format',
+                          dest='output_format',
+                          choices=['nifti', 'hdf5'],
+                          help=('Format of the outputs. "nifti" writes '
+                                'separate NIFTI images and text files. '
+                                '"hdf5" stores all outputs in one chunked, '
+                                'compressed HDF5 container, t2smap_outputs.h5, '
+                                'from which slices can be read without '
+                                'loading whole images (requires h5py). '
+                                'Default is "nifti".'),
+                          default='nifti')
+    optional.add_argument('--output-precision',
+                          dest='output_precision',
+                          choices=['float64', 'float32', 'int16'],
+                          help=('Data type of floating-point output images. '
+                                '"float32" halves their size. "int16" '
+                                'quarters it, storing integers scaled to the '
+                                'range of each image. With --debug, the '
+                                'rounding error of each image is logged. '
+                                'Default is "float64".'),
+                          default='float64')
     optional.add_argument('--debug',
                           dest='debug',
                           help=argparse.SUPPRESS,
@@ -104,7 +164,10 @@ def _get_parser():
 
 
 def t2smap_workflow(data, tes, mask=None, fitmode='all', combmode='t2s',
-                    label=None, debug=False, fittype='loglin', quiet=False):
+                    label=None, debug=False, fittype='loglin', quiet=False,
+                    n_jobs=1, max_memory=None, window_size=10,
+                    output_compression='default', output_format='nifti',
+                    output_precision='float64'):
     """
     Estimate T2 and S0, and optimally combine data across TEs.
 
@@ -118,10 +181,12 @@ def t2smap_workflow(data, tes, mask=None, fitmode='all', combmode='t2s',
     mask : :obj:`str`, optional
         Binary mask of voxels to include in TE Dependent ANAlysis. Must be spatially
         aligned with `data`.
-    fitmode : {'all', 'ts'}, optional
+    fitmode : {'all', 'ts', 'window'}, optional
         Monoexponential model fitting scheme.
         'all' means that the model is fit, per voxel, across all timepoints.
         'ts' means that the model is fit, per voxel and per timepoint.
+        'window' means that the model is fit, per voxel and per timepoint,
+        across the `window_size` timepoints centered on each timepoint.
         Default is 'all'.
     combmode : {'t2s', 'paid'}, optional
         Combination scheme for TEs: 't2s' (Posse 1999, default), 'paid' (Poser).
@@ -133,6 +198,29 @@ def t2smap_workflow(data, tes, mask=None, fitmode='all', combmode='t2s',
         the data.
         'curvefit' means to use a monoexponential fit to the raw data,
         which is slightly slower but may be more accurate.
+    n_jobs : :obj:`int`, optional
+        Number of worker processes used to fit voxels when `fittype` is
+        'curvefit', and of threads compressing gzipped outputs. -1 uses all
+        available CPUs. Default is 1.
+    max_memory : :obj:`float` or None, optional
+        Approximate memory budget, in gigabytes, for the temporary arrays of
+        the T2*/S0 fit and the optimal combination. If provided, voxels are
+        fit in chunks that fit in this budget, and the optimally combined
+        time series is computed and written in blocks of volumes read from
+        `data`, after the loaded data are released. Default is None.
+    window_size : :obj:`int`, optional
+        Number of timepoints in each window when `fitmode` is 'window'.
+        Default is 10.
+    output_compression : {'default', 'fast', 'max', 'none'}, optional
+        Compression of the output images: gzip levels 6, 1 and 9, or 'none'
+        for uncompressed ``.nii`` images. Default is 'default'.
+    output_format : {'nifti', 'hdf5'}, optional
+        Format of the outputs: separate NIFTI images and text files, or one
+        chunked HDF5 container, ``t2smap_outputs.h5``, in the output
+        directory (requires h5py). Default is 'nifti'.
+    output_precision : {'float64', 'float32', 'int16'}, optional
+        Data type of floating-point output images. 'int16' images are scaled
+        to the range of each image. Default is 'float64'.
 
     Other Parameters
     ----------------
@@ -156,7 +244,7 @@ def t2smap_workflow(data, tes, mask=None, fitmode='all', combmode='t2s',
     ======================    =================================================
     t2sv.nii                  Limited estimated T2* 3D map or 4D timeseries.
                               Will be a 3D map if ``fitmode`` is 'all' and a
-                              4D timeseries if it is 'ts'.
+                              4D timeseries if it is 'ts' or 'window'.
     s0v.nii                   Limited S0 3D map or 4D timeseries.
     t2svG.nii                 Full T2* map/timeseries. The difference between
                               the limited and full maps is that, for voxels
@@ -164,9 +252,32 @@ def t2smap_workflow(data, tes, mask=None, fitmode='all', combmode='t2s',
                               good data, the full map uses the single echo's
                               value while the limited map has a NaN.
     s0vG.nii                  Full S0 map/timeseries.
+    t2svSE.nii                Standard error of the full T2* map. Only
+                              written if ``fitmode`` is 'all'.
+    s0vSE.nii                 Standard error of the full S0 map. Only written
+                              if ``fitmode`` is 'all'.
+    rsqv.nii                  R-squared of the decay fit for each voxel. Only
+                              written if ``fitmode`` is 'all'.
     ts_OC.nii                 Optimally combined timeseries.
     ======================    =================================================
     """
+    # queued writes are flushed and the output settings restored even if
+    # the workflow fails
+    with io.output_session(compression=output_compression,
+                           precision=output_precision, report=debug,
+                           n_jobs=n_jobs):
+        _t2smap_workflow(data, tes, mask=mask, fitmode=fitmode,
+                         combmode=combmode, label=label, fittype=fittype,
+                         n_jobs=n_jobs, max_memory=max_memory,
+                         window_size=window_size,
+                         output_format=output_format)
+
+
+def _t2smap_workflow(data, tes, mask, fitmode, combmode, label, fittype,
+                     n_jobs, max_memory, window_size, output_format):
+    """
+    Run :func:`t2smap_workflow` in the output session it sets up
+    """
     # ensure tes are in appropriate format
     tes = [float(te) for te in tes]
     n_echos = len(tes)
@@ -184,6 +295,8 @@ def t2smap_workflow(data, tes, mask=None, fitmode='all', combmode='t2s',
         ref_label = op.basename(ref_img).split('.')[0]
     except (TypeError, AttributeError):
         ref_label = op.basename(str(data[0])).split('.')[0]
+    # all outputs are built from the geometry of the reference image
+    ref_img = io.ReferenceGeometry(ref_img)
 
     if label is not None:
         out_dir = 'TED.{0}.{1}'.format(ref_label, label)
@@ -196,6 +309,12 @@ def t2smap_workflow(data, tes, mask=None, fitmode='all', combmode='t2s',
     else:
         LGR.info('Using output directory: {}'.format(out_dir))
 
+    if output_format not in io.OUTPUT_FORMATS:
+        raise ValueError('Output format must be one of {0}, not '
+                         '{1}'.format(io.OUTPUT_FORMATS, output_format))
+    if output_format == 'hdf5':
+        io.open_container(op.join(out_dir, 't2smap_outputs.h5'))
+
     if mask is None:
         LGR.info('Computing adaptive mask')
     else:
@@ -206,12 +325,23 @@ def t2smap_workflow(data, tes, mask=None, fitmode='all', combmode='t2s',
     if fitmode == 'all':
         (t2s_limited, s0_limited,
          t2ss, s0s,
-         t2s_full, s0_full) = decay.fit_decay(catd, tes, mask, masksum,
-                                              fittype)
+         t2s_full, s0_full,
+         t2s_se, s0_se, rsquared) = decay.fit_decay(catd, tes, mask, masksum,
+                                                    fittype, n_jobs=n_jobs,
+                                                    verbose=False,
+                                                    max_memory=max_memory,
+                                                    getstats=True)
+    elif fitmode == 'window':
+        (t2s_limited, s0_limited,
+         t2s_full, s0_full) = decay.fit_decay_window(catd, tes, mask, masksum,
+                                                     fittype, window_size,
+                                                     n_jobs=n_jobs,
+                                                     max_memory=max_memory)
     else:
         (t2s_limited, s0_limited,
          t2s_full, s0_full) = decay.fit_decay_ts(catd, tes, mask, masksum,
-                                                 fittype)
+                                                 fittype, n_jobs=n_jobs,
+                                                 max_memory=max_memory)
 
     # set a hard cap for the T2* map/timeseries
     # anything that is 10x higher than the 99.5 %ile will be reset to 99.5 %ile
@@ -221,12 +351,21 @@ def t2smap_workflow(data, tes, mask=None, fitmode='all', combmode='t2s',
     t2s_limited[t2s_limited > cap_t2s * 10] = cap_t2s
 
     LGR.info('Computing optimal combination')
-    # optimally combine data
-    OCcatd = combine.make_optcom(catd, tes, mask, t2s=t2s_full,
-                                 combmode=combmode)
+    if max_memory is None:
+        # optimally combine data
+        OCcatd = combine.make_optcom(catd, tes, mask, t2s=t2s_full,
+                                     combmode=combmode)
+        np.nan_to_num(OCcatd, copy=False)
+    else:
+        # stream the combination from the input files, so the multi-echo data
+        # and the combined data are never in memory together
+        del catd
+        combine.write_optcom(data, tes, mask, op.join(out_dir, 'ts_OC.nii'),
+                             ref_img, t2s=t2s_full, combmode=combmode,
+                             max_memory=max_memory)
 
     # clean up numerical errors
-    for arr in (OCcatd, s0_limited, t2s_limited):
+    for arr in (s0_limited, t2s_limited):
         np.nan_to_num(arr, copy=False)
 
     s0_limited[s0_limited < 0] = 0
@@ -236,7 +375,15 @@ def t2smap_workflow(data, tes, mask=None, fitmode='all', combmode='t2s',
     io.filewrite(s0_limited, op.join(out_dir, 's0v.nii'), ref_img)
     io.filewrite(t2s_full, op.join(out_dir, 't2svG.nii'), ref_img)
     io.filewrite(s0_full, op.join(out_dir, 's0vG.nii'), ref_img)
-    io.filewrite(OCcatd, op.join(out_dir, 'ts_OC.nii'), ref_img)
+    if fitmode == 'all':
+        io.filewrite(t2s_se, op.join(out_dir, 't2svSE.nii'), ref_img)
+        io.filewrite(s0_se, op.join(out_dir, 's0vSE.nii'), ref_img)
+        io.filewrite(rsquared, op.join(out_dir, 'rsqv.nii'), ref_img)
+    if max_memory is None:
+        io.filewrite(OCcatd, op.join(out_dir, 'ts_OC.nii'), ref_img,
+                     copy=False)
+    io.flush_writes()
+    io.close_container()
 
 
 def _main(argv=None):
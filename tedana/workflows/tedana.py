@@ -24,7 +24,7 @@ from nilearn.masking import compute_epi_mask
 from tedana import (decay, combine, decomposition, io, metrics, selection, utils,
                     viz)
 import tedana.gscontrol as gsc
-from tedana.workflows.parser_utils import is_valid_file, ContextFilter
+from tedana.workflows.parser_utils import is_valid_file, is_valid_n_jobs, ContextFilter
 
 LGR = logging.getLogger(__name__)
 RepLGR = logging.getLogger('REPORT')
@@ -192,6 +192,47 @@ def _get_parser():
                                'demanding monoexponential model is fit '
                                'to the raw data',
                           default='loglin')
+    optional.add_argument('--n-jobs',
+                          dest='n_jobs',
+                          type=lambda x: is_valid_n_jobs(parser, x),
+                          help=('Number of worker processes used to fit '
+                                'voxels with "curvefit" and to cluster '
+                                'component maps, and of threads compressing '
+                                'outputs. Negative values count back from '
+                                'the number of available CPUs, so -1 uses '
+                                'all of them. Default is 1.'),
+                          default=1)
+    optional.add_argument('--output-compression',
+                          dest='output_compression',
+                          choices=['none', 'fast', 'default', 'max'],
+                          help=('Compression of the output images. "fast", '
+                                '"default" and "max" write gzipped images, '
+                                'compressed in parallel by --n-jobs '
+                                'threads. "none" writes uncompressed images, '
+                                'which is fastest but uses the most disk '
+                                'space. Default is "default".'),
+                          default='default')
+    optional.add_argument('--output-format',
+                          dest='output_format',
+                          choices=['nifti', 'hdf5'],
+                          help=('Format of the outputs. "nifti" writes '
+                                'separate NIFTI images and text files. '
+                                '"hdf5" stores all outputs in one chunked, '
+                                'compressed HDF5 container, tedana_outputs.h5, '
+                                'from which slices can be read without '
+                                'loading whole images (requires h5py). '
+                                'Default is "nifti".'),
+                          default='nifti')
+    optional.add_argument('--output-precision',
+                          dest='output_precision',
+                          choices=['float64', 'float32', 'int16'],
+                          help=('Data type of floating-point output images. '
+                                '"float32" halves their size. "int16" '
+                                'quarters it, storing integers scaled to the '
+                                'range of each image. With --debug, the '
+                                'rounding error of each image is logged. '
+                                'Default is "float64".'),
+                          default='float64')
     optional.add_argument('--debug',
                           dest='debug',
                           action='store_true',
@@ -215,7 +256,9 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
                     out_dir='.', fixed_seed=42, maxit=500, maxrestart=10,
                     debug=False, quiet=False, no_png=False,
                     png_cmap='coolwarm',
-                    low_mem=False, fittype='loglin'):
+                    low_mem=False, fittype='loglin', n_jobs=1,
+                    output_compression='default', output_format='nifti',
+                    output_precision='float64'):
     """
     Run the "canonical" TE-Dependent ANAlysis workflow.
 
@@ -260,6 +303,20 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
         the data.
         'curvefit' means to use a monoexponential fit to the raw data,
         which is slightly slower but may be more accurate.
+    n_jobs : :obj:`int`, optional
+        Number of worker processes used to fit voxels when `fittype` is
+        'curvefit' and to cluster component maps, and of threads compressing
+        gzipped outputs. -1 uses all available CPUs. Default is 1.
+    output_compression : {'default', 'fast', 'max', 'none'}, optional
+        Compression of the output images: gzip levels 6, 1 and 9, or 'none'
+        for uncompressed ``.nii`` images. Default is 'default'.
+    output_format : {'nifti', 'hdf5'}, optional
+        Format of the outputs: separate NIFTI images and text files, or one
+        chunked HDF5 container, ``tedana_outputs.h5``, in the output
+        directory (requires h5py). Default is 'nifti'.
+    output_precision : {'float64', 'float32', 'int16'}, optional
+        Data type of floating-point output images. 'int16' images are scaled
+        to the range of each image. Default is 'float64'.
     verbose : :obj:`bool`, optional
         Generate intermediate and additional files. Default is False.
     no_png : obj:'bool', optional
@@ -297,6 +354,31 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
     generated by this workflow, please visit
     https://tedana.readthedocs.io/en/latest/outputs.html
     """
+    # queued writes are flushed and the output settings restored even if
+    # the workflow fails
+    with io.output_session(compression=output_compression,
+                           precision=output_precision, report=debug,
+                           n_jobs=n_jobs):
+        _tedana_workflow(data, tes, mask=mask, mixm=mixm, ctab=ctab,
+                         manacc=manacc, tedort=tedort, gscontrol=gscontrol,
+                         tedpca=tedpca, source_tes=source_tes,
+                         combmode=combmode, verbose=verbose,
+                         stabilize=stabilize, out_dir=out_dir,
+                         fixed_seed=fixed_seed, maxit=maxit,
+                         maxrestart=maxrestart, debug=debug, quiet=quiet,
+                         no_png=no_png, png_cmap=png_cmap, low_mem=low_mem,
+                         fittype=fittype, n_jobs=n_jobs,
+                         output_format=output_format)
+
+
+def _tedana_workflow(data, tes, mask, mixm, ctab, manacc, tedort, gscontrol,
+                     tedpca, source_tes, combmode, verbose, stabilize,
+                     out_dir, fixed_seed, maxit, maxrestart, debug, quiet,
+                     no_png, png_cmap, low_mem, fittype, n_jobs,
+                     output_format):
+    """
+    Run :func:`tedana_workflow` in the output session it sets up
+    """
     out_dir = op.abspath(out_dir)
     if not op.isdir(out_dir):
         os.mkdir(out_dir)
@@ -357,6 +439,12 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
 
     LGR.info('Using output directory: {}'.format(out_dir))
 
+    if output_format not in io.OUTPUT_FORMATS:
+        raise ValueError('Output format must be one of {0}, not '
+                         '{1}'.format(io.OUTPUT_FORMATS, output_format))
+    if output_format == 'hdf5':
+        io.open_container(op.join(out_dir, 'tedana_outputs.h5'))
+
     # ensure tes are in appropriate format
     tes = [float(te) for te in tes]
     n_echos = len(tes)
@@ -373,6 +461,8 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
 
     LGR.info('Loading input data: {}'.format([f for f in data]))
     catd, ref_img = io.load_data(data, n_echos=n_echos)
+    # all outputs are built from the geometry of the reference image
+    ref_img = io.ReferenceGeometry(ref_img)
     n_samp, n_echos, n_vols = catd.shape
     LGR.debug('Resulting data shape: {}'.format(catd.shape))
 
@@ -439,10 +529,16 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
     if verbose:
         io.filewrite(masksum, op.join(out_dir, 'adaptive_mask.nii'), ref_img)
 
+    # only keep the samples within the mask from here on; they are unmasked
+    # when written to disk
+    catd = utils.MaskedData.from_full(catd, mask, ref_img=ref_img)
+
     os.chdir(out_dir)
 
     LGR.info('Computing T2* map')
-    t2s, s0, t2ss, s0s, t2sG, s0G = decay.fit_decay(catd, tes, mask, masksum, fittype)
+    t2s, s0, t2ss, s0s, t2sG, s0G = decay.fit_decay(catd, tes, mask, masksum,
+                                                    fittype, n_jobs=n_jobs,
+                                                    verbose=verbose)
 
     # set a hard cap for the T2* map
     # anything that is 10x higher than the 99.5 %ile will be reset to 99.5 %ile
@@ -481,7 +577,8 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
 
         if verbose and (source_tes == -1):
             io.filewrite(utils.unmask(dd, mask),
-                         op.join(out_dir, 'ts_OC_whitened.nii'), ref_img)
+                         op.join(out_dir, 'ts_OC_whitened.nii'), ref_img,
+                         copy=False)
 
         LGR.info('Making second component selection guess from ICA results')
         # Estimate betas and compute selection metrics for mixing matrix
@@ -490,8 +587,8 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
         comptable, metric_maps, betas, mmix = metrics.dependence_metrics(
                     catd, data_oc, mmix_orig, t2s, tes,
                     ref_img, reindex=True, label='meica_', out_dir=out_dir,
-                    algorithm='kundu_v2', verbose=verbose)
-        np.savetxt(op.join(out_dir, 'meica_mix.1D'), mmix)
+                    algorithm='kundu_v2', verbose=verbose, n_jobs=n_jobs)
+        io.write_matrix(mmix, op.join(out_dir, 'meica_mix.1D'))
 
         comptable = metrics.kundu_metrics(comptable, metric_maps)
         comptable = selection.kundu_selection_v2(comptable, n_echos, n_vols)
@@ -501,7 +598,7 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
         comptable, metric_maps, betas, mmix = metrics.dependence_metrics(
                     catd, data_oc, mmix_orig, t2s, tes,
                     ref_img, label='meica_', out_dir=out_dir,
-                    algorithm='kundu_v2', verbose=verbose)
+                    algorithm='kundu_v2', verbose=verbose, n_jobs=n_jobs)
         if ctab is None:
             comptable = metrics.kundu_metrics(comptable, metric_maps)
             comptable = selection.kundu_selection_v2(comptable, n_echos, n_vols)
@@ -509,8 +606,7 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
             comptable = pd.read_csv(ctab, sep='\t', index_col='component')
             comptable = selection.manual_selection(comptable, acc=manacc)
 
-    comptable.to_csv(op.join(out_dir, 'comp_table_ica.tsv'), sep='\t',
-                     index=True, index_label='component', float_format='%.6f')
+    io.write_table(comptable, op.join(out_dir, 'comp_table_ica.tsv'))
 
     if comptable[comptable.classification == 'accepted'].shape[0] == 0:
         LGR.warning('No BOLD components detected! Please check data and '
@@ -528,7 +624,7 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
         pred_rej_ts = np.dot(acc_ts, betas)
         resid = rej_ts - pred_rej_ts
         mmix[:, rej_idx] = resid
-        np.savetxt(op.join(out_dir, 'meica_mix_orth.1D'), mmix)
+        io.write_matrix(mmix, op.join(out_dir, 'meica_mix_orth.1D'))
         RepLGR.info("Rejected components' time series were then "
                     "orthogonalized with respect to accepted components' time "
                     "series.")
@@ -562,6 +658,8 @@ def tedana_workflow(data, tes, mask=None, mixm=None, ctab=None, manacc=None,
         viz.write_summary_fig(comptable=comptable,
                               out_dir=op.join(out_dir, 'figures'))
 
+    io.flush_writes()
+    io.close_container()
     LGR.info('Workflow completed')
 
     RepLGR.info("This workflow used numpy (Van Der Walt, Colbert, & "